@@ -0,0 +1,24 @@
+"""
+The command line of the package, run from the root of the project:
+    python -m speech2speech batch <directory of WAV files> --target-lang en
+
+The web app itself is started with 'streamlit run speech2speech.py'.
+"""
+import os
+import sys
+
+# the modules of the package import each other by their plain names, as
+# they do when the app is run from this directory
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+
+def main() -> None:
+    if sys.argv[1:2] != ["batch"]:
+        sys.exit("usage: python -m speech2speech batch [-h] source "
+                 "--target-lang TARGET_LANG ...")
+    import batch
+    batch.main(sys.argv[2:])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,356 @@
+"""
+Keeps the output of each stage in memory so the next stage can use it
+directly, while a background thread writes it to the file configured in
+config.ini.
+"""
+import os
+import queue
+import shutil
+import threading
+import time
+from typing import Collection, Dict, List, Optional, Tuple
+
+# the config entries of the files written by the stages
+ARTIFACTS = ("source_lang_audio_filename", "transcript_filename",
+             "translation_filename", "target_lang_audio_filename")
+
+# the sessions directory is pruned at most this often per process
+PRUNE_INTERVAL_SECONDS = 600
+
+
+class BackgroundWriter:
+    """
+    Writes files from a daemon thread. If a file is written again before
+    the previous write is done, only the latest content is written.
+    """
+
+    def __init__(self):
+        self._pending: Dict[str, bytes] = {}
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._queue: queue.Queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, daemon=True,
+                                        name="background-writer")
+        self._thread.start()
+
+    def write(self, filename: str, data: bytes) -> None:
+        """
+        Schedules a write and returns at once.
+
+        Args:
+            filename (str): The path of the file.
+            data (bytes): The new content of the file.
+        """
+        with self._lock:
+            queued = filename in self._pending
+            self._pending[filename] = data
+        if not queued:
+            self._queue.put(filename)
+
+    def is_pending(self, filename: str) -> bool:
+        with self._lock:
+            return filename in self._pending
+
+    def flush(self, timeout: float = None) -> bool:
+        """
+        Waits until every scheduled write is done.
+
+        Args:
+            timeout (float): The maximum number of seconds to wait.
+
+        Returns:
+            bool: True if all writes are done, False on timeout.
+        """
+        with self._idle:
+            return self._idle.wait_for(lambda: not self._pending, timeout)
+
+    def _run(self) -> None:
+        while True:
+            filename = self._queue.get()
+            with self._lock:
+                data = self._pending.get(filename)
+            try:
+                directory = os.path.dirname(filename)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                # write to a temporary file first, so that readers never
+                # see a partly written file
+                tmp_filename = f"{filename}.tmp"
+                with open(tmp_filename, "wb") as f:
+                    f.write(data)
+                os.replace(tmp_filename, filename)
+            except Exception as e:
+                print(f"Error writing {filename}: {e}")
+            with self._idle:
+                # keep the file pending if it was changed during the write
+                if self._pending.get(filename) is data:
+                    del self._pending[filename]
+                else:
+                    self._queue.put(filename)
+                self._idle.notify_all()
+
+
+_writer: Optional[BackgroundWriter] = None
+_writer_lock = threading.Lock()
+
+
+def get_writer() -> BackgroundWriter:
+    """
+    Returns:
+        BackgroundWriter: The writer shared by the whole process.
+    """
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = BackgroundWriter()
+        return _writer
+
+
+def _usage(directory: str) -> Tuple[float, int]:
+    # the time the directory or a file in it was last written to, and the
+    # size of its files
+    last_write = os.stat(directory).st_mtime
+    size = 0
+    for root, _, files in os.walk(directory):
+        for name in files:
+            try:
+                stat = os.stat(os.path.join(root, name))
+            except OSError:
+                continue
+            last_write = max(last_write, stat.st_mtime)
+            size += stat.st_size
+    return last_write, size
+
+
+def prune_sessions(sessions_dir: str, max_age_hours: float,
+                   max_bytes: int, keep: Collection[str] = ()) -> List[str]:
+    """
+    Deletes the directories of the sessions no one has written to for
+    max_age_hours, then those written to longest ago until the others take
+    at most max_bytes.
+
+    Args:
+        sessions_dir (str): The directory of the session directories.
+        max_age_hours (float): The age of the sessions deleted, or 0 to
+            keep them whatever their age.
+        max_bytes (int): The largest size of all session directories, or 0
+            for no limit.
+        keep (Collection[str]): The names of the session directories never
+            deleted, such as that of the current session.
+
+    Returns:
+        List[str]: The paths of the deleted directories.
+    """
+    sessions = []
+    try:
+        entries = list(os.scandir(sessions_dir))
+    except OSError:
+        return []
+    for entry in entries:
+        if not entry.is_dir(follow_symlinks=False) or entry.name in keep:
+            continue
+        try:
+            last_write, size = _usage(entry.path)
+        except OSError:
+            continue
+        sessions.append((last_write, size, entry.path))
+    # the least recently written first
+    sessions.sort()
+    total = sum(size for _, size, _ in sessions)
+    now = time.time()
+    deleted = []
+    for last_write, size, path in sessions:
+        too_old = max_age_hours and now - last_write > max_age_hours * 3600
+        too_big = max_bytes and total > max_bytes
+        if not (too_old or too_big):
+            continue
+        shutil.rmtree(path, ignore_errors=True)
+        total -= size
+        deleted.append(path)
+    return deleted
+
+
+_last_prune = 0.0
+_prune_lock = threading.Lock()
+
+
+def schedule_prune(sessions_dir: str, max_age_hours: float, max_bytes: int,
+                   keep: Collection[str] = ()) -> bool:
+    """
+    Runs prune_sessions() in a daemon thread, unless it already ran in the
+    last PRUNE_INTERVAL_SECONDS.
+
+    Args:
+        sessions_dir (str): The directory of the session directories.
+        max_age_hours (float): The age of the sessions deleted, or 0.
+        max_bytes (int): The largest size of all session directories, or 0.
+        keep (Collection[str]): The names of the session directories never
+            deleted.
+
+    Returns:
+        bool: Whether pruning was started.
+    """
+    global _last_prune
+    if not (max_age_hours or max_bytes):
+        return False
+    with _prune_lock:
+        now = time.monotonic()
+        if _last_prune and now - _last_prune < PRUNE_INTERVAL_SECONDS:
+            return False
+        _last_prune = now
+
+    def prune() -> None:
+        deleted = prune_sessions(sessions_dir, max_age_hours, max_bytes,
+                                 keep)
+        if deleted:
+            print(f"Deleted {len(deleted)} old session directories from "
+                  f"{sessions_dir}")
+
+    threading.Thread(target=prune, daemon=True,
+                     name="session-pruner").start()
+    return True
+
+
+class ArtifactStore:
+    """
+    The audio, transcript, translation and speech of one session, kept in
+    memory and named after their entries in config.ini.
+
+    Every artifact put in the store is also written to its file in the
+    background when persist is on. With a session directory, the files are
+    written there under the name of their configured file, so that sessions
+    do not overwrite each other's files. An artifact that is not in memory,
+    or whose file was changed by someone else since, is read from its file,
+    or else from its configured file, so users can still start the workflow
+    from their own files.
+    """
+
+    def __init__(self, persist: bool = True, directory: str = None):
+        """
+        Args:
+            persist (bool): Whether artifacts are written to their files.
+            directory (str): The directory of the session's files, or None
+                to use the configured files.
+        """
+        self.persist = persist
+        self.directory = directory
+        self.filenames: Dict[str, str] = {}
+        # the content of each artifact, the file it was written to or read
+        # from, and the modification time of that file when the content was
+        # last known to match it; the content is None for artifacts only
+        # kept on disk
+        self._items: Dict[str, Tuple[Optional[bytes], str,
+                                     Optional[int]]] = {}
+        self._writer = get_writer()
+
+    def path(self, name: str) -> str:
+        """
+        Args:
+            name (str): The config entry of the artifact, such as
+                transcript_filename.
+
+        Returns:
+            str: The file the artifact is written to.
+        """
+        filename = self.filenames[name]
+        if self.directory is None:
+            return filename
+        return os.path.join(self.directory, os.path.basename(filename))
+
+    def put(self, name: str, data: bytes) -> None:
+        """
+        Args:
+            name (str): The config entry of the artifact, such as
+                transcript_filename.
+            data (bytes): The content of the artifact.
+        """
+        filename = self.path(name)
+        if self.persist:
+            self._items[name] = (data, filename, None)
+            self._writer.write(filename, data)
+        else:
+            self._items[name] = (data, filename, self._mtime(filename))
+
+    def put_text(self, name: str, text: str) -> None:
+        self.put(name, text.encode("utf-8"))
+
+    def put_file(self, name: str, filename: str) -> None:
+        """
+        Adds an artifact that was written straight to its file, such as a
+        spooled recording, without keeping its content in memory.
+
+        Args:
+            name (str): The config entry of the artifact.
+            filename (str): The file holding the artifact.
+        """
+        self._items[name] = (None, filename, self._mtime(filename))
+
+    def file(self, name: str) -> Optional[str]:
+        """
+        Args:
+            name (str): The config entry of the artifact.
+
+        Returns:
+            Optional[str]: The file holding the artifact, if it is only kept
+            on disk, so that it can be mapped instead of read, else None.
+        """
+        item = self._items.get(name)
+        if item is not None and item[0] is not None:
+            return None
+        candidates = [item[1]] if item is not None else []
+        candidates += [self.path(name), self.filenames[name]]
+        for filename in dict.fromkeys(candidates):
+            if os.path.isfile(filename):
+                return filename
+        return None
+
+    def get(self, name: str) -> bytes:
+        """
+        Args:
+            name (str): The config entry of the artifact.
+
+        Returns:
+            bytes: The content of the artifact.
+
+        Raises:
+            FileNotFoundError: If the artifact is neither in memory nor in
+                its files.
+        """
+        item = self._items.get(name)
+        if item is not None and item[0] is None:
+            data, filename, mtime = item
+            if mtime is not None and self._mtime(filename) == mtime:
+                # read the file each time, so that it is not kept in memory
+                with open(filename, "rb") as f:
+                    return f.read()
+        elif item is not None:
+            data, filename, mtime = item
+            if self._writer.is_pending(filename):
+                return data
+            current_mtime = self._mtime(filename)
+            if mtime is None:
+                # the background write is done, remember its result
+                self._items[name] = (data, filename, current_mtime)
+                return data
+            if current_mtime == mtime:
+                return data
+        for filename in dict.fromkeys((self.path(name), self.filenames[name])):
+            try:
+                with open(filename, "rb") as f:
+                    data = f.read()
+            except OSError:
+                continue
+            self._items[name] = (data, filename, self._mtime(filename))
+            return data
+        raise FileNotFoundError(
+            f"The {name} ({self.filenames[name]}) does not exist")
+
+    def get_text(self, name: str) -> str:
+        return self.get(name).decode("utf-8")
+
+    @staticmethod
+    def _mtime(filename: str) -> Optional[int]:
+        try:
+            return os.stat(filename).st_mtime_ns
+        except OSError:
+            return None
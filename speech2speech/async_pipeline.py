@@ -0,0 +1,188 @@
+"""
+The stages of the speech-to-speech pipeline as coroutines, so that many
+requests in flight share one event loop instead of one thread each. They
+take the same steps as the functions of pipeline.py, with the same cache
+keys, upload preprocessing and translation memory, and share their caches.
+The steps that only run on the CPU or block run in worker threads.
+
+Run them inside http_pool.async_session(), so that the OpenAI requests
+share its keep-alive connections.
+"""
+import asyncio
+import time
+from typing import Callable, Dict, List, Tuple
+
+from backends import Synthesizer, Transcriber, Translator
+from cache import DiskCache
+from memory import TranslationMemory
+from metrics import record_size, span
+from pipeline import (prepare_upload, speech_key, transcription_key,
+                      translate_with_memory, translation_key)
+from segmenter import split_sentences
+
+
+async def atranscribe(audio: bytes, filename: str, cache: DiskCache,
+                      transcriber: Transcriber,
+                      preprocess: Callable[[bytes, str],
+                                           Tuple[bytes, str]] = None) -> str:
+    """
+    Transcribes audio unless the transcript is cached.
+
+    Args:
+        audio (bytes): The content of the audio file.
+        filename (str): The name of the audio file, whose extension tells
+            its format.
+        cache (DiskCache): The transcription cache.
+        transcriber (Transcriber): The speech-to-text backend.
+        preprocess (Callable[[bytes, str], Tuple[bytes, str]]): The function
+            made by pipeline.upload_preprocessor(), or None to send the
+            audio as it is.
+
+    Returns:
+        str: The transcribed text.
+    """
+    with span("transcribe"):
+        key = transcription_key(audio, transcriber)
+        cached = cache.get(key)
+        if cached is not None:
+            return cached.decode("utf-8")
+        if preprocess is not None:
+            audio, filename = await asyncio.to_thread(
+                prepare_upload, audio, filename, preprocess)
+        record_size("transcription_request", len(audio))
+        text = await transcriber.atranscribe(audio, filename)
+        cache.set(key, text.encode("utf-8"))
+        record_size("transcript", len(text.encode("utf-8")))
+        return text
+
+
+async def arequest_translation(text: str, target_lang: str, cache: DiskCache,
+                               translator: Translator,
+                               memory: TranslationMemory = None) -> str:
+    """
+    Translates text unless the translation is cached.
+
+    Args:
+        text (str): The text to be translated.
+        target_lang (str): The language to translate to.
+        cache (DiskCache): The translation cache.
+        translator (Translator): The translation backend.
+        memory (TranslationMemory): The translation memory the sentences of
+            text are looked up in, or None to send the whole text.
+
+    Returns:
+        str: The translated text.
+    """
+    with span("translate"):
+        key = translation_key(text, target_lang, translator)
+        cached = cache.get(key)
+        if cached is not None:
+            return cached.decode("utf-8")
+        if memory is not None and split_sentences(text):
+            # the memory is looked up and sent with blocking calls
+            translation = await asyncio.to_thread(
+                translate_with_memory, text, target_lang, translator, memory)
+        else:
+            record_size("translation_request", len(text.encode("utf-8")))
+            translation = await translator.atranslate(text, target_lang)
+        cache.set(key, translation.encode("utf-8"))
+        record_size("translation", len(translation.encode("utf-8")))
+        return translation
+
+
+async def atranslate_to_many(text: str, target_langs: List[str],
+                             cache: DiskCache, translator: Translator,
+                             max_concurrency: int,
+                             memory: TranslationMemory = None
+                             ) -> Dict[str, Tuple[str, float]]:
+    """
+    Translates text into several languages at once, with one request per
+    language in flight on the event loop.
+
+    Args:
+        text (str): The text to be translated.
+        target_langs (List[str]): The languages to translate to.
+        cache (DiskCache): The translation cache.
+        translator (Translator): The translation backend.
+        max_concurrency (int): The largest number of requests in flight.
+        memory (TranslationMemory): The translation memory, or None.
+
+    Returns:
+        Dict[str, Tuple[str, float]]: The translation and the latency in
+        seconds of each language. A failed language has an empty
+        translation.
+    """
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def translate_one(target_lang: str) -> Tuple[str, float]:
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                translation = await arequest_translation(
+                    text, target_lang, cache, translator, memory)
+            except Exception as e:
+                print(f"Error translating into {target_lang}: {e}")
+                translation = ""
+            return translation, time.perf_counter() - start
+
+    # every task runs in a copy of the caller's context, so that its spans
+    # are added to the caller's metrics run
+    results = await asyncio.gather(*(translate_one(target_lang)
+                                     for target_lang in target_langs))
+    return dict(zip(target_langs, results))
+
+
+async def asynthesize_sentence(sentence: str, lang: str, cache: DiskCache,
+                               synthesizer: Synthesizer,
+                               slow: bool = False) -> bytes:
+    """
+    Converts one sentence to MP3 speech unless its speech is cached.
+
+    Args:
+        sentence (str): The sentence to be read.
+        lang (str): The language of the sentence.
+        cache (DiskCache): The cache of synthesized sentences.
+        synthesizer (Synthesizer): The text-to-speech backend.
+        slow (bool): Whether the sentence is read slowly.
+
+    Returns:
+        bytes: The MP3 audio of the sentence.
+    """
+    key = speech_key(sentence, lang, slow, synthesizer)
+    segment = cache.get(key)
+    if segment is None:
+        with span("synthesize"):
+            segment = await synthesizer.asynthesize(sentence, lang, slow)
+        record_size("speech", len(segment))
+        cache.set(key, segment)
+    return segment
+
+
+async def asynthesize_speech(text: str, lang: str, cache: DiskCache,
+                             synthesizer: Synthesizer, slow: bool = False,
+                             max_concurrency: int = 1) -> bytes:
+    """
+    Converts text to MP3 speech, synthesizing its sentences concurrently.
+
+    Args:
+        text (str): The text to be read.
+        lang (str): The language of the text.
+        cache (DiskCache): The cache of synthesized sentences.
+        synthesizer (Synthesizer): The text-to-speech backend.
+        slow (bool): Whether the text is read slowly.
+        max_concurrency (int): The largest number of sentences synthesized
+            at the same time.
+
+    Returns:
+        bytes: The MP3 audio of the whole text.
+    """
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def synthesize_one(sentence: str) -> bytes:
+        async with semaphore:
+            return await asynthesize_sentence(sentence, lang, cache,
+                                              synthesizer, slow)
+
+    segments = await asyncio.gather(*(synthesize_one(sentence)
+                                      for sentence in split_sentences(text)))
+    return b"".join(segments)
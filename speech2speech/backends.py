@@ -0,0 +1,626 @@
+"""
+The services behind the transcribe, translate and synthesize stages.
+
+Each stage talks to a backend through a small protocol, and the backend is
+chosen in the [backends] section of config.ini. Besides the remote services,
+there are deterministic stub backends that answer locally after a
+configurable delay, to measure the app's own overhead without a network.
+"""
+import asyncio
+import base64
+import hashlib
+import io
+import json
+import re
+import sys
+import time
+from typing import Any, Dict, List, Mapping, Protocol, Tuple
+
+from cache import make_key, normalize_text
+from http_pool import get_session, use_openai_session
+from scheduler import RequestScheduler, get_scheduler
+from segmenter import estimate_tokens
+
+TRANSCRIBERS = ("openai", "whisper", "stub")
+TRANSLATORS = ("openai", "stub")
+SYNTHESIZERS = ("gtts", "stub")
+
+
+class Transcriber(Protocol):
+    # identifies the backend and its settings in cache keys
+    name: str
+
+    def transcribe(self, audio: bytes, filename: str) -> str:
+        """
+        Args:
+            audio (bytes): The content of the audio file.
+            filename (str): The name of the audio file, whose extension
+                tells its format.
+
+        Returns:
+            str: The transcribed text.
+        """
+
+    async def atranscribe(self, audio: bytes, filename: str) -> str:
+        """The same as transcribe, without blocking the event loop."""
+
+
+class Translator(Protocol):
+    # identifies the backend and its settings in cache keys
+    name: str
+
+    def translate(self, text: str, target_lang: str) -> str:
+        """
+        Args:
+            text (str): The text to be translated.
+            target_lang (str): The language to translate to.
+
+        Returns:
+            str: The translated text.
+        """
+
+    async def atranslate(self, text: str, target_lang: str) -> str:
+        """The same as translate, without blocking the event loop."""
+
+    def translate_many(self, text: str,
+                       target_langs: List[str]) -> Dict[str, str]:
+        """
+        Translates text into several languages with a single request.
+
+        Args:
+            text (str): The text to be translated.
+            target_langs (List[str]): The languages to translate to.
+
+        Returns:
+            Dict[str, str]: The translation of each language that could be
+            translated.
+        """
+
+    def translate_segments(self, segments: List[str], target_lang: str,
+                           examples: List[Tuple[str, str]] = ()
+                           ) -> List[str]:
+        """
+        Translates several sentences with a single request.
+
+        Args:
+            segments (List[str]): The sentences to be translated.
+            target_lang (str): The language to translate to.
+            examples (List[Tuple[str, str]]): Similar sentences and their
+                translations, to translate consistently with them.
+
+        Returns:
+            List[str]: The translation of each sentence.
+
+        Raises:
+            ValueError: If the answer does not hold one translation per
+                sentence.
+        """
+
+
+class Synthesizer(Protocol):
+    # identifies the backend and its settings in cache keys
+    name: str
+
+    def synthesize(self, text: str, lang: str, slow: bool = False) -> bytes:
+        """
+        Args:
+            text (str): The text to be read.
+            lang (str): The language of the text.
+            slow (bool): Whether the text is read slowly.
+
+        Returns:
+            bytes: The MP3 audio of the text.
+        """
+
+    async def asynthesize(self, text: str, lang: str,
+                          slow: bool = False) -> bytes:
+        """The same as synthesize, without blocking the event loop."""
+
+
+def is_openai_error(e: Exception) -> bool:
+    """
+    Tells whether an exception was raised by the openai package, without
+    importing it if no OpenAI backend has been used.
+
+    Args:
+        e (Exception): The exception.
+
+    Returns:
+        bool: True if e is an openai.Error.
+    """
+    openai = sys.modules.get("openai")
+    return openai is not None and isinstance(e, openai.Error)
+
+
+def _account_key(api_key: str = None, api_base: str = None) -> str:
+    """
+    Identifies the account requests are sent with, so that identical
+    requests are only coalesced when they would be billed and answered
+    alike.
+
+    Args:
+        api_key (str): The OpenAI API key, or None for openai.api_key, which
+            defaults to the OPENAI_API_KEY environment variable.
+        api_base (str): The URL of the API, or None for OpenAI's.
+
+    Returns:
+        str: The hash of the API key and URL, which never holds the key in
+        the clear.
+    """
+    if api_key is None:
+        import openai
+
+        api_key = openai.api_key
+    return make_key(api_key or "", api_base or "")
+
+
+class OpenAITranscriber:
+    """Transcribes audio with OpenAI's Whisper API."""
+
+    def __init__(self, model: str = "whisper-1", api_key: str = None,
+                 scheduler: RequestScheduler = None, session=None,
+                 api_base: str = None):
+        """
+        Args:
+            model (str): The Whisper model.
+            api_key (str): The OpenAI API key, or None to use the
+                OPENAI_API_KEY environment variable.
+            scheduler (RequestScheduler): The scheduler the requests are
+                sent through, or None to send them directly.
+            session (requests.Session): The pooled session the requests
+                are sent through, or None to use openai's own.
+            api_base (str): The URL of the API, or None for OpenAI's.
+        """
+        self.model = model
+        self.api_key = api_key
+        self.scheduler = scheduler
+        self.session = session
+        self.api_base = api_base
+        self.name = model
+
+    def transcribe(self, audio: bytes, filename: str) -> str:
+        if self.scheduler is None:
+            return self._transcribe(audio, filename)
+        return self.scheduler.call(
+            make_key(_account_key(self.api_key, self.api_base), self.name,
+                     audio),
+            self._transcribe, audio, filename)
+
+    async def atranscribe(self, audio: bytes, filename: str) -> str:
+        if self.scheduler is None:
+            return await self._atranscribe(audio, filename)
+        return await self.scheduler.acall(
+            make_key(_account_key(self.api_key, self.api_base), self.name,
+                     audio),
+            self._atranscribe, audio, filename)
+
+    def _transcribe(self, audio: bytes, filename: str) -> str:
+        import openai
+
+        if self.session is not None:
+            use_openai_session(self.session)
+        transcript = openai.Audio.transcribe_raw(self.model, audio, filename,
+                                                 api_key=self.api_key,
+                                                 api_base=self.api_base)
+        return transcript["text"]
+
+    async def _atranscribe(self, audio: bytes, filename: str) -> str:
+        import openai
+
+        transcript = await openai.Audio.atranscribe_raw(
+            self.model, audio, filename, api_key=self.api_key,
+            api_base=self.api_base)
+        return transcript["text"]
+
+
+class WhisperTranscriber:
+    """
+    Transcribes audio on the CPU with a local Whisper model, shared by the
+    whole process.
+    """
+
+    def __init__(self, model_size: str = "base", threads: int = 0,
+                 batch_size: int = 8, language: str = None):
+        """
+        Args:
+            model_size (str): The Whisper model, such as tiny, base, small,
+                medium or large.
+            threads (int): The number of CPU threads, or 0 to let PyTorch
+                choose.
+            batch_size (int): The largest number of clips decoded together.
+            language (str): The language of the audio, such as en, or None
+                to detect it.
+        """
+        self.model_size = model_size
+        self.threads = threads
+        self.batch_size = batch_size
+        self.language = language
+        self.name = f"whisper-{model_size}" + (f"-{language}" if language
+                                               else "")
+
+    def _model(self):
+        # the model is only looked up, and loaded, when audio is
+        # transcribed, since the app creates its backends on every action
+        from local_whisper import get_whisper_model
+
+        return get_whisper_model(self.model_size, self.threads)
+
+    def transcribe(self, audio: bytes, filename: str) -> str:
+        return self.transcribe_batch([(audio, filename)])[0]
+
+    async def atranscribe(self, audio: bytes, filename: str) -> str:
+        from local_whisper import load_clip
+
+        clip = await asyncio.to_thread(load_clip, audio, filename)
+        return await asyncio.wrap_future(self._model().submit(
+            clip, self.language, self.batch_size))
+
+    def transcribe_batch(self, clips: List[Tuple[bytes, str]]) -> List[str]:
+        """
+        Transcribes several clips at once; clips of up to 30 seconds are
+        decoded together.
+
+        Args:
+            clips (List[Tuple[bytes, str]]): The content and the file name
+                of each audio file.
+
+        Returns:
+            List[str]: The transcript of each clip.
+        """
+        from local_whisper import load_clip
+
+        return self._model().transcribe_batch(
+            [load_clip(audio, filename) for audio, filename in clips],
+            self.language, self.batch_size)
+
+
+class OpenAITranslator:
+    """Translates text with OpenAI's GPT-3 Completion API."""
+
+    def __init__(self, engine: str = "text-davinci-003",
+                 temperature: float = 0, api_key: str = None,
+                 scheduler: RequestScheduler = None, session=None,
+                 api_base: str = None):
+        """
+        Args:
+            engine (str): The completion engine.
+            temperature (float): The sampling temperature.
+            api_key (str): The OpenAI API key, or None to use the
+                OPENAI_API_KEY environment variable.
+            scheduler (RequestScheduler): The scheduler the requests are
+                sent through, or None to send them directly.
+            session (requests.Session): The pooled session the requests
+                are sent through, or None to use openai's own.
+            api_base (str): The URL of the API, or None for OpenAI's.
+        """
+        self.engine = engine
+        self.temperature = temperature
+        self.api_key = api_key
+        self.scheduler = scheduler
+        self.session = session
+        self.api_base = api_base
+        self.name = f"{engine}@{temperature}"
+
+    def _complete(self, key: str, prompt: str, max_tokens: int) -> str:
+        if self.scheduler is None:
+            return self._create(prompt, max_tokens)
+        # requests are only coalesced with those of the same account
+        key = make_key(_account_key(self.api_key, self.api_base), key)
+        # completion limits count the prompt and the largest answer
+        return self.scheduler.call(key, self._create, prompt, max_tokens,
+                                   tokens=estimate_tokens(prompt) + max_tokens)
+
+    async def _acomplete(self, key: str, prompt: str, max_tokens: int) -> str:
+        if self.scheduler is None:
+            return await self._acreate(prompt, max_tokens)
+        key = make_key(_account_key(self.api_key, self.api_base), key)
+        return await self.scheduler.acall(
+            key, self._acreate, prompt, max_tokens,
+            tokens=estimate_tokens(prompt) + max_tokens)
+
+    def _create(self, prompt: str, max_tokens: int) -> str:
+        import openai
+
+        if self.session is not None:
+            use_openai_session(self.session)
+        response = openai.Completion.create(
+            engine=self.engine,
+            prompt=prompt,
+            max_tokens=max_tokens,
+            n=1,
+            stop=None,
+            temperature=self.temperature,
+            api_key=self.api_key,
+            api_base=self.api_base,
+        )
+        return response.choices[0].text.strip()
+
+    async def _acreate(self, prompt: str, max_tokens: int) -> str:
+        import openai
+
+        response = await openai.Completion.acreate(
+            engine=self.engine,
+            prompt=prompt,
+            max_tokens=max_tokens,
+            n=1,
+            stop=None,
+            temperature=self.temperature,
+            api_key=self.api_key,
+            api_base=self.api_base,
+        )
+        return response.choices[0].text.strip()
+
+    @staticmethod
+    def _prompt(text: str, target_lang: str) -> str:
+        return f"Please translate the following text into '{target_lang}': {text}"
+
+    def translate(self, text: str, target_lang: str) -> str:
+        return self._complete(
+            make_key(normalize_text(text), target_lang, self.name),
+            self._prompt(text, target_lang), 1024)
+
+    async def atranslate(self, text: str, target_lang: str) -> str:
+        return await self._acomplete(
+            make_key(normalize_text(text), target_lang, self.name),
+            self._prompt(text, target_lang), 1024)
+
+    def translate_many(self, text: str,
+                       target_langs: List[str]) -> Dict[str, str]:
+        answer = self._complete(
+            make_key(normalize_text(text), ",".join(target_langs), self.name),
+            f"Please translate the following text into each of "
+            f"these languages: {', '.join(target_langs)}. Answer "
+            f"with a JSON object whose keys are the language codes "
+            f"and whose values are the translations: {text}",
+            min(3000, 1024 * len(target_langs)))
+        translations = json.loads(answer)
+        return {target_lang: str(translations[target_lang]).strip()
+                for target_lang in target_langs
+                if target_lang in translations}
+
+    def translate_segments(self, segments: List[str], target_lang: str,
+                           examples: List[Tuple[str, str]] = ()
+                           ) -> List[str]:
+        sentences = json.dumps(segments, ensure_ascii=False)
+        hints = ""
+        if examples:
+            hints = (f" Translate them consistently with these earlier "
+                     f"translations of similar sentences: "
+                     f"{json.dumps(dict(examples), ensure_ascii=False)}.")
+        answer = self._complete(
+            make_key(sentences, hints, target_lang, self.name),
+            f"Please translate each sentence of the following JSON array "
+            f"into '{target_lang}'.{hints} Answer with a JSON array of the "
+            f"translations, in the same order: {sentences}",
+            min(3000, 1024 + 2 * estimate_tokens(sentences)))
+        translations = json.loads(answer)
+        if not isinstance(translations, list) \
+                or len(translations) != len(segments):
+            raise ValueError(f"Expected {len(segments)} translations, got: "
+                             f"{answer}")
+        return [str(translation).strip() for translation in translations]
+
+
+# the audio in a line of Google Translate's batchexecute response
+_GTTS_AUDIO = re.compile(r'jQ1olc","\[\\"(.*)\\"]')
+
+
+class GTTSSynthesizer:
+    """Reads text aloud with Google Translate's text-to-speech API."""
+
+    name = "gtts"
+
+    def __init__(self, session=None):
+        """
+        Args:
+            session (requests.Session): The pooled session the requests
+                are sent through, or None to let gTTS open a new one for
+                every request.
+        """
+        self.session = session
+        # whether the requests are still sent through the session
+        self._pooled = True
+
+    def synthesize(self, text: str, lang: str, slow: bool = False) -> bytes:
+        from gtts import gTTS
+
+        tts = gTTS(text=text, lang=lang, slow=slow)
+        if self.session is not None and self._pooled:
+            audio = self._send_pooled(tts)
+            if audio:
+                return audio
+            # this version of gTTS prepares or answers requests differently,
+            # so they are left to it from now on
+            print("gTTS internals changed, synthesizing without the pooled "
+                  "session")
+            self._pooled = False
+        fp = io.BytesIO()
+        tts.write_to_fp(fp)
+        return fp.getvalue()
+
+    def _send_pooled(self, tts) -> bytes:
+        """
+        Sends the requests gTTS prepares through the pooled session and
+        decodes their answers as gTTS 2.3 does. gTTS has no public way to
+        pass a session, so this uses its private _prepare_requests().
+
+        Args:
+            tts (gtts.gTTS): The text to read aloud.
+
+        Returns:
+            bytes: The MP3 audio, or b"" if gTTS has no _prepare_requests()
+            or an answer is not in the expected format.
+
+        Raises:
+            gtts.tts.gTTSError: If a request fails.
+        """
+        import urllib.request
+
+        from gtts.tts import gTTSError
+
+        try:
+            prepared = tts._prepare_requests()
+        except (AttributeError, TypeError):
+            return b""
+        fp = io.BytesIO()
+        for request in prepared:
+            response = self.session.send(
+                request, proxies=urllib.request.getproxies())
+            if not response.ok:
+                raise gTTSError(tts=tts, response=response)
+            found = False
+            for line in response.iter_lines(chunk_size=1024):
+                decoded_line = line.decode("utf-8")
+                if "jQ1olc" in decoded_line:
+                    audio_search = _GTTS_AUDIO.search(decoded_line)
+                    if not audio_search:
+                        return b""
+                    fp.write(base64.b64decode(
+                        audio_search.group(1).encode("ascii")))
+                    found = True
+            if not found:
+                return b""
+        return fp.getvalue()
+
+    async def asynthesize(self, text: str, lang: str,
+                          slow: bool = False) -> bytes:
+        # gTTS has no asynchronous client, so its requests run on a thread
+        return await asyncio.to_thread(self.synthesize, text, lang, slow)
+
+
+# a silent MPEG-1 Layer III frame: 32 kbit/s, 44.1 kHz, mono, 26 ms long
+_SILENT_MP3_FRAME = b"\xff\xfb\x10\xc0" + bytes(100)
+
+
+class StubTranscriber:
+    """
+    Returns a transcript derived from the hash of the audio after a fixed
+    delay, so the same audio always gets the same text.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.name = "stub"
+
+    def transcribe(self, audio: bytes, filename: str) -> str:
+        time.sleep(self.latency)
+        return self._transcript(audio)
+
+    async def atranscribe(self, audio: bytes, filename: str) -> str:
+        await asyncio.sleep(self.latency)
+        return self._transcript(audio)
+
+    @staticmethod
+    def _transcript(audio: bytes) -> str:
+        digest = hashlib.sha256(audio).hexdigest()[:8]
+        return f"This is recording {digest} of {len(audio)} bytes."
+
+
+class StubTranslator:
+    """
+    Returns the text tagged with the target language after a fixed delay.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.name = "stub"
+
+    def translate(self, text: str, target_lang: str) -> str:
+        time.sleep(self.latency)
+        return f"[{target_lang}] {text}"
+
+    async def atranslate(self, text: str, target_lang: str) -> str:
+        await asyncio.sleep(self.latency)
+        return f"[{target_lang}] {text}"
+
+    def translate_many(self, text: str,
+                       target_langs: List[str]) -> Dict[str, str]:
+        time.sleep(self.latency)
+        return {target_lang: f"[{target_lang}] {text}"
+                for target_lang in target_langs}
+
+    def translate_segments(self, segments: List[str], target_lang: str,
+                           examples: List[Tuple[str, str]] = ()
+                           ) -> List[str]:
+        time.sleep(self.latency)
+        return [f"[{target_lang}] {segment}" for segment in segments]
+
+
+class StubSynthesizer:
+    """
+    Returns silent MP3 audio whose length grows with the text after a fixed
+    delay.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.name = "stub"
+
+    def synthesize(self, text: str, lang: str, slow: bool = False) -> bytes:
+        time.sleep(self.latency)
+        return self._speech(text, slow)
+
+    async def asynthesize(self, text: str, lang: str,
+                          slow: bool = False) -> bytes:
+        await asyncio.sleep(self.latency)
+        return self._speech(text, slow)
+
+    @staticmethod
+    def _speech(text: str, slow: bool) -> bytes:
+        frames_per_char = 6 if slow else 3
+        return _SILENT_MP3_FRAME * max(1, len(text) * frames_per_char)
+
+
+def load_backends(settings: Mapping[str, Any]) -> Tuple[Transcriber,
+                                                        Translator,
+                                                        Synthesizer]:
+    """
+    Creates the backends chosen in the configuration.
+
+    Args:
+        settings (Mapping[str, Any]): The configuration values, such as
+            the Streamlit session state.
+
+    Returns:
+        Tuple[Transcriber, Translator, Synthesizer]: The backends of the
+        transcribe, translate and synthesize stages.
+    """
+    latency = settings["stub_latency_ms"] / 1000
+    api_key = settings.get("openai_api_key")
+    api_base = settings["openai_api_base"] or None
+    # requests is only imported if a remote backend is used
+    remote = (settings["transcriber"] == "openai"
+              or settings["translator"] == "openai"
+              or settings["synthesizer"] == "gtts")
+    session = (get_session(settings["http_pool_size"])
+               if settings["http_pool_size"] and remote else None)
+    retries = (settings["max_retries"], settings["backoff_seconds"],
+               settings["max_backoff_seconds"])
+    if settings["transcriber"] == "stub":
+        transcriber = StubTranscriber(latency)
+    elif settings["transcriber"] == "whisper":
+        transcriber = WhisperTranscriber(
+            settings["whisper_model"], settings["whisper_threads"],
+            settings["whisper_batch_size"],
+            settings["whisper_language"] or None)
+    else:
+        transcriber = OpenAITranscriber(
+            api_key=api_key,
+            scheduler=get_scheduler(
+                "transcription",
+                settings["transcription_requests_per_minute"], 0, *retries),
+            session=session, api_base=api_base)
+    if settings["translator"] == "stub":
+        translator = StubTranslator(latency)
+    else:
+        translator = OpenAITranslator(
+            api_key=api_key,
+            scheduler=get_scheduler(
+                "translation", settings["translation_requests_per_minute"],
+                settings["translation_tokens_per_minute"], *retries),
+            session=session, api_base=api_base)
+    if settings["synthesizer"] == "stub":
+        synthesizer = StubSynthesizer(latency)
+    else:
+        synthesizer = GTTSSynthesizer(session)
+    return transcriber, translator, synthesizer
@@ -0,0 +1,264 @@
+"""
+Runs the speech-to-speech pipeline without the Streamlit app over a
+directory of WAV files, or over a text file listing one WAV file per line.
+
+Usage, from the root of the project:
+    OPENAI_API_KEY=sk-... python -m speech2speech batch recordings/ \
+        --target-lang en --workers 4
+
+or, from the speech2speech directory, python batch.py with the same
+arguments.
+
+Every finished recording is appended to a JSONL manifest, so an interrupted
+run skips the recordings already done when it is started again.
+"""
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Any, Dict, List, Mapping, Optional, Set, Tuple
+
+from backends import load_backends
+from scheduler import BATCH, lane
+from pipeline import (speech_cache, synthesize_speech, transcribe_file,
+                      transcription_cache, translate_long, translation_cache,
+                      translation_memory)
+from settings import load_settings
+from spool import MappedWav
+
+# the config file of the app, next to this module
+DEFAULT_CONFIG = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                              "config.ini")
+
+
+def list_inputs(source: str) -> List[str]:
+    """
+    Args:
+        source (str): A directory of WAV files, or a text file with the path
+            of one WAV file per line, relative to the text file.
+
+    Returns:
+        List[str]: The absolute paths of the WAV files, in order.
+
+    Raises:
+        FileNotFoundError: If source does not exist.
+    """
+    if os.path.isdir(source):
+        return sorted(os.path.abspath(os.path.join(source, name))
+                      for name in os.listdir(source)
+                      if name.lower().endswith(".wav"))
+    base = os.path.dirname(os.path.abspath(source))
+    with open(source) as f:
+        return [os.path.abspath(os.path.join(base, line.strip()))
+                for line in f if line.strip()]
+
+
+def read_manifest(manifest_filename: str) -> Set[Tuple[str, str]]:
+    """
+    Args:
+        manifest_filename (str): The path of the JSONL manifest.
+
+    Returns:
+        Set[Tuple[str, str]]: The (input, target_lang) pairs already done.
+    """
+    done = set()
+    if not os.path.exists(manifest_filename):
+        return done
+    with open(manifest_filename) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # the last line may be cut short by a crash
+                continue
+            if record.get("status") == "done":
+                done.add((record["input"], record["target_lang"]))
+    return done
+
+
+def process_item(audio_filename: str, target_lang: str, output_dir: str,
+                 settings: Mapping[str, Any]) -> Dict[str, Any]:
+    """
+    Transcribes, translates and synthesizes one recording. It runs in a
+    worker process.
+
+    Args:
+        audio_filename (str): The path of the WAV file.
+        target_lang (str): The language to translate to.
+        output_dir (str): The directory of the output files.
+        settings (Mapping[str, Any]): The configuration values.
+
+    Returns:
+        Dict[str, Any]: The manifest record of the recording.
+    """
+    stem = os.path.splitext(os.path.basename(audio_filename))[0]
+    record = {"input": audio_filename, "target_lang": target_lang}
+    seconds = {}
+    try:
+        # the recording is memory-mapped rather than read, so that long
+        # recordings do not fill the memory of the worker
+        with MappedWav(audio_filename) as wav:
+            record["audio_seconds"] = wav.seconds
+
+        # the requests of batch runs go after those of the app
+        with lane(BATCH):
+            transcriber, translator, synthesizer = load_backends(settings)
+
+            start = time.perf_counter()
+            transcript, timeline = transcribe_file(
+                audio_filename, transcription_cache(settings), transcriber,
+                settings)
+            seconds["transcribe"] = time.perf_counter() - start
+
+            start = time.perf_counter()
+            translation = translate_long(
+                transcript, target_lang, translation_cache(settings),
+                translator, settings["translation_batch_tokens"],
+                settings["translation_workers"],
+                memory=translation_memory(settings))
+            seconds["translate"] = time.perf_counter() - start
+
+            start = time.perf_counter()
+            speech = synthesize_speech(
+                translation, target_lang, speech_cache(settings), synthesizer,
+                max_workers=settings["synthesis_workers"])
+            seconds["synthesize"] = time.perf_counter() - start
+
+        outputs = {
+            "transcript": (os.path.join(output_dir, f"{stem}.txt"),
+                           transcript.encode("utf-8")),
+            "timeline": (os.path.join(output_dir, f"{stem}.timeline.json"),
+                         json.dumps(timeline, indent=2).encode("utf-8")),
+            "translation": (os.path.join(output_dir,
+                                         f"{stem}.{target_lang}.txt"),
+                            translation.encode("utf-8")),
+            "speech": (os.path.join(output_dir, f"{stem}.{target_lang}.mp3"),
+                       speech),
+        }
+        for name, (filename, content) in outputs.items():
+            with open(filename, "wb") as f:
+                f.write(content)
+            record[name] = filename
+        record["status"] = "done"
+    except Exception as e:
+        record["status"] = "failed"
+        record["error"] = repr(e)
+    record["seconds"] = seconds
+    return record
+
+
+def run_batch(inputs: List[str], target_lang: str, output_dir: str,
+              manifest_filename: str, settings: Mapping[str, Any],
+              workers: int) -> Dict[str, Any]:
+    """
+    Processes the recordings not yet done with a pool of worker processes,
+    appending each result to the manifest as soon as it is available.
+
+    Args:
+        inputs (List[str]): The paths of the WAV files.
+        target_lang (str): The language to translate to.
+        output_dir (str): The directory of the output files.
+        manifest_filename (str): The path of the JSONL manifest.
+        settings (Mapping[str, Any]): The configuration values.
+        workers (int): The number of worker processes.
+
+    Returns:
+        Dict[str, Any]: The throughput summary of the run.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    done = read_manifest(manifest_filename)
+    pending = [path for path in inputs if (path, target_lang) not in done]
+    summary = {"skipped": len(inputs) - len(pending), "done": 0,
+               "failed": 0, "audio_seconds": 0.0,
+               "stage_seconds": {"transcribe": 0.0, "translate": 0.0,
+                                 "synthesize": 0.0}}
+
+    # every worker process has its own rate limiters, so they share the
+    # limits of the service
+    worker_settings = dict(settings)
+    for name in ("transcription_requests_per_minute",
+                 "translation_requests_per_minute",
+                 "translation_tokens_per_minute"):
+        if settings[name]:
+            worker_settings[name] = max(1, settings[name] // workers)
+
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as executor, \
+            open(manifest_filename, "a") as manifest:
+        futures = [executor.submit(process_item, path, target_lang,
+                                   output_dir, worker_settings)
+                   for path in pending]
+        for future in as_completed(futures):
+            record = future.result()
+            manifest.write(json.dumps(record) + "\n")
+            manifest.flush()
+            summary[record["status"]] += 1
+            summary["audio_seconds"] += record.get("audio_seconds", 0.0)
+            for stage, seconds in record["seconds"].items():
+                summary["stage_seconds"][stage] += seconds
+            if record["status"] == "failed":
+                print(f"Failed {record['input']}: {record['error']}")
+    summary["wall_seconds"] = time.perf_counter() - start
+    return summary
+
+
+def print_summary(summary: Dict[str, Any]) -> None:
+    wall = max(summary["wall_seconds"], 1e-9)
+    processed = summary["done"] + summary["failed"]
+    print(f"Processed {processed} recordings ({summary['done']} done, "
+          f"{summary['failed']} failed, {summary['skipped']} skipped) "
+          f"in {wall:.1f} s")
+    print(f"Throughput: {processed / wall:.2f} recordings/s, "
+          f"{summary['audio_seconds'] / wall:.2f} s of audio/s")
+    if processed:
+        for stage, seconds in summary["stage_seconds"].items():
+            print(f"  {stage}: {seconds / processed:.2f} s per recording")
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """
+    Parses the command line of the batch command and runs it.
+
+    Args:
+        argv (Optional[List[str]]): The arguments after 'batch'.
+    """
+    parser = argparse.ArgumentParser(
+        prog="python -m speech2speech batch",
+        description="Transcribe, translate and synthesize a batch of WAV "
+                    "files. The OpenAI API key is read from the "
+                    "OPENAI_API_KEY environment variable.")
+    parser.add_argument("source",
+                        help="a directory of WAV files, or a text file "
+                             "listing one WAV file per line")
+    parser.add_argument("--target-lang", required=True,
+                        help="the language to translate to, e.g. en")
+    parser.add_argument("--output-dir", default="data/batch",
+                        help="the directory of the output files")
+    parser.add_argument("--manifest",
+                        help="the JSONL manifest of finished recordings "
+                             "(default: <output-dir>/manifest.jsonl)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                        help="the number of worker processes")
+    parser.add_argument("--config", default=DEFAULT_CONFIG,
+                        help="the configuration file (default: the "
+                             "config.ini of the app)")
+    args = parser.parse_args(argv)
+    if args.workers <= 0:
+        parser.error("--workers must be a positive integer")
+
+    settings = dict(load_settings(args.config))
+    # a relative cache directory is that of the app, wherever the command
+    # is run from
+    settings["cache_dir"] = os.path.join(
+        os.path.dirname(os.path.abspath(args.config)), settings["cache_dir"])
+    manifest_filename = args.manifest or os.path.join(args.output_dir,
+                                                      "manifest.jsonl")
+    summary = run_batch(list_inputs(args.source), args.target_lang,
+                        args.output_dir, manifest_filename, settings,
+                        args.workers)
+    print_summary(summary)
+
+
+if __name__ == "__main__":
+    main()
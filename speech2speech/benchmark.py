@@ -0,0 +1,407 @@
+"""
+Measures the pipeline end to end on synthetic recordings, with the stub
+backends, so that the results depend on our own code only and can be
+compared from one commit to the next.
+
+Usage, from the speech2speech directory:
+    python benchmark.py                      # on the commit to check
+    python benchmark.py --save-baseline      # to accept its results
+
+Recordings of several lengths and channel counts are generated from a fixed
+seed, then replayed through the capture engine, as handle_record() records,
+and transcribed, translated and synthesized with cold caches. For each
+recording and stage it reports the latency percentiles over --runs runs,
+the throughput in seconds of audio per second, and the peak memory
+allocated by Python and NumPy.
+
+The fastest run of each stage and its peak memory are compared with the
+baseline in data/benchmark_baseline.json: the fastest run is the one least
+disturbed by the rest of the machine, so it hardly varies between runs of
+the same code. Before every run, a fixed workload is timed too, and the
+baseline's latencies are scaled by how much slower or faster it ran than
+when the baseline was saved, which makes up for a slower machine or a
+busier one. Any latency or memory more than --threshold above the baseline
+is a regression, and the command exits with status 1, as it does when
+there is no baseline.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List, Mapping, Tuple
+
+import numpy as np
+
+from backends import load_backends
+from pipeline import (speech_cache, synthesize_speech, transcribe_file,
+                      transcription_cache, translate_long, translation_cache,
+                      translation_memory)
+from settings import load_settings
+from spool import WavFormat, wav_header
+
+# the config file of the app and the baseline, next to this module, so
+# that the paths given on the command line stay relative to the current
+# directory
+_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_CONFIG = os.path.join(_DIRECTORY, "config.ini")
+DEFAULT_BASELINE = os.path.join(_DIRECTORY, "data", "benchmark_baseline.json")
+# the recordings, as (seconds, channels)
+FIXTURES = ((5, 1), (60, 1), (60, 2), (600, 1))
+STAGES = ("capture", "transcribe", "translate", "synthesize")
+# the metrics compared with the baseline
+COMPARED = ("min_ms", "peak_mb")
+
+_WORDS = ("the quick brown fox jumps over a lazy dog while seven "
+          "bright wizards quietly mix their potions near the old stone "
+          "bridge").split()
+
+
+def synthetic_speech(seconds: float, channels: int, rate: int = 16000,
+                     seed: int = 0) -> bytes:
+    """
+    Generates speech-like audio: voiced bursts of a few harmonics with a
+    moving pitch and some noise, separated by short and long pauses.
+
+    Args:
+        seconds (float): The length of the audio.
+        channels (int): The number of channels.
+        rate (int): The sample rate in Hz.
+        seed (int): The seed of the random generator.
+
+    Returns:
+        bytes: The content of a 16-bit PCM WAV file.
+    """
+    rng = np.random.default_rng(seed)
+    n = int(seconds * rate)
+    envelope = np.zeros(n, dtype=np.float32)
+    position = 0
+    while position < n:
+        burst = int(rng.uniform(0.3, 2.5) * rate)
+        envelope[position:position + burst] = 1
+        pause = rng.uniform(0.8, 2.0) if rng.random() < 0.2 else \
+            rng.uniform(0.1, 0.4)
+        position += burst + int(pause * rate)
+    t = np.arange(n, dtype=np.float32) / rate
+    pitch = 140 + 30 * np.sin(2 * np.pi * 0.3 * t)
+    phase = 2 * np.pi * np.cumsum(pitch) / rate
+    voice = sum(np.sin(k * phase) / k for k in range(1, 5))
+    signal = 0.3 * envelope * voice + 0.003 * rng.standard_normal(n)
+    # the channels differ slightly, as two microphones would
+    samples = np.stack([signal * (1 - 0.1 * c) for c in range(channels)],
+                       axis=1)
+    pcm = (np.clip(samples, -1, 1) * 32767).astype(np.int16).tobytes()
+    return wav_header(WavFormat(channels, 2, rate), len(pcm)) + pcm
+
+
+def synthetic_text(seconds: float, seed: int = 0) -> str:
+    """
+    Args:
+        seconds (float): The length of the speech the text stands for.
+        seed (int): The seed of the random generator.
+
+    Returns:
+        str: Sentences of about 2.5 words per second of speech.
+    """
+    rng = np.random.default_rng(seed)
+    sentences = []
+    words = int(seconds * 2.5)
+    while words > 0:
+        length = min(words, int(rng.integers(6, 18)))
+        sentence = " ".join(rng.choice(_WORDS, length))
+        sentences.append(sentence.capitalize() + ".")
+        words -= length
+    return " ".join(sentences)
+
+
+def benchmark_settings(config: str, work_dir: str,
+                       stub_latency_ms: int) -> Dict[str, Any]:
+    settings = dict(load_settings(config))
+    settings.update({
+        "transcriber": "stub", "translator": "stub", "synthesizer": "stub",
+        "stub_latency_ms": stub_latency_ms,
+        # uploads are not encoded, since ffmpeg may be missing
+        "upload_codec": "wav",
+        # the translation memory is measured even though it is off by
+        # default
+        "translation_memory": True,
+        "cache_dir": os.path.join(work_dir, "cache"),
+    })
+    return settings
+
+
+def replay_capture(audio_filename: str, spool_filename: str,
+                   settings: Mapping[str, Any]) -> None:
+    """
+    Records a WAV file as handle_record() records the microphone: chunk by
+    chunk through the capture engine, its voice activity detector and, if
+    spool is on, its spool file.
+
+    Args:
+        audio_filename (str): The WAV file to replay.
+        spool_filename (str): The WAV file the recording is saved to.
+        settings (Mapping[str, Any]): The configuration values.
+    """
+    from capture import CaptureEngine
+    from spool import MappedWav, parse_wav
+    from vad import VoiceActivityDetector
+
+    with MappedWav(audio_filename) as wav, wav.view() as view:
+        fmt, pcm = parse_wav(view)
+        vad = VoiceActivityDetector(
+            fmt.rate, fmt.channels,
+            energy_threshold_db=settings["energy_threshold_db"],
+            zcr_threshold=settings["zcr_threshold"],
+            max_silence_seconds=settings["max_silence_seconds"])
+        engine = CaptureEngine(
+            fmt.channels, fmt.rate, settings["chunk"],
+            max(settings["max_record_seconds"], int(wav.seconds) + 1),
+            vad=vad,
+            spool_filename=spool_filename if settings["spool"] else None)
+        engine.start()
+        chunk_bytes = settings["chunk"] * fmt.channels * fmt.sample_width
+        for start in range(0, len(pcm), chunk_bytes):
+            # PortAudio hands the callback a new bytes object per chunk
+            engine.feed(bytes(pcm[start:start + chunk_bytes]))
+        pcm.release()
+        engine.stop()
+        if settings["spool"]:
+            engine.close()
+        else:
+            engine.save(spool_filename)
+
+
+def calibrate() -> float:
+    """
+    Returns:
+        float: The seconds a fixed workload of Python and NumPy code takes,
+        which tells how fast the machine is at the moment.
+    """
+    data = np.random.default_rng(0).standard_normal(1 << 16)
+    start = time.perf_counter()
+    np.sort(data)
+    np.fft.rfft(data)
+    json.loads(json.dumps({str(i): i for i in range(2000)}))
+    sum(i * i for i in range(20000))
+    return time.perf_counter() - start
+
+
+def measure(fn: Callable[[], Any], runs: int, reset: Callable[[], None]
+            ) -> Tuple[List[float], List[float], float]:
+    """
+    Args:
+        fn (Callable[[], Any]): The stage to measure.
+        runs (int): The number of timed runs.
+        reset (Callable[[], None]): Called before every run, to empty the
+            caches.
+
+    Returns:
+        Tuple[List[float], List[float], float]: The seconds of each run,
+        the seconds of the calibration workload before each run, and the
+        peak memory in bytes traced during one more run.
+    """
+    seconds = []
+    calibration = []
+    # the stages log every request, which would drown the report
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(runs):
+            calibration.append(calibrate())
+            reset()
+            start = time.perf_counter()
+            fn()
+            seconds.append(time.perf_counter() - start)
+        # tracing slows the code down, so the peak is taken from its own run
+        reset()
+        tracemalloc.start()
+        try:
+            fn()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return seconds, calibration, peak
+
+
+def summarize(seconds: List[float], calibration: List[float], peak: int,
+              audio_seconds: float) -> Dict[str, float]:
+    ms = np.array(seconds) * 1000
+    return {
+        "calibration_ms": min(calibration) * 1000,
+        "min_ms": float(ms.min()),
+        "p50_ms": float(np.percentile(ms, 50)),
+        "p90_ms": float(np.percentile(ms, 90)),
+        "p99_ms": float(np.percentile(ms, 99)),
+        "throughput": audio_seconds / max(float(np.median(seconds)), 1e-9),
+        "peak_mb": peak / 1e6,
+    }
+
+
+def run_suite(settings: Mapping[str, Any], work_dir: str,
+              runs: int) -> Dict[str, Dict[str, Dict[str, float]]]:
+    """
+    Args:
+        settings (Mapping[str, Any]): The configuration values.
+        work_dir (str): A directory for the fixtures, spools and caches.
+        runs (int): The number of timed runs per stage.
+
+    Returns:
+        Dict[str, Dict[str, Dict[str, float]]]: The metrics of each stage of
+        each fixture, by fixture name and stage.
+    """
+    transcriber, translator, synthesizer = load_backends(settings)
+    caches = (transcription_cache(settings), translation_cache(settings),
+              speech_cache(settings))
+    memory = translation_memory(settings)
+
+    def reset() -> None:
+        # cold caches, so that every run does the work
+        for cache in caches:
+            cache.clear()
+        if memory is not None:
+            memory.clear()
+
+    results = {}
+    for seconds, channels in FIXTURES:
+        name = f"{seconds}s_{channels}ch"
+        audio_filename = os.path.join(work_dir, f"{name}.wav")
+        with open(audio_filename, "wb") as f:
+            f.write(synthetic_speech(seconds, channels,
+                                     seed=seconds * 10 + channels))
+        spool_filename = os.path.join(work_dir, f"{name}.spool.wav")
+        text = synthetic_text(seconds, seed=seconds)
+
+        stages = {
+            "capture": lambda: replay_capture(audio_filename,
+                                              spool_filename, settings),
+            "transcribe": lambda: transcribe_file(
+                audio_filename, caches[0], transcriber, settings),
+            "translate": lambda: translate_long(
+                text, "de", caches[1], translator,
+                settings["translation_batch_tokens"],
+                settings["translation_workers"], memory=memory),
+            "synthesize": lambda: synthesize_speech(
+                text, "de", caches[2], synthesizer,
+                max_workers=settings["synthesis_workers"]),
+        }
+        results[name] = {}
+        for stage in STAGES:
+            timings, calibration, peak = measure(stages[stage], runs, reset)
+            results[name][stage] = summarize(timings, calibration, peak,
+                                             seconds)
+            print(f"{name:>10} {stage:>10}: "
+                  f"p50 {results[name][stage]['p50_ms']:8.1f} ms, "
+                  f"p90 {results[name][stage]['p90_ms']:8.1f} ms, "
+                  f"{results[name][stage]['throughput']:8.0f}x realtime, "
+                  f"peak {results[name][stage]['peak_mb']:6.1f} MB")
+    return results
+
+
+def compare(results: Dict[str, Dict[str, Dict[str, float]]],
+            baseline: Dict[str, Dict[str, Dict[str, float]]],
+            threshold: float, min_delta_ms: float,
+            min_delta_mb: float) -> List[str]:
+    """
+    Args:
+        results: The metrics of this run.
+        baseline: The metrics of the baseline run.
+        threshold (float): The largest allowed increase, as a fraction of
+            the baseline.
+        min_delta_ms (float): Latency increases smaller than this are
+            ignored, as timer noise.
+        min_delta_mb (float): Memory increases smaller than this are
+            ignored.
+
+    Returns:
+        List[str]: A description of each regression.
+    """
+    regressions = []
+    for name, stages in results.items():
+        for stage, metrics in stages.items():
+            reference = baseline.get(name, {}).get(stage)
+            if reference is None:
+                continue
+            # the baseline's latencies as they would be on this machine,
+            # as loaded as it was during this stage
+            speed = metrics["calibration_ms"] / reference["calibration_ms"]
+            for metric in COMPARED:
+                old, new = reference[metric], metrics[metric]
+                if metric.endswith("_ms"):
+                    old *= speed
+                if new <= old * (1 + threshold):
+                    continue
+                min_delta = (min_delta_ms if metric.endswith("_ms")
+                             else min_delta_mb)
+                if new - old < min_delta:
+                    continue
+                change = f" (+{new / old - 1:.0%})" if old else ""
+                regressions.append(f"{name} {stage} {metric}: {old:.1f} -> "
+                                   f"{new:.1f}{change}")
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Benchmark the pipeline on synthetic recordings with "
+                    "the stub backends and compare it with a baseline.")
+    parser.add_argument("--runs", type=int, default=15,
+                        help="the number of timed runs per stage")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE,
+                        help="the results to compare with")
+    parser.add_argument("--save-baseline", action="store_true",
+                        help="save the results as the new baseline")
+    parser.add_argument("--threshold", type=float, default=0.5,
+                        help="the largest allowed increase of a latency or "
+                             "memory, as a fraction of the baseline")
+    parser.add_argument("--min-delta-ms", type=float, default=10,
+                        help="latency increases below this are ignored")
+    parser.add_argument("--min-delta-mb", type=float, default=1,
+                        help="memory increases below this are ignored")
+    parser.add_argument("--stub-latency-ms", type=int, default=0,
+                        help="the delay of the stub backends")
+    parser.add_argument("--output",
+                        help="a JSON file to write the results to")
+    parser.add_argument("--config", default=DEFAULT_CONFIG,
+                        help="the configuration file")
+    args = parser.parse_args()
+    if args.runs <= 0:
+        parser.error("--runs must be a positive integer")
+
+    work_dir = tempfile.mkdtemp(prefix="speech2speech-benchmark-")
+    try:
+        settings = benchmark_settings(args.config, work_dir,
+                                      args.stub_latency_ms)
+        results = run_suite(settings, work_dir, args.runs)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    report = {"python": sys.version.split()[0], "runs": args.runs,
+              "stub_latency_ms": args.stub_latency_ms, "results": results}
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(args.baseline) or ".", exist_ok=True)
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+        return
+    if not os.path.exists(args.baseline):
+        sys.exit(f"No baseline at {args.baseline}; run with "
+                 f"--save-baseline first")
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    regressions = compare(results, baseline["results"], args.threshold,
+                          args.min_delta_ms, args.min_delta_mb)
+    for regression in regressions:
+        print(f"Regression: {regression}")
+    if regressions:
+        sys.exit(1)
+    print(f"No regression above {args.threshold:.0%} of the baseline")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+from typing import Dict, Optional
+
+
+def make_key(*parts) -> str:
+    """
+    Builds a cache key from the hash of its parts.
+
+    Args:
+        *parts: The str or bytes values identifying the cached item.
+
+    Returns:
+        str: The hexadecimal SHA-256 digest of the parts.
+    """
+    digest = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, str):
+            part = part.encode("utf-8")
+        digest.update(len(part).to_bytes(8, "big"))
+        digest.update(part)
+    return digest.hexdigest()
+
+
+def normalize_text(text: str) -> str:
+    """
+    Normalizes text so that trivially different inputs share a cache key.
+
+    Args:
+        text (str): The text to be normalized.
+
+    Returns:
+        str: The text in NFC form with its whitespace collapsed.
+    """
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+class DiskCache:
+    """
+    A persistent key-value store kept in a SQLite file.
+
+    When the stored values exceed max_bytes, the least recently used entries
+    are evicted. Entries older than ttl seconds are treated as misses. The
+    counters of hits and misses are kept per process.
+    """
+
+    def __init__(self, path: str, max_bytes: int, ttl: float = None):
+        """
+        Args:
+            path (str): The path of the SQLite file.
+            max_bytes (int): The largest total size of the stored values.
+            ttl (float): The lifetime of an entry in seconds, or None if
+                entries never expire.
+
+        Raises:
+            ValueError: If max_bytes is not a positive integer.
+        """
+        if max_bytes <= 0:
+            raise ValueError("'max_bytes' must be a positive integer.")
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30,
+                                     check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS entries ("
+                           "key TEXT PRIMARY KEY, "
+                           "value BLOB NOT NULL, "
+                           "size INTEGER NOT NULL, "
+                           "created REAL NOT NULL, "
+                           "accessed REAL NOT NULL)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS entries_accessed "
+                           "ON entries (accessed)")
+        self._conn.commit()
+
+    def get(self, key: str) -> Optional[bytes]:
+        """
+        Args:
+            key (str): The key of the entry.
+
+        Returns:
+            Optional[bytes]: The stored value, or None on a miss.
+        """
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, created FROM entries WHERE key = ?",
+                (key,)).fetchone()
+            if row is not None and self.ttl is not None \
+                    and row[1] < now - self.ttl:
+                self._conn.execute("DELETE FROM entries WHERE key = ?",
+                                   (key,))
+                self._conn.commit()
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE entries SET accessed = ? "
+                               "WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+            return row[0]
+
+    def set(self, key: str, value: bytes) -> None:
+        """
+        Stores a value, evicting the least recently used entries if the
+        cache grows beyond max_bytes.
+
+        Args:
+            key (str): The key of the entry.
+            value (bytes): The value to be stored.
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO entries "
+                               "VALUES (?, ?, ?, ?, ?)",
+                               (key, value, len(value), now, now))
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self) -> None:
+        if self.ttl is not None:
+            self._conn.execute("DELETE FROM entries WHERE created < ?",
+                               (time.time() - self.ttl,))
+        total = self._conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        stale = []
+        for key, size in self._conn.execute(
+                "SELECT key, size FROM entries ORDER BY accessed"):
+            if total <= self.max_bytes:
+                break
+            stale.append((key,))
+            total -= size
+        self._conn.executemany("DELETE FROM entries WHERE key = ?", stale)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM entries")
+            self._conn.commit()
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Returns:
+            Dict[str, int]: The hits, misses, entries and bytes of the cache.
+        """
+        with self._lock:
+            entries, size = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) "
+                "FROM entries").fetchone()
+        return {"hits": self.hits, "misses": self.misses,
+                "entries": entries, "bytes": size}
+
+
+_caches: Dict[str, DiskCache] = {}
+_caches_lock = threading.Lock()
+
+
+def get_cache(path: str, max_bytes: int, ttl: float = None) -> DiskCache:
+    """
+    Returns the cache stored at path, creating it on first use, so that all
+    Streamlit sessions and reruns of this process share it.
+
+    Args:
+        path (str): The path of the SQLite file.
+        max_bytes (int): The largest total size of the stored values.
+        ttl (float): The lifetime of an entry in seconds, or None if entries
+            never expire.
+
+    Returns:
+        DiskCache: The shared cache.
+    """
+    with _caches_lock:
+        cache = _caches.get(path)
+        if cache is None:
+            cache = DiskCache(path, max_bytes, ttl)
+            _caches[path] = cache
+        cache.max_bytes = max_bytes
+        cache.ttl = ttl
+        return cache
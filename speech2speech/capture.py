@@ -0,0 +1,308 @@
+import io
+import queue
+import threading
+import wave
+
+from spool import WavFormat, WavSpool
+from streaming import UtteranceSegmenter
+from vad import VoiceActivityDetector
+
+
+class RingBuffer:
+    """
+    A fixed-size byte buffer that keeps the most recent audio written to it.
+
+    The storage is allocated once, so writing a chunk never allocates
+    memory. When the buffer is full the oldest bytes are overwritten.
+    """
+
+    def __init__(self, capacity: int):
+        """
+        Args:
+            capacity (int): The size of the buffer in bytes.
+
+        Raises:
+            ValueError: If capacity is not a positive integer.
+        """
+        if capacity <= 0:
+            raise ValueError("'capacity' must be a positive integer.")
+        self._buf = bytearray(capacity)
+        self._capacity = capacity
+        self._write_pos = 0
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return self._size
+
+    @property
+    def free(self) -> int:
+        """The number of bytes that can be written without overwriting."""
+        return self._capacity - self._size
+
+    def write(self, data: bytes) -> None:
+        """
+        Copies data into the buffer, overwriting the oldest bytes if needed.
+
+        Args:
+            data (bytes): The bytes to be stored.
+        """
+        n = len(data)
+        with self._lock:
+            if n >= self._capacity:
+                self._buf[:] = data[n - self._capacity:]
+                self._write_pos = 0
+                self._size = self._capacity
+                return
+            end = self._write_pos + n
+            if end <= self._capacity:
+                self._buf[self._write_pos:end] = data
+            else:
+                first = self._capacity - self._write_pos
+                self._buf[self._write_pos:] = data[:first]
+                self._buf[:n - first] = data[first:]
+            self._write_pos = end % self._capacity
+            self._size = min(self._capacity, self._size + n)
+
+    def read_all(self) -> bytes:
+        """
+        Returns:
+            bytes: The buffered bytes, oldest first.
+        """
+        with self._lock:
+            if self._size < self._capacity:
+                return bytes(self._buf[:self._size])
+            return bytes(self._buf[self._write_pos:]
+                         + self._buf[:self._write_pos])
+
+    def clear(self) -> None:
+        with self._lock:
+            self._write_pos = 0
+            self._size = 0
+
+
+class CaptureEngine:
+    """
+    Records audio from the microphone using PyAudio's callback mode.
+
+    PortAudio calls the callback from its own thread every time a chunk is
+    available, so the caller never polls the stream. Audio is only kept
+    between start() and stop(); stop() sets the stop event, which ends the
+    stream and wakes any thread blocked in wait(). If a voice activity
+    detector is given, it also stops the recording after a long enough
+    silence and removes long silences.
+
+    The audio is kept in a buffer of max_seconds, and the recording stops
+    when it is full, or, with a spool file, written straight to that WAV
+    file, so that recordings of any length use the same memory. With an
+    utterance segmenter, each utterance is also put on the utterances queue
+    as soon as it ends, and None after the last one.
+    """
+
+    def __init__(self, channels: int, rate: int, chunk: int,
+                 max_seconds: int, stop_event: threading.Event = None,
+                 vad: VoiceActivityDetector = None,
+                 spool_filename: str = None,
+                 segmenter: UtteranceSegmenter = None):
+        """
+        Args:
+            channels (int): The number of channels to record.
+            rate (int): The sample rate in Hz.
+            chunk (int): The number of frames per buffer.
+            max_seconds (int): The longest recording kept in the buffer.
+            stop_event (threading.Event): The event used to stop recording.
+                A new one is created if not given.
+            vad (VoiceActivityDetector): The detector used to auto-stop and
+                trim the recording, or None.
+            spool_filename (str): The WAV file the recording is written to
+                as it comes, or None to keep it in the ring buffer.
+            segmenter (UtteranceSegmenter): Cuts the live audio into
+                utterances, or None.
+        """
+        self.channels = channels
+        self.rate = rate
+        self.chunk = chunk
+        # paInt16 samples
+        self.sample_width = 2
+        self.spool_filename = spool_filename
+        self.spool = None
+        self.buffer = None
+        if spool_filename is None:
+            chunk_bytes = chunk * channels * self.sample_width
+            n_chunks = max(1, -(-rate * max_seconds // chunk))
+            self.buffer = RingBuffer(chunk_bytes * n_chunks)
+        self.start_event = threading.Event()
+        self.stop_event = stop_event or threading.Event()
+        self.vad = vad
+        self.segmenter = segmenter
+        self.utterances: queue.Queue = queue.Queue()
+        # whether the recording stopped because the buffer was full
+        self.limit_reached = False
+        # whether any chunk was speech; without a detector, every chunk
+        # counts as speech
+        self.heard_speech = vad is None
+        self._pyaudio = None
+        self._stream = None
+
+    @property
+    def recording(self) -> bool:
+        return self.start_event.is_set() and not self.stop_event.is_set()
+
+    @property
+    def recorded_bytes(self) -> int:
+        """
+        Returns:
+            int: The size of the PCM audio kept so far, in the spool file
+            if there is one, else in the buffer.
+        """
+        if self.spool is not None:
+            return self.spool.data_bytes
+        if self.buffer is not None:
+            return len(self.buffer)
+        return 0
+
+    def feed(self, in_data: bytes) -> bool:
+        """
+        Keeps a chunk of audio, as the stream callback does, so that audio
+        from elsewhere, such as a benchmark fixture, can be replayed through
+        the same path without a microphone.
+
+        Args:
+            in_data (bytes): The chunk of interleaved 16-bit PCM audio.
+
+        Returns:
+            bool: True once the recording is stopped.
+        """
+        if self.stop_event.is_set():
+            return True
+        if self.start_event.is_set():
+            # the detector looks at every chunk once, for trimming,
+            # segmenting and auto-stop alike
+            speech = None
+            if self.vad is not None:
+                speech = self.vad.is_speech(in_data)
+                self.heard_speech = self.heard_speech or speech
+            if self.spool is None:
+                if len(in_data) > self.buffer.free:
+                    # keep the start of a long recording rather than let
+                    # the buffer overwrite it
+                    self.buffer.write(in_data[:self.buffer.free])
+                    self.limit_reached = True
+                    self.stop_event.set()
+                    return True
+                self.buffer.write(in_data)
+            elif self.vad is None:
+                self.spool.write(in_data)
+            else:
+                self.spool.write(self.vad.trim_stream(in_data, speech))
+            if self.segmenter is not None:
+                utterance = self.segmenter.feed(in_data, speech)
+                if utterance is not None:
+                    self.utterances.put(utterance)
+            if self.vad is not None and self.vad.feed(in_data, speech):
+                self.stop_event.set()
+                return True
+        return False
+
+    def _callback(self, in_data, frame_count, time_info, status):
+        import pyaudio
+
+        if self.feed(in_data):
+            return None, pyaudio.paComplete
+        return None, pyaudio.paContinue
+
+    def open(self) -> None:
+        """
+        Opens the input stream. Chunks are discarded until start() is called.
+        """
+        import pyaudio
+
+        self._pyaudio = pyaudio.PyAudio()
+        self._stream = self._pyaudio.open(format=pyaudio.paInt16,
+                                          channels=self.channels,
+                                          rate=self.rate,
+                                          input=True,
+                                          frames_per_buffer=self.chunk,
+                                          stream_callback=self._callback)
+
+    def start(self) -> None:
+        if self.spool_filename is not None and self.spool is None:
+            self.spool = WavSpool(self.spool_filename,
+                                  WavFormat(self.channels, self.sample_width,
+                                            self.rate))
+        self.start_event.set()
+
+    def stop(self) -> None:
+        self.stop_event.set()
+
+    def wait(self, timeout: float = None) -> bool:
+        """
+        Blocks without using the CPU until recording is stopped.
+
+        Args:
+            timeout (float): The maximum number of seconds to wait.
+
+        Returns:
+            bool: True if recording was stopped, False on timeout.
+        """
+        return self.stop_event.wait(timeout)
+
+    def close(self) -> None:
+        """
+        Closes the stream, releases PortAudio, finishes the spool file, or
+        deletes it if no speech was heard, and ends the last utterance.
+        """
+        if self._stream is not None:
+            self._stream.stop_stream()
+            self._stream.close()
+            self._stream = None
+        if self._pyaudio is not None:
+            self._pyaudio.terminate()
+            self._pyaudio = None
+        if self.spool is not None:
+            if self.heard_speech:
+                self.spool.close()
+            else:
+                self.spool.discard()
+        if self.segmenter is not None:
+            utterance = self.segmenter.flush()
+            if utterance is not None:
+                self.utterances.put(utterance)
+            self.utterances.put(None)
+            self.segmenter = None
+
+    def to_wav(self) -> bytes:
+        """
+        Returns the recorded audio as the content of a WAV file, without its
+        long silences if a voice activity detector is set.
+
+        Returns:
+            bytes: The WAV file content.
+        """
+        if self.spool is not None:
+            self.close()
+            with open(self.spool_filename, "rb") as f:
+                return f.read()
+        data = self.buffer.read_all()
+        if self.vad is not None:
+            data = self.vad.trim(data)
+        fp = io.BytesIO()
+        with wave.open(fp, "wb") as wf:
+            wf.setnchannels(self.channels)
+            wf.setsampwidth(self.sample_width)
+            wf.setframerate(self.rate)
+            wf.writeframes(data)
+        return fp.getvalue()
+
+    def save(self, file_name: str) -> None:
+        """
+        Writes the recorded audio to a WAV file.
+
+        Args:
+            file_name (str): The path of the WAV file.
+        """
+        if self.spool is not None and file_name == self.spool_filename:
+            self.close()
+            return
+        with open(file_name, "wb") as f:
+            f.write(self.to_wav())
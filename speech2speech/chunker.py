@@ -0,0 +1,197 @@
+"""
+Splits long recordings into chunks that can be transcribed concurrently, and
+stitches their transcripts back together.
+
+Chunks are cut in the middle of a pause wherever possible, and each chunk
+extends overlap_seconds into its neighbours, so that a word cut at a chunk
+boundary is still heard whole by one of them. The words transcribed twice
+in an overlap are removed when the transcripts are merged.
+"""
+import re
+from typing import List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from spool import parse_wav, wav_header
+from vad import VoiceActivityDetector
+
+
+class AudioChunk(NamedTuple):
+    # the position of the chunk in the recording, in seconds
+    start: float
+    end: float
+    # the chunk as a WAV file
+    audio: bytes
+
+
+def _longest_silence(mask: np.ndarray) -> Optional[int]:
+    """
+    Args:
+        mask (np.ndarray): A boolean per frame, True where the frame is
+            speech.
+
+    Returns:
+        Optional[int]: The middle frame of the longest run of silence, or
+        None if every frame is speech.
+    """
+    silent = np.concatenate(([0], (~mask).astype(np.int8), [0]))
+    edges = np.flatnonzero(np.diff(silent))
+    if len(edges) == 0:
+        return None
+    starts, ends = edges[::2], edges[1::2]
+    # of several pauses of the same length, take the latest one
+    lengths = (ends - starts)[::-1]
+    longest = len(lengths) - 1 - np.argmax(lengths)
+    return int(starts[longest] + ends[longest]) // 2
+
+
+def chunk_bounds(audio, max_chunk_seconds: float, overlap_seconds: float,
+                 energy_threshold_db: float = -40.0,
+                 zcr_threshold: float = 0.25) -> List[Tuple[int, int]]:
+    """
+    Finds where to split a WAV file into chunks of at most
+    max_chunk_seconds, plus the overlap on each side. Each cut is placed in
+    the longest pause of the second half of the chunk, or at its end if
+    there is no pause. Only one chunk of audio is analysed at a time, so a
+    memory-mapped recording of any length can be split.
+
+    Args:
+        audio (bytes-like): The content of a 16-bit PCM WAV file.
+        max_chunk_seconds (float): The longest chunk, without its overlap.
+        overlap_seconds (float): How far each chunk extends into its
+            neighbours.
+        energy_threshold_db (float): The level, in dBFS, above which a
+            frame is speech.
+        zcr_threshold (float): The zero-crossing rate above which a quieter
+            frame is still speech.
+
+    Returns:
+        List[Tuple[int, int]]: The first and the last sample frame (not
+        included) of each chunk, in order. A recording shorter than
+        max_chunk_seconds is a single chunk.
+
+    Raises:
+        ValueError: If audio is not a PCM WAV file.
+    """
+    fmt, pcm = parse_wav(audio)
+    rate = fmt.rate
+    sample_bytes = fmt.sample_width * fmt.channels
+    n_samples = len(pcm) // sample_bytes
+    if n_samples <= max_chunk_seconds * rate:
+        return [(0, n_samples)]
+
+    vad = VoiceActivityDetector(rate, fmt.channels,
+                                energy_threshold_db=energy_threshold_db,
+                                zcr_threshold=zcr_threshold)
+    frame_length = vad.frame_length
+    frame_bytes = frame_length * sample_bytes
+    max_frames = max(2, int(max_chunk_seconds * rate) // frame_length)
+
+    # cut points in frames
+    cuts = [0]
+    while (n_samples // frame_length) - cuts[-1] > max_frames:
+        window_start = cuts[-1] + max_frames // 2
+        window_end = cuts[-1] + max_frames
+        mask = vad.speech_mask(pcm[window_start * frame_bytes:
+                                   window_end * frame_bytes])
+        pause = _longest_silence(mask)
+        cuts.append(window_end if pause is None else window_start + pause)
+
+    bounds = [cut * frame_length for cut in cuts] + [n_samples]
+    overlap = int(overlap_seconds * rate)
+    return [(max(0, start - overlap), min(n_samples, end + overlap))
+            for start, end in zip(bounds, bounds[1:])]
+
+
+def chunk_wav(audio, start: int, end: int) -> bytes:
+    """
+    Args:
+        audio (bytes-like): The content of a PCM WAV file.
+        start (int): The first sample frame of the chunk.
+        end (int): The sample frame after the chunk.
+
+    Returns:
+        bytes: The chunk as a WAV file.
+    """
+    fmt, pcm = parse_wav(audio)
+    sample_bytes = fmt.sample_width * fmt.channels
+    data = pcm[start * sample_bytes:end * sample_bytes]
+    return wav_header(fmt, len(data)) + data
+
+
+def split_wav(audio, max_chunk_seconds: float, overlap_seconds: float,
+              energy_threshold_db: float = -40.0,
+              zcr_threshold: float = 0.25) -> List[AudioChunk]:
+    """
+    Splits a WAV file into chunks at the bounds given by chunk_bounds().
+
+    Args:
+        audio (bytes-like): The content of a 16-bit PCM WAV file.
+        max_chunk_seconds (float): The longest chunk, without its overlap.
+        overlap_seconds (float): How far each chunk extends into its
+            neighbours.
+        energy_threshold_db (float): The level, in dBFS, above which a
+            frame is speech.
+        zcr_threshold (float): The zero-crossing rate above which a quieter
+            frame is still speech.
+
+    Returns:
+        List[AudioChunk]: The chunks in order. A recording shorter than
+        max_chunk_seconds is returned as a single chunk.
+
+    Raises:
+        ValueError: If audio is not a PCM WAV file.
+    """
+    rate = parse_wav(audio)[0].rate
+    bounds = chunk_bounds(audio, max_chunk_seconds, overlap_seconds,
+                          energy_threshold_db, zcr_threshold)
+    if len(bounds) == 1:
+        return [AudioChunk(0.0, bounds[0][1] / rate, bytes(audio))]
+    return [AudioChunk(start / rate, end / rate, chunk_wav(audio, start, end))
+            for start, end in bounds]
+
+
+def _word_key(word: str) -> str:
+    # compare words without their case and punctuation
+    return re.sub(r"\W", "", word.casefold())
+
+
+def merge_overlap(left: str, right: str, max_overlap_words: int = 20) -> str:
+    """
+    Joins the transcripts of two consecutive chunks, dropping the words at
+    the start of right that repeat the end of left.
+
+    Args:
+        left (str): The transcript of the earlier chunk.
+        right (str): The transcript of the later chunk.
+        max_overlap_words (int): The largest number of repeated words
+            looked for.
+
+    Returns:
+        str: The joined transcript.
+    """
+    left_words = [_word_key(word) for word in left.split()[-max_overlap_words:]]
+    right_words = [_word_key(word)
+                   for word in right.split()[:max_overlap_words]]
+    for n in range(min(len(left_words), len(right_words)), 0, -1):
+        if left_words[-n:] == right_words[:n] and any(right_words[:n]):
+            rest = right.split(None, n)
+            right = rest[n] if len(rest) > n else ""
+            break
+    return " ".join(text for text in (left.strip(), right.strip()) if text)
+
+
+def merge_transcripts(texts: List[str], max_overlap_words: int = 20) -> str:
+    """
+    Args:
+        texts (List[str]): The transcripts of consecutive chunks.
+        max_overlap_words (int): The largest number of repeated words
+            looked for at each overlap.
+
+    Returns:
+        str: The transcript of the whole recording.
+    """
+    merged = ""
+    for text in texts:
+        merged = merge_overlap(merged, text, max_overlap_words)
+    return merged
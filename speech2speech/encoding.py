@@ -0,0 +1,53 @@
+"""
+Encodes recordings in a compact codec before they are uploaded, since on a
+slow uplink most of the transcription time is spent sending the audio.
+
+FLAC is lossless and about half the size of WAV for speech. MP3 and Opus are
+lossy and much smaller; their bitrate trades size against accuracy. The
+encoding is done in memory by pydub, which needs ffmpeg.
+"""
+import io
+import os
+from typing import Tuple
+
+# the codecs of uploads, with the format, codec and extension given to
+# ffmpeg; the Whisper API reads the format from the extension
+UPLOAD_CODECS = {
+    "wav": ("wav", None, ".wav"),
+    "flac": ("flac", None, ".flac"),
+    "mp3": ("mp3", None, ".mp3"),
+    "opus": ("webm", "libopus", ".webm"),
+}
+
+_LOSSY = ("mp3", "opus")
+
+
+def encode_upload(audio: bytes, filename: str, codec: str,
+                  bitrate_kbps: int = 32) -> Tuple[bytes, str]:
+    """
+    Args:
+        audio (bytes): The content of a WAV file.
+        filename (str): The name of the WAV file.
+        codec (str): One of UPLOAD_CODECS.
+        bitrate_kbps (int): The bitrate of lossy codecs, in kbit/s.
+
+    Returns:
+        Tuple[bytes, str]: The encoded audio, and the file name with the
+        extension of the codec.
+
+    Raises:
+        ValueError: If codec is not one of UPLOAD_CODECS.
+        Exception: If pydub or ffmpeg fail to encode the audio.
+    """
+    if codec not in UPLOAD_CODECS:
+        raise ValueError(f"'codec' must be one of {tuple(UPLOAD_CODECS)}.")
+    if codec == "wav":
+        return audio, filename
+    from pydub import AudioSegment
+
+    file_format, ffmpeg_codec, extension = UPLOAD_CODECS[codec]
+    segment = AudioSegment.from_wav(io.BytesIO(audio))
+    fp = io.BytesIO()
+    segment.export(fp, format=file_format, codec=ffmpeg_codec,
+                   bitrate=f"{bitrate_kbps}k" if codec in _LOSSY else None)
+    return fp.getvalue(), os.path.splitext(filename)[0] + extension
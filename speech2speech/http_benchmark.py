@@ -0,0 +1,170 @@
+"""
+Measures how the HTTP client of the translation stage performs against a
+local stub of the OpenAI API, with no key and no network needed.
+
+Usage, from the speech2speech directory:
+    python http_benchmark.py --requests 200 --concurrency 16
+
+The same requests are sent in rounds of concurrent requests, each round on
+new worker threads as the pipeline does, in three ways:
+- default: openai's own session of each thread,
+- pooled: the keep-alive session shared by all threads (http_pool),
+- async: coroutines on one event loop sharing an aiohttp session.
+
+For each it reports the wall time, the requests per second and the number
+of TCP connections the server accepted. Every new connection waits for
+--handshake-ms first, standing in for the TLS handshake of the real API.
+"""
+import argparse
+import asyncio
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List
+
+from backends import OpenAITranslator
+from http_pool import async_session, get_session
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Answers every completion request with the prompt after a delay."""
+
+    # keep-alive connections
+    protocol_version = "HTTP/1.1"
+
+    def setup(self) -> None:
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+        time.sleep(self.server.handshake_seconds)
+
+    def do_POST(self) -> None:
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if not self.path.endswith("/completions"):
+            self.send_error(404)
+            return
+        time.sleep(self.server.latency_seconds)
+        prompt = json.loads(body or b"{}").get("prompt", "")
+        answer = json.dumps({
+            "id": "cmpl-stub",
+            "object": "text_completion",
+            "created": int(time.time()),
+            "model": "stub",
+            "choices": [{"text": f" {prompt}", "index": 0,
+                         "logprobs": None, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": 0, "completion_tokens": 0,
+                      "total_tokens": 0},
+        }).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(answer)))
+        self.end_headers()
+        self.wfile.write(answer)
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+
+def start_server(latency_seconds: float,
+                 handshake_seconds: float) -> ThreadingHTTPServer:
+    """
+    Starts the stub server on a free port in a daemon thread.
+
+    Args:
+        latency_seconds (float): The time taken by every request.
+        handshake_seconds (float): The time taken by every new connection.
+
+    Returns:
+        ThreadingHTTPServer: The running server.
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    server.daemon_threads = True
+    server.latency_seconds = latency_seconds
+    server.handshake_seconds = handshake_seconds
+    server.connections = 0
+    server.lock = threading.Lock()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def run_threads(translator: OpenAITranslator, texts: List[str],
+                concurrency: int) -> None:
+    for start in range(0, len(texts), concurrency):
+        # every round runs on new threads, like every call of
+        # pipeline.translate_to_many
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            list(executor.map(translator.translate,
+                              texts[start:start + concurrency],
+                              ["de"] * concurrency))
+
+
+async def run_async(translator: OpenAITranslator, texts: List[str],
+                    concurrency: int) -> None:
+    async with async_session(concurrency):
+        for start in range(0, len(texts), concurrency):
+            await asyncio.gather(*(translator.atranslate(text, "de")
+                                   for text in texts[start:start
+                                                     + concurrency]))
+
+
+def measure(mode: str, server: ThreadingHTTPServer, texts: List[str],
+            concurrency: int) -> Dict[str, float]:
+    """
+    Sends the texts to the stub server in one of the three ways.
+
+    Args:
+        mode (str): default, pooled or async.
+        server (ThreadingHTTPServer): The stub server.
+        texts (List[str]): The texts to translate, one request each.
+        concurrency (int): The number of requests sent at the same time.
+
+    Returns:
+        Dict[str, float]: The wall time, requests per second and number of
+        connections.
+    """
+    api_base = f"http://127.0.0.1:{server.server_address[1]}/v1"
+    session = get_session(concurrency) if mode == "pooled" else None
+    translator = OpenAITranslator(api_key="sk-benchmark", session=session,
+                                  api_base=api_base)
+    with server.lock:
+        server.connections = 0
+    start = time.perf_counter()
+    if mode == "async":
+        asyncio.run(run_async(translator, texts, concurrency))
+    else:
+        run_threads(translator, texts, concurrency)
+    seconds = time.perf_counter() - start
+    return {"seconds": seconds, "requests_per_second": len(texts) / seconds,
+            "connections": server.connections}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Compare the HTTP clients of the translation stage "
+                    "against a local stub server.")
+    parser.add_argument("--requests", type=int, default=200,
+                        help="the number of requests per mode")
+    parser.add_argument("--concurrency", type=int, default=16,
+                        help="the number of requests sent at the same time")
+    parser.add_argument("--latency-ms", type=float, default=50,
+                        help="the time the server takes per request")
+    parser.add_argument("--handshake-ms", type=float, default=30,
+                        help="the time the server takes per new connection")
+    args = parser.parse_args()
+
+    server = start_server(args.latency_ms / 1000, args.handshake_ms / 1000)
+    texts = [f"Sentence number {i}." for i in range(args.requests)]
+    try:
+        for mode in ("default", "pooled", "async"):
+            result = measure(mode, server, texts, args.concurrency)
+            print(f"{mode:>8}: {result['seconds']:.2f} s, "
+                  f"{result['requests_per_second']:.0f} requests/s, "
+                  f"{result['connections']} connections")
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
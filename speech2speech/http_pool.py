@@ -0,0 +1,88 @@
+"""
+Shares keep-alive HTTP connections between the requests of all stages, so
+that the TLS handshake with each service is done once per connection
+instead of once per request.
+
+The synchronous backends send their requests through a requests.Session
+with a connection pool of the configured size. The asynchronous backends use
+an aiohttp.ClientSession with a connection limit of the same size, opened
+with async_session().
+"""
+import contextlib
+import threading
+from typing import Any, AsyncIterator, Dict
+
+_sessions: Dict[int, Any] = {}
+_sessions_lock = threading.Lock()
+
+
+def get_session(pool_size: int):
+    """
+    Returns the pooled session with this pool size, creating it on first
+    use, so that all Streamlit sessions, reruns and worker threads of this
+    process share its connections.
+
+    Args:
+        pool_size (int): The largest number of connections kept open per
+            host.
+
+    Returns:
+        requests.Session: The shared session.
+    """
+    with _sessions_lock:
+        session = _sessions.get(pool_size)
+        if session is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=pool_size,
+                                  pool_maxsize=pool_size)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _sessions[pool_size] = session
+        return session
+
+
+def use_openai_session(session) -> None:
+    """
+    Makes the openai package send the requests of the calling thread through
+    session. openai 0.27.4 keeps one session per thread, so every new worker
+    thread would otherwise open its own connections.
+
+    This sets the private api_requestor._thread_context of openai 0.27.4,
+    the version pinned in requirements.txt, and must be checked again
+    whenever that pin changes.
+
+    Args:
+        session (requests.Session): The pooled session.
+    """
+    from openai import api_requestor
+
+    api_requestor._thread_context.session = session
+
+
+@contextlib.asynccontextmanager
+async def async_session(pool_size: int) -> AsyncIterator[Any]:
+    """
+    Opens an aiohttp session whose connections are shared by all the
+    asynchronous requests made inside the async with block, including those
+    of the openai package.
+
+    Args:
+        pool_size (int): The largest number of connections open at the same
+            time.
+
+    Yields:
+        aiohttp.ClientSession: The pooled session.
+    """
+    import aiohttp
+    import openai
+
+    connector = aiohttp.TCPConnector(limit=pool_size)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        token = openai.aiosession.set(session)
+        try:
+            yield session
+        finally:
+            openai.aiosession.reset(token)
@@ -0,0 +1,159 @@
+"""
+A job queue shared by all sessions of the Streamlit server.
+
+The slow stages of every session run on a fixed number of worker threads
+instead of in the script threads, so that many users cannot overload the
+backends or the machine. Jobs wait their turn in order, and each session
+can show the position of its job in the queue. When too many jobs are
+waiting, new ones are refused instead of piling up.
+"""
+import contextvars
+import threading
+from collections import deque
+from concurrent.futures import Future, wait
+from typing import Any, Callable, Deque, Dict, Tuple
+
+
+class QueueFull(Exception):
+    """Raised when a job is submitted to a queue that is full."""
+
+
+class Job:
+    """A function waiting for or running on a worker of a JobQueue."""
+
+    def __init__(self, queue: "JobQueue", fn: Callable[..., Any],
+                 args: Tuple[Any, ...]):
+        self.future: Future = Future()
+        self._queue = queue
+        self._fn = fn
+        self._args = args
+        # run the function with the caller's context, so that its spans
+        # are added to the caller's metrics run
+        self._context = contextvars.copy_context()
+
+    def run(self) -> None:
+        if not self.future.set_running_or_notify_cancel():
+            return
+        try:
+            result = self._context.run(self._fn, *self._args)
+        except BaseException as e:
+            self.future.set_exception(e)
+        else:
+            self.future.set_result(result)
+
+    def position(self) -> int:
+        """
+        Returns:
+            int: The number of jobs to wait for before this one starts,
+            plus one, or 0 once the job has started.
+        """
+        return self._queue.position(self)
+
+    def wait(self, timeout: float = None) -> bool:
+        """
+        Args:
+            timeout (float): The maximum number of seconds to wait.
+
+        Returns:
+            bool: True if the job is done, False on timeout.
+        """
+        wait([self.future], timeout)
+        return self.future.done()
+
+    def result(self) -> Any:
+        """
+        Returns:
+            Any: The return value of the function, once it is done.
+
+        Raises:
+            Exception: The exception raised by the function.
+        """
+        return self.future.result()
+
+
+class JobQueue:
+    """
+    Runs jobs in the order they were submitted on a fixed number of worker
+    threads, with a bounded number of waiting jobs.
+    """
+
+    def __init__(self, workers: int, max_waiting: int):
+        """
+        Args:
+            workers (int): The number of jobs that run at the same time.
+            max_waiting (int): The largest number of jobs waiting to start.
+        """
+        self.max_waiting = max_waiting
+        self._waiting: Deque[Job] = deque()
+        self._lock = threading.Lock()
+        self._available = threading.Condition(self._lock)
+        for i in range(workers):
+            threading.Thread(target=self._run, daemon=True,
+                             name=f"job-worker-{i}").start()
+
+    def submit(self, fn: Callable[..., Any], *args: Any) -> Job:
+        """
+        Adds a job at the end of the queue.
+
+        Args:
+            fn (Callable[..., Any]): The function to run, which must not use
+                Streamlit.
+            *args (Any): The arguments of the function.
+
+        Returns:
+            Job: The submitted job.
+
+        Raises:
+            QueueFull: If max_waiting jobs are already waiting.
+        """
+        job = Job(self, fn, args)
+        with self._available:
+            if len(self._waiting) >= self.max_waiting:
+                raise QueueFull(f"The server is busy: {len(self._waiting)} "
+                                f"jobs are waiting. Please try again in a "
+                                f"moment.")
+            self._waiting.append(job)
+            self._available.notify()
+        return job
+
+    def position(self, job: Job) -> int:
+        with self._lock:
+            try:
+                return self._waiting.index(job) + 1
+            except ValueError:
+                return 0
+
+    def waiting(self) -> int:
+        with self._lock:
+            return len(self._waiting)
+
+    def _run(self) -> None:
+        while True:
+            with self._available:
+                self._available.wait_for(lambda: self._waiting)
+                job = self._waiting.popleft()
+            job.run()
+
+
+_queues: Dict[Tuple[int, int], JobQueue] = {}
+_queues_lock = threading.Lock()
+
+
+def get_job_queue(workers: int, max_waiting: int) -> JobQueue:
+    """
+    Returns the queue with these settings, creating it on first use, so that
+    all Streamlit sessions and reruns of this process share it.
+
+    Args:
+        workers (int): The number of jobs that run at the same time.
+        max_waiting (int): The largest number of jobs waiting to start.
+
+    Returns:
+        JobQueue: The shared queue.
+    """
+    with _queues_lock:
+        queue = _queues.get((workers, max_waiting))
+        if queue is None:
+            queue = JobQueue(workers, max_waiting)
+            _queues[(workers, max_waiting)] = queue
+        return queue
@@ -0,0 +1,227 @@
+"""
+Transcribes audio on the CPU with a local openai-whisper model, for sites
+without network access and to spare short utterances a round trip.
+
+Each model size is loaded once per process, when the first clip arrives,
+by a worker thread that owns it. All Streamlit sessions, reruns and
+pipeline threads send their clips to that worker, with the language and
+the batch size they were configured with, and the worker decodes the
+clips waiting together as one batch per language. Clips of up to 30
+seconds are decoded in batches; longer ones are transcribed one at a time
+with Whisper's sliding window.
+"""
+import os
+import queue
+import tempfile
+import threading
+from concurrent.futures import Future
+from typing import Any, Dict, List, NamedTuple, Optional
+
+import numpy as np
+
+# Whisper works on 16 kHz mono audio, in windows of 30 seconds
+SAMPLE_RATE = 16000
+WINDOW_SECONDS = 30
+
+
+def load_clip(audio: bytes, filename: str) -> np.ndarray:
+    """
+    Args:
+        audio (bytes): The content of an audio file.
+        filename (str): The name of the audio file, whose extension tells
+            its format.
+
+    Returns:
+        np.ndarray: The float32 samples at 16 kHz, mono, in [-1, 1].
+    """
+    from preprocess import resample_frames
+    from spool import parse_wav
+
+    try:
+        fmt, pcm = parse_wav(audio)
+    except ValueError:
+        fmt = None
+    if fmt is not None and fmt.sample_width == 2:
+        samples = np.frombuffer(pcm, dtype=np.int16).reshape(-1,
+                                                             fmt.channels)
+        mono = resample_frames(samples, fmt.rate, SAMPLE_RATE)
+        return mono / np.float32(32768)
+    # other formats are decoded by ffmpeg, which reads files
+    import whisper
+
+    suffix = os.path.splitext(filename)[1]
+    with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as f:
+        f.write(audio)
+    try:
+        return whisper.load_audio(f.name, sr=SAMPLE_RATE)
+    finally:
+        os.remove(f.name)
+
+
+class _Request(NamedTuple):
+    # the float32 samples at 16 kHz, mono
+    clip: np.ndarray
+    language: Optional[str]
+    batch_size: int
+    future: Future
+
+
+class WhisperModel:
+    """
+    A Whisper model and the worker thread that transcribes every clip sent
+    to it. Each clip brings its own language and batch size, so that one
+    model serves every configuration of its size.
+    """
+
+    def __init__(self, model_size: str = "base", threads: int = 0):
+        """
+        Args:
+            model_size (str): The Whisper model, such as tiny, base, small,
+                medium or large.
+            threads (int): The number of CPU threads of PyTorch, or 0 to let
+                it choose.
+        """
+        self.model_size = model_size
+        # PyTorch's thread count is global to the process; the worker
+        # applies the latest value before each batch
+        self.threads = threads
+        self._requests: queue.Queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, daemon=True,
+                                        name=f"whisper-{model_size}")
+        self._thread.start()
+
+    def submit(self, clip: np.ndarray, language: str = None,
+               batch_size: int = 8) -> Future:
+        """
+        Args:
+            clip (np.ndarray): The float32 samples at 16 kHz, mono.
+            language (str): The language of the audio, such as en, or None
+                to detect it.
+            batch_size (int): The largest number of clips decoded together
+                with this one.
+
+        Returns:
+            Future: The future of the transcript.
+        """
+        future: Future = Future()
+        self._requests.put(_Request(clip, language, batch_size, future))
+        return future
+
+    def transcribe_batch(self, clips: List[np.ndarray], language: str = None,
+                         batch_size: int = 8) -> List[str]:
+        """
+        Args:
+            clips (List[np.ndarray]): The float32 samples at 16 kHz, mono,
+                of each clip.
+            language (str): The language of the audio, or None to detect it.
+            batch_size (int): The largest number of clips decoded together.
+
+        Returns:
+            List[str]: The transcript of each clip.
+        """
+        futures = [self.submit(clip, language, batch_size) for clip in clips]
+        return [future.result() for future in futures]
+
+    def _load(self) -> Any:
+        import whisper
+
+        return whisper.load_model(self.model_size, device="cpu")
+
+    def _next_batch(self) -> List[_Request]:
+        # wait for one clip, then take those already waiting behind it, up
+        # to the batch size of the first
+        batch = [self._requests.get()]
+        while len(batch) < batch[0].batch_size:
+            try:
+                batch.append(self._requests.get_nowait())
+            except queue.Empty:
+                break
+        return [request for request in batch
+                if request.future.set_running_or_notify_cancel()]
+
+    def _decode(self, model: Any, clips: List[np.ndarray],
+                language: Optional[str]) -> List[str]:
+        import torch
+        import whisper
+
+        mels = torch.stack([whisper.log_mel_spectrogram(
+            whisper.pad_or_trim(clip)) for clip in clips])
+        options = whisper.DecodingOptions(language=language, fp16=False,
+                                          without_timestamps=True)
+        results = whisper.decode(model, mels, options)
+        return [result.text.strip() for result in results]
+
+    def _run(self) -> None:
+        model = None
+        threads = 0
+        window = WINDOW_SECONDS * SAMPLE_RATE
+        while True:
+            batch = self._next_batch()
+            if model is None:
+                # a failed load, such as a failed download, is tried again
+                # with the next batch
+                try:
+                    model = self._load()
+                except Exception as e:
+                    for request in batch:
+                        request.future.set_exception(e)
+                    continue
+            if self.threads and self.threads != threads:
+                import torch
+
+                threads = self.threads
+                torch.set_num_threads(threads)
+            # the clips of one language are decoded together
+            short: Dict[Optional[str], List[_Request]] = {}
+            for request in batch:
+                if len(request.clip) <= window:
+                    short.setdefault(request.language, []).append(request)
+            for language, requests in short.items():
+                try:
+                    texts = self._decode(
+                        model, [request.clip for request in requests],
+                        language)
+                except Exception as e:
+                    for request in requests:
+                        request.future.set_exception(e)
+                    continue
+                for request, text in zip(requests, texts):
+                    request.future.set_result(text)
+            for request in batch:
+                if len(request.clip) <= window:
+                    continue
+                try:
+                    result = model.transcribe(request.clip,
+                                              language=request.language,
+                                              fp16=False)
+                except Exception as e:
+                    request.future.set_exception(e)
+                else:
+                    request.future.set_result(result["text"].strip())
+
+
+_models: Dict[str, WhisperModel] = {}
+_models_lock = threading.Lock()
+
+
+def get_whisper_model(model_size: str, threads: int = 0) -> WhisperModel:
+    """
+    Returns the model of this size, loading it on first use, so that all
+    Streamlit sessions, reruns and worker threads of this process share it
+    whatever language and batch size they transcribe with.
+
+    Args:
+        model_size (str): The Whisper model, such as base.
+        threads (int): The number of CPU threads, or 0 to let PyTorch choose.
+
+    Returns:
+        WhisperModel: The shared model.
+    """
+    with _models_lock:
+        model = _models.get(model_size)
+        if model is None:
+            model = WhisperModel(model_size, threads)
+            _models[model_size] = model
+        elif threads:
+            model.threads = threads
+        return model
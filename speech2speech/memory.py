@@ -0,0 +1,399 @@
+"""
+A translation memory: the translation of every sentence already translated,
+kept in a SQLite file and indexed by similarity, so that sentences that
+differ from an earlier one only in punctuation or numbers are not sent
+again, and the translations of similar sentences can be sent as examples.
+Case is kept when sentences are matched exactly, since "US" and "us" are
+not translated alike, and only ignored when similar sentences are found
+for the examples.
+
+Similar sentences are found with MinHash signatures of their character
+trigrams, split into bands for locality-sensitive hashing: two sentences
+whose trigrams overlap enough share a band with high probability. A lookup
+reads a few rows of the band index, whatever the size of the memory, and
+compares the handful of candidates it finds exactly.
+"""
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+import zlib
+from functools import lru_cache
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+from cache import make_key, normalize_text
+
+# the signature has BANDS bands of ROWS hashes; sentences whose trigrams
+# have a Jaccard similarity of 0.5, such as two that differ in a name, share
+# a band 93% of the time, those of 0.3, 42% of the time
+SHINGLE = 3
+BANDS = 20
+ROWS = 3
+NUM_HASHES = BANDS * ROWS
+
+# the most rows read per band, so that a band shared by very many
+# sentences does not slow lookups down, and the most candidates compared
+_BAND_LIMIT = 32
+_CANDIDATES = 8
+
+_NUMBER = re.compile(r"\d+(?:[.,]\d+)*")
+# questions and exclamations are not translated like statements
+_KEPT_PUNCTUATION = set("?!¿¡？！")
+
+
+class Match(NamedTuple):
+    # the remembered sentence and its translation
+    source: str
+    translation: str
+    # the Jaccard similarity of the trigrams of both sentences
+    similarity: float
+    # whether the translation can be used as it is, its numbers having been
+    # replaced by those of the sentence looked up
+    exact: bool
+
+
+def template(sentence: str) -> Tuple[str, List[str]]:
+    """
+    Args:
+        sentence (str): A sentence.
+
+    Returns:
+        Tuple[str, List[str]]: The sentence without its punctuation, with 0
+        in place of each number, and its numbers.
+    """
+    text = normalize_text(sentence)
+    numbers = _NUMBER.findall(text)
+    text = _NUMBER.sub("0", text)
+    text = "".join(c for c in text if c in _KEPT_PUNCTUATION
+                   or not unicodedata.category(c).startswith("P"))
+    return " ".join(text.split()), numbers
+
+
+def shingles(text: str) -> Set[str]:
+    """
+    Args:
+        text (str): A template of a sentence.
+
+    Returns:
+        Set[str]: The character trigrams of the text in lower case.
+    """
+    padded = f" {text.casefold()} "
+    if len(padded) <= SHINGLE:
+        return {padded}
+    return {padded[i:i + SHINGLE] for i in range(len(padded) - SHINGLE + 1)}
+
+
+@lru_cache(maxsize=None)
+def _hash_parameters() -> Tuple[Any, Any]:
+    # the parameters of the hash functions, fixed so that signatures stay
+    # comparable across processes
+    import numpy as np
+
+    rng = np.random.default_rng(20230601)
+    a = rng.integers(0, 2 ** 64, NUM_HASHES, dtype=np.uint64) | np.uint64(1)
+    b = rng.integers(0, 2 ** 64, NUM_HASHES, dtype=np.uint64)
+    return a, b
+
+
+def minhash(grams: Set[str]) -> bytes:
+    """
+    Args:
+        grams (Set[str]): The trigrams of a sentence.
+
+    Returns:
+        bytes: The smallest value of each of the NUM_HASHES hash functions
+        over the trigrams, as 8-byte integers.
+    """
+    # numpy is only imported when the first sentence is translated
+    import numpy as np
+
+    a, b = _hash_parameters()
+    hashes = np.fromiter((zlib.crc32(gram.encode("utf-8")) for gram in grams),
+                         dtype=np.uint64, count=len(grams))
+    # multiply-shift hashing: the high half of a * x + b, for random odd a
+    values = (hashes[:, None] * a + b) >> np.uint64(32)
+    return values.min(axis=0).tobytes()
+
+
+def _hash64(*parts) -> int:
+    # a signed 64-bit integer, as stored by SQLite
+    return int.from_bytes(bytes.fromhex(make_key(*parts))[:8], "big",
+                          signed=True)
+
+
+def substitute_numbers(translation: str, old: List[str],
+                       new: List[str]) -> Optional[str]:
+    """
+    Replaces the numbers of a sentence in its translation by those of
+    another sentence.
+
+    Args:
+        translation (str): The translation of the sentence.
+        old (List[str]): The numbers of the sentence, in order.
+        new (List[str]): The numbers of the other sentence, in order.
+
+    Returns:
+        Optional[str]: The translation with the new numbers, or None if
+        the old numbers cannot all be found in it exactly once.
+    """
+    if old == new:
+        return translation
+    if len(old) != len(new) or len(set(old)) != len(old):
+        return None
+    found = {}
+    for number in old:
+        spans = [m.span() for m in re.finditer(
+            rf"(?<![\d.,]){re.escape(number)}(?![\d]|[.,]\d)", translation)]
+        if len(spans) != 1:
+            return None
+        found[spans[0]] = new[old.index(number)]
+    for (start, end), number in sorted(found.items(), reverse=True):
+        translation = translation[:start] + number + translation[end:]
+    return translation
+
+
+class TranslationMemory:
+    """
+    The translations of single sentences, by target language and
+    translation backend, kept in a SQLite file.
+
+    When the memory holds more than max_sentences sentences, the least
+    recently used ones are removed.
+    """
+
+    def __init__(self, path: str, max_sentences: int,
+                 threshold: float = 0.5):
+        """
+        Args:
+            path (str): The path of the SQLite file.
+            max_sentences (int): The largest number of sentences kept.
+            threshold (float): The smallest similarity of a sentence sent
+                as an example.
+
+        Raises:
+            ValueError: If max_sentences is not a positive integer.
+        """
+        if max_sentences <= 0:
+            raise ValueError("'max_sentences' must be a positive integer.")
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.max_sentences = max_sentences
+        self.threshold = threshold
+        self.hits = 0
+        self.near_hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30,
+                                     check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # keys, templates and bands are 64-bit hashes that include the
+        # target language and the backend
+        self._conn.execute("CREATE TABLE IF NOT EXISTS sentences ("
+                           "id INTEGER PRIMARY KEY, "
+                           "key INTEGER NOT NULL UNIQUE, "
+                           "template INTEGER NOT NULL, "
+                           "source TEXT NOT NULL, "
+                           "translation TEXT NOT NULL, "
+                           "accessed REAL NOT NULL)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS sentences_template "
+                           "ON sentences (template)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS sentences_accessed "
+                           "ON sentences (accessed)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS bands ("
+                           "hash INTEGER NOT NULL, "
+                           "sentence INTEGER NOT NULL, "
+                           "PRIMARY KEY (hash, sentence)) WITHOUT ROWID")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS bands_sentence "
+                           "ON bands (sentence)")
+        self._conn.commit()
+        self._count = self._conn.execute(
+            "SELECT COUNT(*) FROM sentences").fetchone()[0]
+
+    def lookup(self, sentence: str, target_lang: str,
+               translator: str) -> Optional[Match]:
+        """
+        Finds the remembered sentence most similar to sentence.
+
+        Args:
+            sentence (str): The sentence to be translated.
+            target_lang (str): The language to translate to.
+            translator (str): The name of the translation backend.
+
+        Returns:
+            Optional[Match]: An exact match if a remembered sentence differs
+            from sentence only in punctuation or numbers that could be
+            replaced in its translation, else the most similar sentence of
+            at least threshold similarity, whose translation is only fit to
+            be sent as an example, else None.
+        """
+        text, numbers = template(sentence)
+        grams = shingles(text)
+        with self._lock:
+            match = self._lookup_exact(text, numbers, target_lang,
+                                       translator)
+            if match is None:
+                match = self._lookup_near(grams, target_lang, translator)
+            if match is None:
+                self.misses += 1
+                return None
+            if match[1].exact:
+                self.hits += 1
+            else:
+                self.near_hits += 1
+            self._conn.execute("UPDATE sentences SET accessed = ? "
+                               "WHERE id = ?", (time.time(), match[0]))
+            self._conn.commit()
+            return match[1]
+
+    def _lookup_exact(self, text: str, numbers: List[str], target_lang: str,
+                      translator: str) -> Optional[Tuple[int, Match]]:
+        rows = self._conn.execute(
+            "SELECT id, source, translation FROM sentences "
+            "WHERE template = ? LIMIT ?",
+            (_hash64(target_lang, translator, text), _CANDIDATES)).fetchall()
+        for sentence_id, source, translation in rows:
+            source_text, source_numbers = template(source)
+            if source_text != text:
+                continue
+            adapted = substitute_numbers(translation, source_numbers, numbers)
+            if adapted is not None:
+                return sentence_id, Match(source, adapted, 1.0, True)
+        return None
+
+    def _lookup_near(self, grams: Set[str], target_lang: str,
+                     translator: str) -> Optional[Tuple[int, Match]]:
+        votes: Dict[int, int] = {}
+        for band_hash in self._bands(grams, target_lang, translator):
+            for (sentence_id,) in self._conn.execute(
+                    "SELECT sentence FROM bands WHERE hash = ? LIMIT ?",
+                    (band_hash, _BAND_LIMIT)):
+                votes[sentence_id] = votes.get(sentence_id, 0) + 1
+        best = None
+        for sentence_id in sorted(votes, key=votes.get,
+                                  reverse=True)[:_CANDIDATES]:
+            row = self._conn.execute(
+                "SELECT source, translation FROM sentences WHERE id = ?",
+                (sentence_id,)).fetchone()
+            if row is None:
+                continue
+            other = shingles(template(row[0])[0])
+            similarity = len(grams & other) / len(grams | other)
+            if similarity >= self.threshold \
+                    and (best is None or similarity > best[1].similarity):
+                best = sentence_id, Match(row[0], row[1], similarity, False)
+        return best
+
+    @staticmethod
+    def _bands(grams: Set[str], target_lang: str,
+               translator: str) -> List[int]:
+        signature = minhash(grams)
+        size = ROWS * 8
+        return [_hash64(target_lang, translator, str(band),
+                        signature[band * size:(band + 1) * size])
+                for band in range(BANDS)]
+
+    def add(self, pairs: Iterable[Tuple[str, str]], target_lang: str,
+            translator: str) -> None:
+        """
+        Remembers the translations of sentences, removing the least
+        recently used sentences if the memory grows beyond max_sentences.
+
+        Args:
+            pairs (Iterable[Tuple[str, str]]): The sentences and their
+                translations.
+            target_lang (str): The language of the translations.
+            translator (str): The name of the translation backend.
+        """
+        rows = []
+        for source, translation in pairs:
+            text, _ = template(source)
+            rows.append((source, translation, text,
+                         self._bands(shingles(text), target_lang,
+                                     translator)))
+        now = time.time()
+        with self._lock:
+            for source, translation, text, bands in rows:
+                key = _hash64(target_lang, translator, normalize_text(source))
+                old = self._conn.execute(
+                    "SELECT id FROM sentences WHERE key = ?",
+                    (key,)).fetchone()
+                if old is not None:
+                    self._conn.execute("DELETE FROM bands WHERE sentence = ?",
+                                       old)
+                    self._conn.execute("DELETE FROM sentences WHERE id = ?",
+                                       old)
+                    self._count -= 1
+                sentence_id = self._conn.execute(
+                    "INSERT INTO sentences "
+                    "(key, template, source, translation, accessed) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (key, _hash64(target_lang, translator, text), source,
+                     translation, now)).lastrowid
+                self._conn.executemany(
+                    "INSERT OR IGNORE INTO bands VALUES (?, ?)",
+                    [(band_hash, sentence_id) for band_hash in bands])
+                self._count += 1
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self) -> None:
+        if self._count <= self.max_sentences:
+            return
+        # remove one percent more than needed, so that eviction does not
+        # run again on every add
+        excess = self._count - self.max_sentences + self.max_sentences // 100
+        stale = self._conn.execute(
+            "SELECT id FROM sentences ORDER BY accessed LIMIT ?",
+            (excess,)).fetchall()
+        self._conn.executemany("DELETE FROM bands WHERE sentence = ?", stale)
+        self._conn.executemany("DELETE FROM sentences WHERE id = ?", stale)
+        self._count -= len(stale)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM bands")
+            self._conn.execute("DELETE FROM sentences")
+            self._conn.commit()
+            self._count = 0
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Returns:
+            Dict[str, int]: The exact hits, near hits, misses and sentences
+            of the memory.
+        """
+        return {"hits": self.hits, "near_hits": self.near_hits,
+                "misses": self.misses, "sentences": self._count}
+
+
+_memories: Dict[str, TranslationMemory] = {}
+_memories_lock = threading.Lock()
+
+
+def get_memory(path: str, max_sentences: int,
+               threshold: float = 0.5) -> TranslationMemory:
+    """
+    Returns the translation memory stored at path, opening it on first use,
+    so that all Streamlit sessions and reruns of this process share it.
+
+    Args:
+        path (str): The path of the SQLite file.
+        max_sentences (int): The largest number of sentences kept.
+        threshold (float): The smallest similarity of a sentence sent as an
+            example.
+
+    Returns:
+        TranslationMemory: The shared memory.
+    """
+    with _memories_lock:
+        memory = _memories.get(path)
+        if memory is None:
+            memory = TranslationMemory(path, max_sentences, threshold)
+            _memories[path] = memory
+        memory.max_sentences = max_sentences
+        memory.threshold = threshold
+        return memory
@@ -0,0 +1,245 @@
+"""
+Measures how long each stage of the app takes, how much data it handles and
+how much memory the process uses.
+
+A Run collects the measurements of one run of the Streamlit script. The
+code of a stage wraps itself in span() and record_size(), which do nothing
+unless a run is active. Finished runs are appended to a JSONL file, and the
+totals are kept as a Prometheus text-format snapshot.
+"""
+import contextlib
+import contextvars
+import json
+import os
+import sys
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, Iterator, List, Optional
+
+_current_run: contextvars.ContextVar = contextvars.ContextVar(
+    "current_run", default=None)
+
+
+def peak_rss_bytes() -> int:
+    """
+    Returns:
+        int: The peak resident set size of the process in bytes, or the
+        current one where the peak is not available.
+    """
+    try:
+        import resource
+    except ImportError:
+        import psutil
+
+        info = psutil.Process().memory_info()
+        return getattr(info, "peak_wset", info.rss)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class Run:
+    """The measurements of one run of the app."""
+
+    def __init__(self):
+        self.started = time.time()
+        self.seconds: Dict[str, float] = {}
+        self.sizes: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def add_span(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            self.seconds[stage] = self.seconds.get(stage, 0.0) + seconds
+
+    def add_size(self, name: str, size: int) -> None:
+        with self._lock:
+            self.sizes[name] = self.sizes.get(name, 0) + size
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"started": self.started,
+                    "seconds": dict(self.seconds),
+                    "bytes": dict(self.sizes),
+                    "peak_rss_bytes": peak_rss_bytes()}
+
+
+@contextlib.contextmanager
+def start_run() -> Iterator[Run]:
+    """
+    Makes a new run the active one for the code inside the with block.
+
+    Yields:
+        Run: The active run.
+    """
+    run = Run()
+    token = _current_run.set(run)
+    try:
+        yield run
+    finally:
+        _current_run.reset(token)
+
+
+def current_run() -> Optional[Run]:
+    return _current_run.get()
+
+
+@contextlib.contextmanager
+def span(stage: str) -> Iterator[None]:
+    """
+    Adds the time spent in the with block to the active run, if any. The
+    time of several spans of the same stage is summed.
+
+    Args:
+        stage (str): The name of the stage.
+    """
+    run = _current_run.get()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if run is not None:
+            run.add_span(stage, time.perf_counter() - start)
+
+
+def record_size(name: str, size: int) -> None:
+    """
+    Adds a payload size to the active run, if any.
+
+    Args:
+        name (str): The name of the payload.
+        size (int): The size in bytes.
+    """
+    run = _current_run.get()
+    if run is not None:
+        run.add_size(name, size)
+
+
+class MetricsRecorder:
+    """
+    Saves finished runs to a JSONL file and keeps their totals for the
+    Prometheus snapshot.
+    """
+
+    def __init__(self, metrics_filename: str, prometheus_filename: str,
+                 history: int = 100):
+        """
+        Args:
+            metrics_filename (str): The JSONL file of the runs.
+            prometheus_filename (str): The Prometheus text-format snapshot.
+            history (int): The number of recent runs kept in memory.
+        """
+        self.metrics_filename = metrics_filename
+        self.prometheus_filename = prometheus_filename
+        self._lock = threading.Lock()
+        self._runs = deque(maxlen=history)
+        self._stage_count: Dict[str, int] = {}
+        self._stage_seconds: Dict[str, float] = {}
+        self._bytes: Dict[str, int] = {}
+        self._peak_rss = 0
+        self._load_history()
+
+    def _load_history(self) -> None:
+        if not os.path.exists(self.metrics_filename):
+            return
+        with open(self.metrics_filename) as f:
+            for line in f:
+                try:
+                    self._runs.append(json.loads(line))
+                except ValueError:
+                    continue
+
+    def record(self, run: Run) -> None:
+        """
+        Saves a finished run and rewrites the Prometheus snapshot.
+
+        Args:
+            run (Run): The finished run.
+        """
+        entry = run.to_dict()
+        with self._lock:
+            self._runs.append(entry)
+            for stage, seconds in entry["seconds"].items():
+                self._stage_count[stage] = self._stage_count.get(stage, 0) + 1
+                self._stage_seconds[stage] = (
+                    self._stage_seconds.get(stage, 0.0) + seconds)
+            for name, size in entry["bytes"].items():
+                self._bytes[name] = self._bytes.get(name, 0) + size
+            self._peak_rss = max(self._peak_rss, entry["peak_rss_bytes"])
+            for filename in (self.metrics_filename, self.prometheus_filename):
+                directory = os.path.dirname(filename)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+            with open(self.metrics_filename, "a") as f:
+                f.write(json.dumps(entry) + "\n")
+            snapshot = self._prometheus_text()
+        tmp_filename = f"{self.prometheus_filename}.tmp"
+        with open(tmp_filename, "w") as f:
+            f.write(snapshot)
+        os.replace(tmp_filename, self.prometheus_filename)
+
+    def last_runs(self, n: int) -> List[Dict[str, Any]]:
+        """
+        Args:
+            n (int): The number of runs.
+
+        Returns:
+            List[Dict[str, Any]]: The last n runs, newest first.
+        """
+        with self._lock:
+            return list(self._runs)[::-1][:n]
+
+    def prometheus_text(self) -> str:
+        """
+        Returns:
+            str: The totals since the process started, in Prometheus text
+            format.
+        """
+        with self._lock:
+            return self._prometheus_text()
+
+    def _prometheus_text(self) -> str:
+        lines = ["# HELP speech2speech_stage_seconds Time spent in each "
+                 "stage.",
+                 "# TYPE speech2speech_stage_seconds summary"]
+        for stage in sorted(self._stage_seconds):
+            lines.append(f'speech2speech_stage_seconds_sum{{stage="{stage}"}} '
+                         f'{self._stage_seconds[stage]:.6f}')
+            lines.append(f'speech2speech_stage_seconds_count'
+                         f'{{stage="{stage}"}} {self._stage_count[stage]}')
+        lines += ["# HELP speech2speech_payload_bytes Bytes handled by each "
+                  "stage.",
+                  "# TYPE speech2speech_payload_bytes counter"]
+        for name in sorted(self._bytes):
+            lines.append(f'speech2speech_payload_bytes{{payload="{name}"}} '
+                         f'{self._bytes[name]}')
+        lines += ["# HELP speech2speech_peak_rss_bytes Peak resident set "
+                  "size of the process.",
+                  "# TYPE speech2speech_peak_rss_bytes gauge",
+                  f"speech2speech_peak_rss_bytes {self._peak_rss}"]
+        return "\n".join(lines) + "\n"
+
+
+_recorders: Dict[str, MetricsRecorder] = {}
+_recorders_lock = threading.Lock()
+
+
+def get_recorder(metrics_filename: str,
+                 prometheus_filename: str) -> MetricsRecorder:
+    """
+    Returns the recorder writing to metrics_filename, creating it on first
+    use, so that all Streamlit sessions and reruns of this process share it.
+
+    Args:
+        metrics_filename (str): The JSONL file of the runs.
+        prometheus_filename (str): The Prometheus text-format snapshot.
+
+    Returns:
+        MetricsRecorder: The shared recorder.
+    """
+    with _recorders_lock:
+        recorder = _recorders.get(metrics_filename)
+        if recorder is None:
+            recorder = MetricsRecorder(metrics_filename, prometheus_filename)
+            _recorders[metrics_filename] = recorder
+        return recorder
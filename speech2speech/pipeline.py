@@ -0,0 +1,702 @@
+"""
+The stages of the speech-to-speech pipeline, free of any Streamlit state so
+that they can be called from the app, from worker threads and processes,
+and from the command line.
+"""
+import contextvars
+import os
+import queue
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import (Any, Callable, Dict, Iterator, List, Mapping, NamedTuple,
+                    Optional, Tuple)
+
+from backends import Synthesizer, Transcriber, Translator
+from cache import DiskCache, get_cache, make_key, normalize_text
+from encoding import encode_upload
+from memory import TranslationMemory, get_memory
+from metrics import record_size, span
+from segmenter import join_sentences, pack_sentences, split_sentences
+
+
+def transcription_cache(settings: Mapping[str, Any]) -> DiskCache:
+    """
+    Args:
+        settings (Mapping[str, Any]): The configuration values, such as
+            the Streamlit session state.
+
+    Returns:
+        DiskCache: The transcription cache.
+    """
+    return get_cache(
+        os.path.join(settings["cache_dir"], "transcripts.sqlite"),
+        settings["transcription_cache_mb"] * 1024 * 1024)
+
+
+def translation_cache(settings: Mapping[str, Any]) -> DiskCache:
+    """
+    Args:
+        settings (Mapping[str, Any]): The configuration values, such as
+            the Streamlit session state.
+
+    Returns:
+        DiskCache: The translation cache.
+    """
+    return get_cache(
+        os.path.join(settings["cache_dir"], "translations.sqlite"),
+        settings["translation_cache_mb"] * 1024 * 1024,
+        ttl=settings["translation_cache_ttl_hours"] * 3600)
+
+
+def translation_memory(settings: Mapping[str, Any]
+                       ) -> Optional[TranslationMemory]:
+    """
+    Args:
+        settings (Mapping[str, Any]): The configuration values, such as the
+            Streamlit session state.
+
+    Returns:
+        Optional[TranslationMemory]: The translation memory, or None if it
+        is turned off.
+    """
+    if not settings["translation_memory"]:
+        return None
+    return get_memory(
+        os.path.join(settings["cache_dir"], "memory.sqlite"),
+        settings["translation_memory_max_sentences"],
+        settings["translation_memory_threshold"])
+
+
+def speech_cache(settings: Mapping[str, Any]) -> DiskCache:
+    """
+    Args:
+        settings (Mapping[str, Any]): The configuration values, such as
+            the Streamlit session state.
+
+    Returns:
+        DiskCache: The cache of synthesized sentences.
+    """
+    return get_cache(
+        os.path.join(settings["cache_dir"], "speech.sqlite"),
+        settings["speech_cache_mb"] * 1024 * 1024)
+
+
+def transcribe(audio: bytes, filename: str, cache: DiskCache,
+               transcriber: Transcriber,
+               preprocess: Callable[[bytes, str], Tuple[bytes, str]] = None
+               ) -> str:
+    """
+    Transcribes audio unless the transcript is cached. Transcripts are
+    cached by the hash of the audio and the backend name, so the same
+    recording is only transcribed once.
+
+    Args:
+        audio (bytes): The content of the audio file.
+        filename (str): The name of the audio file, whose extension tells
+            its format.
+        cache (DiskCache): The transcription cache.
+        transcriber (Transcriber): The speech-to-text backend.
+        preprocess (Callable[[bytes, str], Tuple[bytes, str]]): Converts
+            the audio and its file name before they are sent, or None to
+            send them as they are. Cached transcripts are found without
+            converting the audio.
+
+    Returns:
+        str: The transcribed text.
+    """
+    with span("transcribe"):
+        key = transcription_key(audio, transcriber)
+        cached = cache.get(key)
+        if cached is not None:
+            return cached.decode("utf-8")
+        audio, filename = prepare_upload(audio, filename, preprocess)
+        record_size("transcription_request", len(audio))
+        text = transcriber.transcribe(audio, filename)
+        cache.set(key, text.encode("utf-8"))
+        record_size("transcript", len(text.encode("utf-8")))
+        return text
+
+
+def transcription_key(audio: bytes, transcriber: Transcriber) -> str:
+    return make_key(transcriber.name, audio)
+
+
+def prepare_upload(audio: bytes, filename: str,
+                   preprocess: Callable[[bytes, str], Tuple[bytes, str]]
+                   ) -> Tuple[bytes, str]:
+    """
+    Args:
+        audio (bytes): The content of the audio file.
+        filename (str): The name of the audio file.
+        preprocess (Callable[[bytes, str], Tuple[bytes, str]]): The function
+            made by upload_preprocessor(), or None.
+
+    Returns:
+        Tuple[bytes, str]: The audio and the file name to upload.
+    """
+    if preprocess is None:
+        return audio, filename
+    size = len(audio)
+    with span("preprocess"):
+        audio, filename = preprocess(audio, filename)
+    record_size("upload_saved", size - len(audio))
+    return audio, filename
+
+
+def upload_preprocessor(settings: Mapping[str, Any]
+                        ) -> Optional[Callable[[bytes, str],
+                                               Tuple[bytes, str]]]:
+    """
+    Args:
+        settings (Mapping[str, Any]): The configuration values, such as
+            the Streamlit session state.
+
+    Returns:
+        Optional[Callable[[bytes, str], Tuple[bytes, str]]]: The function
+        converting a WAV file and its name to the upload configured in the
+        [transcription] section, or None if the recordings are uploaded as
+        they are.
+    """
+    # a local model reads WAV directly, and nothing is uploaded
+    codec = ("wav" if settings["transcriber"] == "whisper"
+             else settings["upload_codec"])
+    if not settings["preprocess"] and codec == "wav":
+        return None
+
+    def preprocess(audio: bytes, filename: str) -> Tuple[bytes, str]:
+        if settings["preprocess"]:
+            # preprocess needs numpy, which is only imported when the first
+            # recording is transcribed
+            from preprocess import preprocess_wav
+
+            audio = preprocess_wav(audio, settings["target_rate"],
+                                   settings["target_rms_db"],
+                                   settings["max_peak_db"])
+        try:
+            return encode_upload(audio, filename, codec,
+                                 settings["upload_bitrate_kbps"])
+        except Exception as e:
+            # ffmpeg may be missing; the upload is only larger
+            print(f"Error encoding {filename} to {codec}, uploading WAV: "
+                  f"{e}")
+            return audio, filename
+
+    return preprocess
+
+
+def transcribe_long(audio, filename: str, cache: DiskCache,
+                    transcriber: Transcriber, settings: Mapping[str, Any]
+                    ) -> Tuple[str, List[Dict[str, Any]]]:
+    """
+    Transcribes a WAV recording of any length. A long recording is split at
+    its pauses into overlapping chunks, which are transcribed concurrently
+    over a bounded pool of threads and cached one by one, so the wall-clock
+    time is set by the slowest chunk. Each chunk is only copied out of the
+    recording while it is transcribed, so a memory-mapped recording is
+    never held in memory as a whole.
+
+    Args:
+        audio (bytes-like): The content of the WAV file, such as bytes or
+            the view of a spool.MappedWav.
+        filename (str): The name of the WAV file.
+        cache (DiskCache): The transcription cache.
+        transcriber (Transcriber): The speech-to-text backend.
+        settings (Mapping[str, Any]): The configuration values, such as
+            the Streamlit session state.
+
+    Returns:
+        Tuple[str, List[Dict[str, Any]]]: The transcript of the whole
+        recording, and the start, end (in seconds) and transcript of each
+        chunk.
+    """
+    # chunker needs numpy, which is only imported when the first recording
+    # is transcribed
+    from chunker import chunk_bounds, chunk_wav, merge_transcripts
+    from spool import parse_wav
+
+    rate = parse_wav(audio)[0].rate
+    bounds = chunk_bounds(audio, settings["max_chunk_seconds"],
+                          settings["chunk_overlap_seconds"],
+                          energy_threshold_db=settings["energy_threshold_db"],
+                          zcr_threshold=settings["zcr_threshold"])
+    preprocess = upload_preprocessor(settings)
+
+    def transcribe_chunk(start: int, end: int) -> str:
+        return transcribe(chunk_wav(audio, start, end), filename, cache,
+                          transcriber, preprocess)
+
+    if len(bounds) == 1:
+        texts = [transcribe(bytes(audio), filename, cache, transcriber,
+                            preprocess)]
+    else:
+        with ThreadPoolExecutor(
+                max_workers=settings["transcription_workers"]) as executor:
+            futures = [executor.submit(contextvars.copy_context().run,
+                                       transcribe_chunk, start, end)
+                       for start, end in bounds]
+            texts = [future.result() for future in futures]
+    timeline = [{"start": start / rate, "end": end / rate, "text": text}
+                for (start, end), text in zip(bounds, texts)]
+    return merge_transcripts(texts), timeline
+
+
+def transcribe_file(audio_filename: str, cache: DiskCache,
+                    transcriber: Transcriber, settings: Mapping[str, Any]
+                    ) -> Tuple[str, List[Dict[str, Any]]]:
+    """
+    Transcribes a WAV file of any length through a memory map, so that it is
+    never read into memory as a whole.
+
+    Args:
+        audio_filename (str): The path of the WAV file.
+        cache (DiskCache): The transcription cache.
+        transcriber (Transcriber): The speech-to-text backend.
+        settings (Mapping[str, Any]): The configuration values, such as
+            the Streamlit session state.
+
+    Returns:
+        Tuple[str, List[Dict[str, Any]]]: The same as transcribe_long.
+    """
+    from spool import MappedWav
+
+    with MappedWav(audio_filename) as wav, wav.view() as audio:
+        return transcribe_long(audio, os.path.basename(audio_filename),
+                               cache, transcriber, settings)
+
+
+def translation_key(text: str, target_lang: str,
+                    translator: Translator) -> str:
+    return make_key(normalize_text(text), target_lang, translator.name)
+
+
+def translate_with_memory(text: str, target_lang: str,
+                          translator: Translator, memory: TranslationMemory,
+                          max_examples: int = 3) -> str:
+    """
+    Translates text a sentence at a time against the translation memory.
+    The sentences it has translated before, up to punctuation and numbers,
+    are not sent again. The others are sent in one request, with the
+    translations of the most similar remembered sentences as examples, and
+    are then remembered; a similar sentence is never used as the
+    translation itself.
+
+    Args:
+        text (str): The text to be translated.
+        target_lang (str): The language to translate to.
+        translator (Translator): The translation backend.
+        memory (TranslationMemory): The translation memory.
+        max_examples (int): The largest number of examples sent.
+
+    Returns:
+        str: The translated text.
+    """
+    sentences = split_sentences(text)
+    translations: List[Optional[str]] = [None] * len(sentences)
+    # the indices of each new sentence, and the near matches of all of them
+    new: Dict[str, List[int]] = {}
+    near = {}
+    for i, sentence in enumerate(sentences):
+        if sentence in new:
+            new[sentence].append(i)
+            continue
+        match = memory.lookup(sentence, target_lang, translator.name)
+        if match is not None and match.exact:
+            translations[i] = match.translation
+            continue
+        new[sentence] = [i]
+        if match is not None:
+            near[match.source] = match
+    record_size("translation_reused", sum(
+        len(sentences[i].encode("utf-8"))
+        for i, translation in enumerate(translations)
+        if translation is not None))
+    if new:
+        segments = list(new)
+        examples = [(match.source, match.translation) for match in sorted(
+            near.values(), key=lambda match: match.similarity,
+            reverse=True)[:max_examples]]
+        record_size("translation_request",
+                    len(" ".join(segments).encode("utf-8")))
+        try:
+            results = translator.translate_segments(segments, target_lang,
+                                                    examples)
+        except ValueError as e:
+            # an answer that cannot be split into sentences is not
+            # remembered
+            print(f"Error translating sentences into {target_lang}, "
+                  f"translating the whole text: {e}")
+            return translator.translate(text, target_lang)
+        memory.add(zip(segments, results), target_lang, translator.name)
+        for segment, result in zip(segments, results):
+            for i in new[segment]:
+                translations[i] = result
+    return join_sentences(translations)
+
+
+def request_translation(text: str, target_lang: str, cache: DiskCache,
+                        translator: Translator,
+                        memory: TranslationMemory = None) -> str:
+    """
+    Translates text unless the translation is cached.
+
+    Args:
+        text (str): The text to be translated.
+        target_lang (str): The language to translate to.
+        cache (DiskCache): The translation cache.
+        translator (Translator): The translation backend.
+        memory (TranslationMemory): The translation memory the sentences of
+            text are looked up in, or None to send the whole text.
+
+    Returns:
+        str: The translated text.
+    """
+    with span("translate"):
+        key = translation_key(text, target_lang, translator)
+        cached = cache.get(key)
+        if cached is not None:
+            return cached.decode("utf-8")
+        if memory is not None and split_sentences(text):
+            translation = translate_with_memory(text, target_lang,
+                                                translator, memory)
+        else:
+            record_size("translation_request", len(text.encode("utf-8")))
+            translation = translator.translate(text, target_lang)
+        cache.set(key, translation.encode("utf-8"))
+        record_size("translation", len(translation.encode("utf-8")))
+        return translation
+
+
+def translate_long(text: str, target_lang: str, cache: DiskCache,
+                   translator: Translator, max_batch_tokens: int,
+                   max_workers: int,
+                   memory: TranslationMemory = None) -> str:
+    """
+    Translates a text of any length. The text is packed into batches of
+    whole sentences of at most max_batch_tokens, so that no translation is
+    cut short by the completion limit. The batches are translated
+    concurrently over a bounded pool of threads, cached one by one and
+    joined in their original order. The requests of a batch are retried by
+    the translator's scheduler.
+
+    Args:
+        text (str): The text to be translated.
+        target_lang (str): The language to translate to.
+        cache (DiskCache): The translation cache.
+        translator (Translator): The translation backend.
+        max_batch_tokens (int): The largest estimated number of tokens of a
+            batch.
+        max_workers (int): The largest number of concurrent requests.
+        memory (TranslationMemory): The translation memory, or None.
+
+    Returns:
+        str: The translated text.
+
+    Raises:
+        Exception: The error of the first batch that failed.
+    """
+    def translate_batch(batch: str) -> str:
+        return request_translation(batch, target_lang, cache, translator,
+                                   memory)
+
+    batches = pack_sentences(text, max_batch_tokens)
+    if len(batches) <= 1:
+        return translate_batch(text)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(contextvars.copy_context().run,
+                                   translate_batch, batch)
+                   for batch in batches]
+        return join_sentences([future.result() for future in futures])
+
+
+def language_filename(filename: str, lang: str) -> str:
+    """
+    Args:
+        filename (str): A path such as data/translation.txt.
+        lang (str): A language code such as de.
+
+    Returns:
+        str: The path with the language before its extension, such as
+        data/translation.de.txt.
+    """
+    root, ext = os.path.splitext(filename)
+    return f"{root}.{lang}{ext}"
+
+
+def translate_to_many(text: str, target_langs: List[str], cache: DiskCache,
+                      translator: Translator, max_workers: int,
+                      memory: TranslationMemory = None
+                      ) -> Dict[str, Tuple[str, float]]:
+    """
+    Translates text into several languages at once, sending one request per
+    language over a bounded pool of threads.
+
+    Args:
+        text (str): The text to be translated.
+        target_langs (List[str]): The languages to translate to.
+        cache (DiskCache): The translation cache.
+        translator (Translator): The translation backend.
+        max_workers (int): The largest number of concurrent requests.
+        memory (TranslationMemory): The translation memory, or None.
+
+    Returns:
+        Dict[str, Tuple[str, float]]: The translation and the latency in
+        seconds of each language. A failed language has an empty
+        translation.
+    """
+    def translate_one(target_lang: str) -> Tuple[str, float]:
+        start = time.perf_counter()
+        try:
+            translation = request_translation(text, target_lang, cache,
+                                              translator, memory)
+        except Exception as e:
+            print(f"Error translating into {target_lang}: {e}")
+            translation = ""
+        return translation, time.perf_counter() - start
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # each task runs in a copy of the caller's context, so that its
+        # spans are added to the caller's metrics run
+        futures = [executor.submit(contextvars.copy_context().run,
+                                   translate_one, target_lang)
+                   for target_lang in target_langs]
+        return {target_lang: future.result()
+                for target_lang, future in zip(target_langs, futures)}
+
+
+def translate_batched(text: str, target_langs: List[str], cache: DiskCache,
+                      translator: Translator) -> Dict[str, Tuple[str, float]]:
+    """
+    Translates text into several languages with a single request. Cached
+    languages are left out of the request.
+
+    Args:
+        text (str): The text to be translated.
+        target_langs (List[str]): The languages to translate to.
+        cache (DiskCache): The translation cache.
+        translator (Translator): The translation backend.
+
+    Returns:
+        Dict[str, Tuple[str, float]]: The translation and the latency in
+        seconds of each language. A failed language has an empty
+        translation.
+    """
+    results = {}
+    missing = []
+    for target_lang in target_langs:
+        start = time.perf_counter()
+        cached = cache.get(translation_key(text, target_lang, translator))
+        if cached is not None:
+            results[target_lang] = (cached.decode("utf-8"),
+                                    time.perf_counter() - start)
+        else:
+            missing.append(target_lang)
+    if not missing:
+        return results
+
+    start = time.perf_counter()
+    try:
+        with span("translate"):
+            translations = translator.translate_many(text, missing)
+    except Exception as e:
+        print(f"Error translating into {', '.join(missing)}: {e}")
+        translations = {}
+    latency = time.perf_counter() - start
+    for target_lang in missing:
+        translation = translations.get(target_lang, "")
+        if translation:
+            cache.set(translation_key(text, target_lang, translator),
+                      translation.encode("utf-8"))
+        results[target_lang] = (translation, latency)
+    return results
+
+
+def speech_key(sentence: str, lang: str, slow: bool,
+               synthesizer: Synthesizer) -> str:
+    return make_key(sentence, lang, str(slow), synthesizer.name)
+
+
+def synthesize_sentence(sentence: str, lang: str, cache: DiskCache,
+                        synthesizer: Synthesizer, slow: bool = False) -> bytes:
+    """
+    Converts one sentence to MP3 speech unless its speech is cached. The
+    speech is cached on disk by the sentence, language, speed and backend,
+    so recurring sentences are never synthesized twice.
+
+    Args:
+        sentence (str): The sentence to be read.
+        lang (str): The language of the sentence.
+        cache (DiskCache): The cache of synthesized sentences.
+        synthesizer (Synthesizer): The text-to-speech backend.
+        slow (bool): Whether the sentence is read slowly.
+
+    Returns:
+        bytes: The MP3 audio of the sentence.
+    """
+    key = speech_key(sentence, lang, slow, synthesizer)
+    segment = cache.get(key)
+    if segment is None:
+        with span("synthesize"):
+            segment = synthesizer.synthesize(sentence, lang, slow)
+        record_size("speech", len(segment))
+        cache.set(key, segment)
+    return segment
+
+
+def iter_speech(text: str, lang: str, cache: DiskCache,
+                synthesizer: Synthesizer, slow: bool = False,
+                max_workers: int = 1) -> Iterator[Tuple[str, bytes]]:
+    """
+    Converts text to MP3 speech one sentence at a time, yielding each
+    sentence as soon as it and those before it are ready. The next sentences
+    are synthesized over a bounded pool of threads while the caller handles
+    the current one, so the first sentence can be played long before the
+    whole text is synthesized.
+
+    Args:
+        text (str): The text to be read.
+        lang (str): The language of the text.
+        cache (DiskCache): The cache of synthesized sentences.
+        synthesizer (Synthesizer): The text-to-speech backend.
+        slow (bool): Whether the text is read slowly.
+        max_workers (int): The largest number of sentences synthesized at
+            the same time.
+
+    Yields:
+        Tuple[str, bytes]: Each sentence and its MP3 audio, in order.
+    """
+    sentences = split_sentences(text)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(contextvars.copy_context().run,
+                                   synthesize_sentence, sentence, lang, cache,
+                                   synthesizer, slow)
+                   for sentence in sentences]
+        try:
+            for sentence, future in zip(sentences, futures):
+                yield sentence, future.result()
+        finally:
+            # stop synthesizing if the caller stops reading
+            for future in futures:
+                future.cancel()
+
+
+def synthesize_into(sentences: queue.Queue, text: str, lang: str,
+                    cache: DiskCache, synthesizer: Synthesizer,
+                    max_workers: int = 1) -> None:
+    """
+    Puts the speech of each sentence of a text in a queue as soon as it is
+    ready, followed by None, so that another thread can play it meanwhile.
+
+    Args:
+        sentences (queue.Queue): The queue of (sentence, MP3 audio) pairs.
+        text (str): The text to be read.
+        lang (str): The language of the text.
+        cache (DiskCache): The cache of synthesized sentences.
+        synthesizer (Synthesizer): The text-to-speech backend.
+        max_workers (int): The largest number of sentences synthesized at
+            the same time.
+    """
+    try:
+        for item in iter_speech(text, lang, cache, synthesizer,
+                                max_workers=max_workers):
+            sentences.put(item)
+    finally:
+        sentences.put(None)
+
+
+def synthesize_speech(text: str, lang: str, cache: DiskCache,
+                      synthesizer: Synthesizer, slow: bool = False,
+                      max_workers: int = 1) -> bytes:
+    """
+    Converts text to MP3 speech one sentence at a time.
+
+    The speech of every sentence is cached on disk by its text, language,
+    speed and backend, so recurring sentences are never synthesized twice. MP3 is a
+    sequence of independent frames, so the sentences are joined as bytes.
+
+    Args:
+        text (str): The text to be read.
+        lang (str): The language of the text.
+        cache (DiskCache): The cache of synthesized sentences.
+        synthesizer (Synthesizer): The text-to-speech backend.
+        slow (bool): Whether the text is read slowly.
+        max_workers (int): The largest number of sentences synthesized at
+            the same time.
+
+    Returns:
+        bytes: The MP3 audio of the whole text.
+    """
+    return b"".join(segment for _, segment in iter_speech(
+        text, lang, cache, synthesizer, slow, max_workers))
+
+
+class Utterance(NamedTuple):
+    # the results of the stages of a conversation for one utterance
+    transcript: str
+    translation: str = ""
+    speech: bytes = b""
+
+
+def utterance_stages(target_lang: str, transcriber: Transcriber,
+                     translator: Translator, synthesizer: Synthesizer,
+                     settings: Mapping[str, Any],
+                     run: Callable[..., Any] = None
+                     ) -> List[Tuple[str, Callable[[Any], Any], int]]:
+    """
+    Returns the stages of a conversation, for a stages.StagePipeline: the
+    WAV file of each utterance is transcribed, its transcript translated
+    and, if live_speak is on, the translation synthesized, each stage with
+    the number of workers set in the [live] section. Every stage uses the
+    caches, and translations the translation memory.
+
+    Args:
+        target_lang (str): The language to translate to.
+        transcriber (Transcriber): The speech-to-text backend.
+        translator (Translator): The translation backend.
+        synthesizer (Synthesizer): The text-to-speech backend.
+        settings (Mapping[str, Any]): The configuration values, which must
+            not be the Streamlit session state, since the stages run in
+            their own threads.
+        run (Callable[..., Any]): Calls a function with its arguments and
+            returns its result, such as on the job queue, or None to call
+            the functions directly.
+
+    Returns:
+        List[Tuple[str, Callable[[Any], Any], int]]: The name, function and
+        number of workers of each stage. The first stage takes the WAV file
+        of an utterance, and every stage returns an Utterance.
+    """
+    filename = os.path.basename(settings["source_lang_audio_filename"])
+    preprocess = upload_preprocessor(settings)
+    if run is None:
+        def run(fn: Callable[..., Any], *args: Any) -> Any:
+            return fn(*args)
+
+    def transcribe_stage(audio: bytes) -> Utterance:
+        return Utterance(run(transcribe, audio, filename,
+                             transcription_cache(settings), transcriber,
+                             preprocess))
+
+    def translate_stage(utterance: Utterance) -> Utterance:
+        if not utterance.transcript.strip():
+            return utterance
+        return utterance._replace(translation=run(
+            request_translation, utterance.transcript, target_lang,
+            translation_cache(settings), translator,
+            translation_memory(settings)))
+
+    def synthesize_stage(utterance: Utterance) -> Utterance:
+        if not utterance.translation.strip():
+            return utterance
+        return utterance._replace(speech=run(
+            synthesize_speech, utterance.translation, target_lang,
+            speech_cache(settings), synthesizer, False,
+            settings["synthesis_workers"]))
+
+    stages = [("transcribe", transcribe_stage,
+               settings["live_transcribe_workers"]),
+              ("translate", translate_stage,
+               settings["live_translate_workers"])]
+    if settings["live_speak"]:
+        stages.append(("synthesize", synthesize_stage,
+                       settings["live_synthesize_workers"]))
+    return stages
@@ -0,0 +1,264 @@
+"""
+Prepares recordings for upload: stereo is mixed down to mono, the audio is
+resampled to the rate the speech-to-text model works at, and its level is
+normalized. Mixing down and resampling work a block at a time, so that
+only the prepared audio, a fraction of the size of the recording, is held
+in memory in full.
+
+Whisper resamples everything to 16 kHz mono anyway, so sending it more
+channels or a higher rate only makes the upload larger.
+"""
+from functools import lru_cache
+from math import gcd
+from typing import Tuple
+
+import numpy as np
+
+from spool import WavFormat, parse_wav, wav_header
+
+# the frames mixed down and resampled at a time, and the samples the
+# resampling filter computes at a time
+BLOCK_FRAMES = 1 << 16
+_OUTPUT_BLOCK = 4096
+
+# the resampling filter spans this many zero crossings of its sinc on each
+# side, and passes this share of the band below the new Nyquist frequency
+_ZERO_CROSSINGS = 16
+_ROLLOFF = 0.9
+_KAISER_BETA = 8.0
+
+
+def downmix(samples: np.ndarray) -> np.ndarray:
+    """
+    Args:
+        samples (np.ndarray): The samples as an array of shape
+            (frames, channels).
+
+    Returns:
+        np.ndarray: The mean of the channels, as float32.
+    """
+    if samples.shape[1] == 1:
+        return samples[:, 0].astype(np.float32)
+    return samples.mean(axis=1, dtype=np.float32)
+
+
+@lru_cache(maxsize=None)
+def _polyphase_filter(up: int, down: int) -> Tuple[np.ndarray, int]:
+    # a windowed-sinc low-pass filter at up times the input rate, cutting
+    # below the lower of the two Nyquist frequencies, split into its up
+    # phases; each row is reversed to be applied to a window of the input
+    ratio = max(up, down)
+    half = _ZERO_CROSSINGS * ratio
+    k = np.arange(-half, half + 1)
+    cutoff = _ROLLOFF / (2 * ratio)
+    h = (2 * cutoff * np.sinc(2 * cutoff * k) * np.kaiser(len(k), _KAISER_BETA)
+         * up)
+    taps = -(-len(h) // up)
+    h = np.concatenate([h, np.zeros(taps * up - len(h))])
+    phases = h.reshape(taps, up).T[:, ::-1]
+    return np.ascontiguousarray(phases, dtype=np.float32), half
+
+
+class Resampler:
+    """
+    Resamples a stream of float samples, one block at a time, with a
+    polyphase windowed-sinc filter, so that nothing above the new Nyquist
+    frequency folds back into the speech band. Only the last few samples of
+    the previous block are kept between blocks.
+    """
+
+    def __init__(self, rate: int, target_rate: int):
+        """
+        Args:
+            rate (int): The sample rate of the input, in Hz.
+            target_rate (int): The sample rate of the output, in Hz.
+        """
+        g = gcd(rate, target_rate)
+        self.up, self.down = target_rate // g, rate // g
+        self._phases, self._delay = _polyphase_filter(self.up, self.down)
+        taps = self._phases.shape[1]
+        # the input not used up yet, starting with silence before the
+        # first sample, and the index of its first sample
+        self._buffer = np.zeros(taps - 1, dtype=np.float32)
+        self._start = 1 - taps
+        self._fed = 0
+        self._produced = 0
+
+    def _last_input(self, n: int) -> int:
+        # the index of the last input sample output n depends on
+        return (n * self.down + self._delay) // self.up
+
+    def _run(self, end: int) -> np.ndarray:
+        taps = self._phases.shape[1]
+        windows = np.lib.stride_tricks.sliding_window_view(self._buffer,
+                                                           taps)
+        out = np.empty(max(0, end - self._produced), dtype=np.float32)
+        for i in range(0, len(out), _OUTPUT_BLOCK):
+            n = np.arange(self._produced + i,
+                          min(end, self._produced + i + _OUTPUT_BLOCK))
+            t = n * self.down + self._delay
+            rows = windows[t // self.up - self._start - (taps - 1)]
+            if self.up == 1:
+                out[i:i + len(n)] = rows @ self._phases[0]
+            else:
+                out[i:i + len(n)] = np.einsum(
+                    "ij,ij->i", rows, self._phases[t % self.up])
+        self._produced = max(self._produced, end)
+        # drop the input no later output depends on
+        keep = self._last_input(self._produced) - (taps - 1) - self._start
+        if keep > 0:
+            self._buffer = self._buffer[keep:]
+            self._start += keep
+        return out
+
+    def feed(self, samples: np.ndarray) -> np.ndarray:
+        """
+        Args:
+            samples (np.ndarray): The next float samples.
+
+        Returns:
+            np.ndarray: The float32 samples that can be computed so far.
+        """
+        self._buffer = np.concatenate(
+            [self._buffer, samples.astype(np.float32, copy=False)])
+        self._fed += len(samples)
+        return self._run((self._fed * self.up - 1 - self._delay)
+                         // self.down + 1)
+
+    def flush(self) -> np.ndarray:
+        """
+        Returns:
+            np.ndarray: The float32 samples left after the last block, up to
+            the length of the input at the new rate.
+        """
+        end = max(1, round(self._fed * self.up / self.down))
+        missing = (self._last_input(end - 1) + 1
+                   - (self._start + len(self._buffer)))
+        if missing > 0:
+            self._buffer = np.concatenate(
+                [self._buffer, np.zeros(missing, dtype=np.float32)])
+        return self._run(end)
+
+
+def resample_frames(samples: np.ndarray, rate: int,
+                    target_rate: int) -> np.ndarray:
+    """
+    Mixes down and resamples audio BLOCK_FRAMES frames at a time, so that
+    besides the result only a block is held in memory.
+
+    Args:
+        samples (np.ndarray): The samples as an array of shape
+            (frames, channels), such as a view of a memory-mapped file.
+        rate (int): The sample rate of samples, in Hz.
+        target_rate (int): The new sample rate, in Hz.
+
+    Returns:
+        np.ndarray: The mono float32 samples at target_rate.
+    """
+    if len(samples) == 0:
+        return np.zeros(0, dtype=np.float32)
+    if rate == target_rate:
+        out = np.empty(len(samples), dtype=np.float32)
+        for i in range(0, len(samples), BLOCK_FRAMES):
+            out[i:i + BLOCK_FRAMES] = downmix(samples[i:i + BLOCK_FRAMES])
+        return out
+    resampler = Resampler(rate, target_rate)
+    out = np.empty(max(1, round(len(samples) * resampler.up
+                                / resampler.down)), dtype=np.float32)
+    end = 0
+    for i in range(0, len(samples), BLOCK_FRAMES):
+        block = resampler.feed(downmix(samples[i:i + BLOCK_FRAMES]))
+        out[end:end + len(block)] = block
+        end += len(block)
+    out[end:] = resampler.flush()
+    return out
+
+
+def resample(mono: np.ndarray, rate: int, target_rate: int) -> np.ndarray:
+    """
+    Args:
+        mono (np.ndarray): The float samples.
+        rate (int): The sample rate of mono, in Hz.
+        target_rate (int): The new sample rate, in Hz.
+
+    Returns:
+        np.ndarray: The resampled float32 samples.
+    """
+    if rate == target_rate or len(mono) == 0:
+        return mono.astype(np.float32, copy=False)
+    return resample_frames(mono[:, None], rate, target_rate)
+
+
+def normalize(mono: np.ndarray, target_rms_db: float = -20.0,
+              max_peak_db: float = -1.0,
+              max_gain_db: float = 30.0) -> np.ndarray:
+    """
+    Scales audio to target_rms_db, unless that would push its peak above
+    max_peak_db, in which case the peak sets the gain.
+
+    Args:
+        mono (np.ndarray): The float samples, full scale being 32768.
+        target_rms_db (float): The wanted RMS level in dBFS.
+        max_peak_db (float): The highest peak level in dBFS.
+        max_gain_db (float): The largest gain in dB, so that near silence
+            is not raised to the level of speech.
+
+    Returns:
+        np.ndarray: The scaled float32 samples, scaled in place.
+    """
+    if len(mono) == 0:
+        return mono
+    # sum the squares a block at a time, without a float64 copy of the
+    # whole buffer
+    block = 1 << 20
+    energy = sum(float(np.dot(mono[i:i + block], mono[i:i + block]))
+                 for i in range(0, len(mono), block))
+    rms = (energy / len(mono)) ** 0.5
+    peak = float(max(mono.max(), -mono.min()))
+    if rms <= 0 or peak <= 0:
+        return mono
+    full_scale = 32768.0
+    gain = min(10 ** (target_rms_db / 20) * full_scale / rms,
+               10 ** (max_peak_db / 20) * full_scale / peak,
+               10 ** (max_gain_db / 20))
+    mono *= np.float32(gain)
+    return mono
+
+
+def preprocess_wav(audio, target_rate: int = 16000,
+                   target_rms_db: float = -20.0,
+                   max_peak_db: float = -1.0) -> bytes:
+    """
+    Converts a WAV file to mono at target_rate with a normalized level.
+    Audio recorded at a lower rate keeps its rate.
+
+    Args:
+        audio (bytes-like): The content of a 16-bit PCM WAV file.
+        target_rate (int): The sample rate to resample to, in Hz.
+        target_rms_db (float): The wanted RMS level in dBFS.
+        max_peak_db (float): The highest peak level in dBFS.
+
+    Returns:
+        bytes: The content of the 16-bit mono WAV file, or audio unchanged
+        if it is not 16-bit.
+
+    Raises:
+        ValueError: If audio is not a PCM WAV file.
+    """
+    fmt, pcm = parse_wav(audio)
+    if fmt.sample_width != 2:
+        return bytes(audio)
+    samples = np.frombuffer(pcm, dtype=np.int16).reshape(-1, fmt.channels)
+    rate = min(fmt.rate, target_rate)
+    mono = normalize(resample_frames(samples, fmt.rate, rate),
+                     target_rms_db, max_peak_db)
+    np.rint(mono, out=mono)
+    np.clip(mono, -32768, 32767, out=mono)
+    header = wav_header(WavFormat(1, 2, rate), 2 * len(mono))
+    wav = bytearray(len(header) + 2 * len(mono))
+    wav[:len(header)] = header
+    # converted a block at a time, straight into the file
+    data = np.frombuffer(wav, dtype=np.int16, offset=len(header))
+    for i in range(0, len(mono), BLOCK_FRAMES):
+        data[i:i + BLOCK_FRAMES] = mono[i:i + BLOCK_FRAMES]
+    return bytes(wav)
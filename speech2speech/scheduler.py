@@ -0,0 +1,348 @@
+"""
+Schedules the requests sent to rate-limited services, shared by all
+sessions, worker threads and reruns of the process.
+
+Requests wait for room in token buckets of requests and tokens per minute,
+and interactive requests go before batch ones. Requests refused with a 429
+or 5xx status are retried after a jittered exponential backoff. Identical
+requests in flight at the same time are sent only once, and all callers get
+its result.
+"""
+import asyncio
+import contextlib
+import contextvars
+import random
+import threading
+import time
+from concurrent.futures import Future
+from typing import (Any, Awaitable, Callable, Dict, Iterator, Optional,
+                    Tuple)
+
+from metrics import span
+
+# the priority lanes, the lower the sooner
+INTERACTIVE = 0
+BATCH = 1
+
+_lane: contextvars.ContextVar = contextvars.ContextVar("lane",
+                                                       default=INTERACTIVE)
+
+
+@contextlib.contextmanager
+def lane(priority: int) -> Iterator[None]:
+    """
+    Sends the requests made inside the with block in a priority lane.
+
+    Args:
+        priority (int): INTERACTIVE or BATCH.
+    """
+    token = _lane.set(priority)
+    try:
+        yield
+    finally:
+        _lane.reset(token)
+
+
+class RateLimiter:
+    """
+    Token buckets of requests and of tokens per minute. A bucket is refilled
+    continuously and holds at most one minute of its budget.
+    """
+
+    def __init__(self, requests_per_minute: int, tokens_per_minute: int = 0):
+        """
+        Args:
+            requests_per_minute (int): The largest number of requests per
+                minute, or 0 for no limit.
+            tokens_per_minute (int): The largest number of tokens per
+                minute, or 0 for no limit.
+        """
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._requests = float(requests_per_minute)
+        self._tokens = float(tokens_per_minute)
+        self._updated = time.monotonic()
+        self._waiting = {INTERACTIVE: 0, BATCH: 0}
+        self._condition = threading.Condition()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        minutes = (now - self._updated) / 60
+        self._updated = now
+        self._requests = min(
+            self.requests_per_minute,
+            self._requests + minutes * self.requests_per_minute)
+        self._tokens = min(self.tokens_per_minute,
+                           self._tokens + minutes * self.tokens_per_minute)
+
+    def _delay(self, tokens: int) -> float:
+        # the seconds until both buckets have enough room
+        delay = 0.0
+        if self.requests_per_minute and self._requests < 1:
+            delay = (1 - self._requests) * 60 / self.requests_per_minute
+        if self.tokens_per_minute and self._tokens < tokens:
+            delay = max(delay, (tokens - self._tokens) * 60
+                        / self.tokens_per_minute)
+        return delay
+
+    def acquire(self, tokens: int = 0, priority: int = INTERACTIVE) -> None:
+        """
+        Waits until there is room for one request of the given number of
+        tokens, and takes it. Batch requests wait while interactive ones
+        are waiting.
+
+        Args:
+            tokens (int): The estimated number of tokens of the request.
+            priority (int): INTERACTIVE or BATCH.
+        """
+        if self.tokens_per_minute:
+            # a request larger than the bucket waits for a full bucket
+            tokens = min(tokens, self.tokens_per_minute)
+        with self._condition:
+            self._waiting[priority] += 1
+            try:
+                while True:
+                    self._refill()
+                    delay = self._delay(tokens)
+                    if priority == BATCH and self._waiting[INTERACTIVE]:
+                        delay = max(delay, 0.05)
+                    if delay <= 0:
+                        break
+                    self._condition.wait(delay)
+                if self.requests_per_minute:
+                    self._requests -= 1
+                if self.tokens_per_minute:
+                    self._tokens -= tokens
+            finally:
+                self._waiting[priority] -= 1
+                self._condition.notify_all()
+
+
+def retry_status(e: Exception) -> Optional[int]:
+    """
+    Args:
+        e (Exception): An error raised by a backend.
+
+    Returns:
+        Optional[int]: The HTTP status of the error if the request can be
+        retried (429 or 5xx), else None.
+    """
+    status = getattr(e, "http_status", None)
+    if status is None:
+        # gTTS and requests errors keep the response
+        response = getattr(e, "rsp", None) or getattr(e, "response", None)
+        status = getattr(response, "status_code", None)
+    if status == 429 or (isinstance(status, int) and 500 <= status < 600):
+        return status
+    return None
+
+
+def retry_after(e: Exception) -> float:
+    """
+    Args:
+        e (Exception): An error raised by a backend.
+
+    Returns:
+        float: The seconds to wait given by the Retry-After header of the
+        response, or 0 if there is none.
+    """
+    headers = getattr(e, "headers", None) or {}
+    try:
+        return float(headers.get("retry-after") or
+                     headers.get("Retry-After") or 0)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+class RequestScheduler:
+    """
+    Sends the requests of one service through a rate limiter, retries them
+    on 429 and 5xx errors and coalesces identical requests in flight.
+    """
+
+    def __init__(self, limiter: RateLimiter, max_retries: int = 5,
+                 backoff_seconds: float = 1.0,
+                 max_backoff_seconds: float = 60.0):
+        """
+        Args:
+            limiter (RateLimiter): The rate limits of the service.
+            max_retries (int): The number of times a request is sent again.
+            backoff_seconds (float): The longest wait before the first retry.
+                It doubles after every retry.
+            max_backoff_seconds (float): The longest wait before a retry.
+        """
+        self.limiter = limiter
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        self.coalesced = 0
+        self.retries = 0
+        self._in_flight: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+
+    def call(self, key: str, fn: Callable[..., Any], *args: Any,
+             tokens: int = 0) -> Any:
+        """
+        Sends a request, or waits for the identical request in flight.
+
+        Args:
+            key (str): Identifies the request; requests with the same key
+                are identical.
+            fn (Callable[..., Any]): The function sending the request.
+            *args (Any): The arguments of the function.
+            tokens (int): The estimated number of tokens of the request.
+
+        Returns:
+            Any: The return value of the function.
+
+        Raises:
+            Exception: The error of the request, once the retries are used
+                up or if it cannot be retried.
+        """
+        future, leader = self._join(key)
+        if not leader:
+            return future.result()
+        try:
+            result = self._send(fn, args, tokens)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            self._leave(key)
+
+    async def acall(self, key: str, fn: Callable[..., Awaitable[Any]],
+                    *args: Any, tokens: int = 0) -> Any:
+        """
+        Sends a request from a coroutine without blocking the event loop,
+        or waits for the identical request in flight.
+
+        Args:
+            key (str): Identifies the request; requests with the same key
+                are identical.
+            fn (Callable[..., Awaitable[Any]]): The coroutine function
+                sending the request.
+            *args (Any): The arguments of the function.
+            tokens (int): The estimated number of tokens of the request.
+
+        Returns:
+            Any: The return value of the function.
+
+        Raises:
+            Exception: The error of the request, once the retries are used
+                up or if it cannot be retried.
+        """
+        future, leader = self._join(key)
+        if not leader:
+            return await asyncio.wrap_future(future)
+        try:
+            result = await self._asend(fn, args, tokens)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            self._leave(key)
+
+    def _join(self, key: str) -> Tuple[Future, bool]:
+        # returns the future of the request and whether the caller sends it
+        with self._lock:
+            future = self._in_flight.get(key)
+            if future is not None:
+                self.coalesced += 1
+                return future, False
+            future = Future()
+            self._in_flight[key] = future
+            return future, True
+
+    def _leave(self, key: str) -> None:
+        with self._lock:
+            del self._in_flight[key]
+
+    def _retry_delay(self, e: Exception, attempt: int) -> Optional[float]:
+        # the seconds to wait before sending the request again, or None if
+        # it must not be sent again
+        status = retry_status(e)
+        if status is None or attempt == self.max_retries:
+            return None
+        # full jitter, so that clients throttled together do not retry
+        # together
+        delay = random.uniform(0, min(self.max_backoff_seconds,
+                                      self.backoff_seconds * 2 ** attempt))
+        delay = max(delay, retry_after(e))
+        print(f"Request failed with status {status}, retrying in "
+              f"{delay:.1f} s")
+        with self._lock:
+            self.retries += 1
+        return delay
+
+    def _send(self, fn: Callable[..., Any], args: Tuple[Any, ...],
+              tokens: int) -> Any:
+        priority = _lane.get()
+        for attempt in range(self.max_retries + 1):
+            with span("rate_limit_wait"):
+                self.limiter.acquire(tokens, priority)
+            try:
+                return fn(*args)
+            except Exception as e:
+                delay = self._retry_delay(e, attempt)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+
+    async def _asend(self, fn: Callable[..., Awaitable[Any]],
+                     args: Tuple[Any, ...], tokens: int) -> Any:
+        priority = _lane.get()
+        for attempt in range(self.max_retries + 1):
+            with span("rate_limit_wait"):
+                await asyncio.to_thread(self.limiter.acquire, tokens,
+                                        priority)
+            try:
+                return await fn(*args)
+            except Exception as e:
+                delay = self._retry_delay(e, attempt)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+
+
+_schedulers: Dict[Tuple[Any, ...], RequestScheduler] = {}
+_schedulers_lock = threading.Lock()
+
+
+def get_scheduler(service: str, requests_per_minute: int,
+                  tokens_per_minute: int = 0, max_retries: int = 5,
+                  backoff_seconds: float = 1.0,
+                  max_backoff_seconds: float = 60.0) -> RequestScheduler:
+    """
+    Returns the scheduler of a service with these settings, creating it on
+    first use, so that all Streamlit sessions, reruns and worker threads of
+    this process share its limits.
+
+    Args:
+        service (str): The name of the service, such as translation.
+        requests_per_minute (int): The largest number of requests per
+            minute, or 0 for no limit.
+        tokens_per_minute (int): The largest number of tokens per minute,
+            or 0 for no limit.
+        max_retries (int): The number of times a request is sent again.
+        backoff_seconds (float): The longest wait before the first retry.
+        max_backoff_seconds (float): The longest wait before a retry.
+
+    Returns:
+        RequestScheduler: The shared scheduler.
+    """
+    key = (service, requests_per_minute, tokens_per_minute, max_retries,
+           backoff_seconds, max_backoff_seconds)
+    with _schedulers_lock:
+        scheduler = _schedulers.get(key)
+        if scheduler is None:
+            scheduler = RequestScheduler(
+                RateLimiter(requests_per_minute, tokens_per_minute),
+                max_retries, backoff_seconds, max_backoff_seconds)
+            _schedulers[key] = scheduler
+        return scheduler
@@ -0,0 +1,103 @@
+import math
+import re
+from typing import List
+
+# a sentence ends with ., !, ?, an ellipsis or their CJK equivalents,
+# optionally followed by a closing quote or bracket
+_SENTENCE_END = re.compile(r'(?<=[.!?…。！？])\s+'
+                           r'|(?<=[.!?…。！？]["\'”’)\]])\s+'
+                           r'|(?<=[。！？])')
+
+# characters of scripts written without spaces, which take about one token
+# each instead of about four characters per token
+_WIDE_CHAR = re.compile(r'[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff'
+                        r'\uac00-\ud7af\uf900-\ufaff]')
+
+
+def split_sentences(text: str) -> List[str]:
+    """
+    Splits a text into sentences.
+
+    Args:
+        text (str): The text to be split.
+
+    Returns:
+        List[str]: The non-empty sentences of the text, in order.
+    """
+    return [sentence.strip() for sentence in _SENTENCE_END.split(text)
+            if sentence.strip()]
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Estimates the number of tokens of a text without a tokenizer: about
+    four characters per token, and one token per CJK character.
+
+    Args:
+        text (str): The text to be measured.
+
+    Returns:
+        int: The estimated number of tokens.
+    """
+    wide = len(_WIDE_CHAR.findall(text))
+    return wide + math.ceil((len(text) - wide) / 4)
+
+
+def join_sentences(pieces: List[str]) -> str:
+    """
+    Joins sentences with a space, except after a CJK sentence, which is not
+    followed by spaces.
+
+    Args:
+        pieces (List[str]): The sentences or groups of sentences to join.
+
+    Returns:
+        str: The joined text.
+    """
+    text = pieces[0] if pieces else ""
+    for piece in pieces[1:]:
+        text += piece if text.endswith(("。", "！", "？")) else " " + piece
+    return text
+
+
+def _pack(pieces: List[str], max_tokens: int) -> List[List[str]]:
+    groups = []
+    group = []
+    group_tokens = 0
+    for piece in pieces:
+        tokens = estimate_tokens(piece) + 1
+        if group and group_tokens + tokens > max_tokens:
+            groups.append(group)
+            group = []
+            group_tokens = 0
+        group.append(piece)
+        group_tokens += tokens
+    if group:
+        groups.append(group)
+    return groups
+
+
+def pack_sentences(text: str, max_tokens: int) -> List[str]:
+    """
+    Splits a text into batches of whole consecutive sentences of at most
+    about max_tokens each. A sentence longer than max_tokens is split
+    between words, or between characters if it has no spaces.
+
+    Args:
+        text (str): The text to be split.
+        max_tokens (int): The largest estimated number of tokens of a batch.
+
+    Returns:
+        List[str]: The batches of the text, in order.
+    """
+    pieces = []
+    for sentence in split_sentences(text):
+        if estimate_tokens(sentence) <= max_tokens:
+            pieces.append(sentence)
+        elif " " in sentence:
+            pieces += [" ".join(words) for words in
+                       _pack(sentence.split(), max_tokens)]
+        else:
+            pieces += ["".join(chars) for chars in
+                       _pack(list(sentence), max_tokens)]
+    return [join_sentences(group) for group in _pack(pieces, max_tokens)]
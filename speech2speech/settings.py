@@ -0,0 +1,346 @@
+import configparser
+import os
+import threading
+from typing import Any, Dict, Optional, Tuple
+
+from backends import SYNTHESIZERS, TRANSCRIBERS, TRANSLATORS
+from encoding import UPLOAD_CODECS
+
+# the settings of each config file and the modification time they were
+# read at
+_loaded: Dict[str, Tuple[Optional[int], Dict[str, Any]]] = {}
+_loaded_lock = threading.Lock()
+
+
+def load_settings(filename: str = "config.ini") -> Dict[str, Any]:
+    """
+    Returns the configuration values of a config file. The file is only
+    parsed again when its modification time changes, and the same dict is
+    returned until then, so it must not be modified.
+
+    Args:
+        filename (str): The path of the config file.
+
+    Returns:
+        Dict[str, Any]: The configuration values by name.
+
+    Raises:
+        configparser.Error: If there is an error reading the configuration file.
+        ValueError: If any of the configuration values are invalid.
+    """
+    path = os.path.abspath(filename)
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        mtime = None
+    with _loaded_lock:
+        loaded = _loaded.get(path)
+        if loaded is not None and loaded[0] == mtime:
+            return loaded[1]
+        settings = parse_settings(path)
+        _loaded[path] = (mtime, settings)
+        return settings
+
+
+def parse_settings(filename: str) -> Dict[str, Any]:
+    """
+    Reads and validates the configuration values from a config file.
+
+    Args:
+        filename (str): The path of the config file.
+
+    Returns:
+        Dict[str, Any]: The configuration values by name.
+
+    Raises:
+        configparser.Error: If there is an error reading the configuration file.
+        ValueError: If any of the configuration values are invalid.
+    """
+    try:
+        config = configparser.ConfigParser()
+        config.read(filename)
+
+        channels = config.getint('audio', 'channels')
+        rate = config.getint('audio', 'rate')
+        chunk = config.getint('audio', 'chunk')
+        spool = config.getboolean('audio', 'spool')
+        max_record_seconds = config.getint('audio', 'max_record_seconds')
+        source_lang_audio_filename = config.get('audio',
+                                                'source_lang_audio_filename')
+        transcript_filename = config.get('files', 'transcript_filename')
+        translation_filename = config.get('files', 'translation_filename')
+        target_lang_audio_filename = config.get('files',
+                                                'target_lang_audio_filename')
+        persist = config.getboolean('files', 'persist')
+        sessions_dir = config.get('files', 'sessions_dir')
+        max_session_age_hours = config.getfloat('storage',
+                                                'max_session_age_hours')
+        max_sessions_mb = config.getint('storage', 'max_sessions_mb')
+        auto_stop = config.getboolean('vad', 'auto_stop')
+        silence_seconds = config.getfloat('vad', 'silence_seconds')
+        energy_threshold_db = config.getfloat('vad', 'energy_threshold_db')
+        zcr_threshold = config.getfloat('vad', 'zcr_threshold')
+        max_silence_seconds = config.getfloat('vad', 'max_silence_seconds')
+        live = config.getboolean('live', 'enabled')
+        live_pause_seconds = config.getfloat('live', 'pause_seconds')
+        live_max_utterance_seconds = config.getfloat('live',
+                                                     'max_utterance_seconds')
+        live_speak = config.getboolean('live', 'speak')
+        live_transcribe_workers = config.getint('live', 'transcribe_workers')
+        live_translate_workers = config.getint('live', 'translate_workers')
+        live_synthesize_workers = config.getint('live', 'synthesize_workers')
+        live_queue_size = config.getint('live', 'queue_size')
+        cache_dir = config.get('cache', 'cache_dir')
+        transcription_cache_mb = config.getint('cache',
+                                               'transcription_cache_mb')
+        translation_cache_mb = config.getint('cache', 'translation_cache_mb')
+        translation_cache_ttl_hours = config.getfloat(
+            'cache', 'translation_cache_ttl_hours')
+        speech_cache_mb = config.getint('cache', 'speech_cache_mb')
+        max_chunk_seconds = config.getfloat('transcription',
+                                            'max_chunk_seconds')
+        chunk_overlap_seconds = config.getfloat('transcription',
+                                                'chunk_overlap_seconds')
+        transcription_workers = config.getint('transcription', 'max_workers')
+        preprocess = config.getboolean('transcription', 'preprocess')
+        target_rate = config.getint('transcription', 'target_rate')
+        target_rms_db = config.getfloat('transcription', 'target_rms_db')
+        max_peak_db = config.getfloat('transcription', 'max_peak_db')
+        upload_codec = config.get('transcription', 'upload_codec')
+        upload_bitrate_kbps = config.getint('transcription',
+                                            'upload_bitrate_kbps')
+        translation_workers = config.getint('translation', 'max_workers')
+        translation_batch_tokens = config.getint('translation',
+                                                 'max_batch_tokens')
+        translation_memory = config.getboolean('translation', 'memory')
+        translation_memory_threshold = config.getfloat('translation',
+                                                       'memory_threshold')
+        translation_memory_max_sentences = config.getint(
+            'translation', 'memory_max_sentences')
+        synthesis_workers = config.getint('speech', 'max_workers')
+        job_workers = config.getint('jobs', 'workers')
+        max_waiting_jobs = config.getint('jobs', 'max_waiting')
+        transcription_requests_per_minute = config.getint(
+            'rate_limits', 'transcription_requests_per_minute')
+        translation_requests_per_minute = config.getint(
+            'rate_limits', 'translation_requests_per_minute')
+        translation_tokens_per_minute = config.getint(
+            'rate_limits', 'translation_tokens_per_minute')
+        max_retries = config.getint('rate_limits', 'max_retries')
+        backoff_seconds = config.getfloat('rate_limits', 'backoff_seconds')
+        max_backoff_seconds = config.getfloat('rate_limits',
+                                              'max_backoff_seconds')
+        http_pool_size = config.getint('http', 'pool_size')
+        openai_api_base = config.get('http', 'openai_api_base')
+        transcriber = config.get('backends', 'transcriber')
+        translator = config.get('backends', 'translator')
+        synthesizer = config.get('backends', 'synthesizer')
+        stub_latency_ms = config.getint('backends', 'stub_latency_ms')
+        whisper_model = config.get('whisper', 'model')
+        whisper_threads = config.getint('whisper', 'threads')
+        whisper_batch_size = config.getint('whisper', 'batch_size')
+        whisper_language = config.get('whisper', 'language')
+        metrics_enabled = config.getboolean('metrics', 'enabled')
+        metrics_filename = config.get('metrics', 'metrics_filename')
+        prometheus_filename = config.get('metrics', 'prometheus_filename')
+        metrics_panel_runs = config.getint('metrics', 'panel_runs')
+        lang_codes = config.get('languages', 'lang_codes')
+        log = config.getint('debugging', 'log')
+
+        if not isinstance(channels, int) or channels <= 0:
+            raise ValueError("'channels' must be a positive integer.")
+        if not isinstance(rate, int) or rate <= 0:
+            raise ValueError("'rate' must be a positive integer.")
+        if not isinstance(chunk, int) or chunk <= 0:
+            raise ValueError("'chunk' must be a positive integer.")
+        if max_record_seconds <= 0:
+            raise ValueError("'max_record_seconds' must be a positive "
+                             "integer.")
+        if silence_seconds <= 0:
+            raise ValueError("'silence_seconds' must be positive.")
+        if max_silence_seconds < 0:
+            raise ValueError("'max_silence_seconds' must not be negative.")
+        if live_pause_seconds <= 0:
+            raise ValueError("'pause_seconds' must be positive.")
+        if live_max_utterance_seconds <= live_pause_seconds:
+            raise ValueError("'max_utterance_seconds' must be greater than "
+                             "'pause_seconds'.")
+        if live_transcribe_workers <= 0:
+            raise ValueError("'transcribe_workers' must be a positive "
+                             "integer.")
+        if live_translate_workers <= 0:
+            raise ValueError("'translate_workers' must be a positive "
+                             "integer.")
+        if live_synthesize_workers <= 0:
+            raise ValueError("'synthesize_workers' must be a positive "
+                             "integer.")
+        if live_queue_size <= 0:
+            raise ValueError("'queue_size' must be a positive integer.")
+        if max_session_age_hours < 0:
+            raise ValueError("'max_session_age_hours' must not be negative.")
+        if max_sessions_mb < 0:
+            raise ValueError("'max_sessions_mb' must not be negative.")
+        if transcription_cache_mb <= 0:
+            raise ValueError("'transcription_cache_mb' must be a positive "
+                             "integer.")
+        if translation_cache_mb <= 0:
+            raise ValueError("'translation_cache_mb' must be a positive "
+                             "integer.")
+        if translation_cache_ttl_hours <= 0:
+            raise ValueError("'translation_cache_ttl_hours' must be "
+                             "positive.")
+        if speech_cache_mb <= 0:
+            raise ValueError("'speech_cache_mb' must be a positive integer.")
+        if max_chunk_seconds <= 0:
+            raise ValueError("'max_chunk_seconds' must be positive.")
+        if chunk_overlap_seconds < 0:
+            raise ValueError("'chunk_overlap_seconds' must not be negative.")
+        if transcription_workers <= 0:
+            raise ValueError("'max_workers' must be a positive integer.")
+        if target_rate <= 0:
+            raise ValueError("'target_rate' must be a positive integer.")
+        if max_peak_db > 0:
+            raise ValueError("'max_peak_db' must not be positive.")
+        if target_rms_db > max_peak_db:
+            raise ValueError("'target_rms_db' must not be greater than "
+                             "'max_peak_db'.")
+        if upload_codec not in UPLOAD_CODECS:
+            raise ValueError(f"'upload_codec' must be one of "
+                             f"{tuple(UPLOAD_CODECS)}.")
+        if upload_bitrate_kbps <= 0:
+            raise ValueError("'upload_bitrate_kbps' must be a positive "
+                             "integer.")
+        if translation_workers <= 0:
+            raise ValueError("'max_workers' must be a positive integer.")
+        if translation_batch_tokens <= 0:
+            raise ValueError("'max_batch_tokens' must be a positive integer.")
+        if not 0 < translation_memory_threshold <= 1:
+            raise ValueError("'memory_threshold' must be greater than 0 and "
+                             "at most 1.")
+        if translation_memory_max_sentences <= 0:
+            raise ValueError("'memory_max_sentences' must be a positive "
+                             "integer.")
+        if synthesis_workers <= 0:
+            raise ValueError("'max_workers' must be a positive integer.")
+        if job_workers <= 0:
+            raise ValueError("'workers' must be a positive integer.")
+        if max_waiting_jobs <= 0:
+            raise ValueError("'max_waiting' must be a positive integer.")
+        if transcription_requests_per_minute < 0:
+            raise ValueError("'transcription_requests_per_minute' must not "
+                             "be negative.")
+        if translation_requests_per_minute < 0:
+            raise ValueError("'translation_requests_per_minute' must not be "
+                             "negative.")
+        if translation_tokens_per_minute < 0:
+            raise ValueError("'translation_tokens_per_minute' must not be "
+                             "negative.")
+        if max_retries < 0:
+            raise ValueError("'max_retries' must not be negative.")
+        if backoff_seconds < 0:
+            raise ValueError("'backoff_seconds' must not be negative.")
+        if max_backoff_seconds < backoff_seconds:
+            raise ValueError("'max_backoff_seconds' must not be less than "
+                             "'backoff_seconds'.")
+        if http_pool_size < 0:
+            raise ValueError("'pool_size' must not be negative.")
+        if openai_api_base and not openai_api_base.startswith(
+                ("http://", "https://")):
+            raise ValueError("'openai_api_base' must be an http:// or "
+                             "https:// URL.")
+        if transcriber not in TRANSCRIBERS:
+            raise ValueError(f"'transcriber' must be one of {TRANSCRIBERS}.")
+        if translator not in TRANSLATORS:
+            raise ValueError(f"'translator' must be one of {TRANSLATORS}.")
+        if synthesizer not in SYNTHESIZERS:
+            raise ValueError(f"'synthesizer' must be one of {SYNTHESIZERS}.")
+        if stub_latency_ms < 0:
+            raise ValueError("'stub_latency_ms' must not be negative.")
+        if not whisper_model:
+            raise ValueError("'model' must not be empty.")
+        if whisper_threads < 0:
+            raise ValueError("'threads' must not be negative.")
+        if whisper_batch_size <= 0:
+            raise ValueError("'batch_size' must be a positive integer.")
+        if metrics_panel_runs <= 0:
+            raise ValueError("'panel_runs' must be a positive integer.")
+
+    except configparser.Error as e:
+        raise configparser.Error(f"Error reading configuration file: {e.args}")
+
+    except ValueError as e:
+        raise ValueError(f"Invalid configuration value: {e.args}")
+
+    return {
+        "channels": channels,
+        "rate": rate,
+        "chunk": chunk,
+        "spool": spool,
+        "max_record_seconds": max_record_seconds,
+        "persist": persist,
+        "sessions_dir": sessions_dir,
+        "max_session_age_hours": max_session_age_hours,
+        "max_sessions_mb": max_sessions_mb,
+        "auto_stop": auto_stop,
+        "silence_seconds": silence_seconds,
+        "energy_threshold_db": energy_threshold_db,
+        "zcr_threshold": zcr_threshold,
+        "max_silence_seconds": max_silence_seconds,
+        "live": live,
+        "live_pause_seconds": live_pause_seconds,
+        "live_max_utterance_seconds": live_max_utterance_seconds,
+        "live_speak": live_speak,
+        "live_transcribe_workers": live_transcribe_workers,
+        "live_translate_workers": live_translate_workers,
+        "live_synthesize_workers": live_synthesize_workers,
+        "live_queue_size": live_queue_size,
+        "source_lang_audio_filename": source_lang_audio_filename,
+        "transcript_filename": transcript_filename,
+        "translation_filename": translation_filename,
+        "target_lang_audio_filename": target_lang_audio_filename,
+        "cache_dir": cache_dir,
+        "transcription_cache_mb": transcription_cache_mb,
+        "translation_cache_mb": translation_cache_mb,
+        "translation_cache_ttl_hours": translation_cache_ttl_hours,
+        "speech_cache_mb": speech_cache_mb,
+        "max_chunk_seconds": max_chunk_seconds,
+        "chunk_overlap_seconds": chunk_overlap_seconds,
+        "transcription_workers": transcription_workers,
+        "preprocess": preprocess,
+        "target_rate": target_rate,
+        "target_rms_db": target_rms_db,
+        "max_peak_db": max_peak_db,
+        "upload_codec": upload_codec,
+        "upload_bitrate_kbps": upload_bitrate_kbps,
+        "translation_workers": translation_workers,
+        "translation_batch_tokens": translation_batch_tokens,
+        "translation_memory": translation_memory,
+        "translation_memory_threshold": translation_memory_threshold,
+        "translation_memory_max_sentences": translation_memory_max_sentences,
+        "synthesis_workers": synthesis_workers,
+        "job_workers": job_workers,
+        "max_waiting_jobs": max_waiting_jobs,
+        "transcription_requests_per_minute":
+            transcription_requests_per_minute,
+        "translation_requests_per_minute": translation_requests_per_minute,
+        "translation_tokens_per_minute": translation_tokens_per_minute,
+        "max_retries": max_retries,
+        "backoff_seconds": backoff_seconds,
+        "max_backoff_seconds": max_backoff_seconds,
+        "http_pool_size": http_pool_size,
+        "openai_api_base": openai_api_base,
+        "transcriber": transcriber,
+        "translator": translator,
+        "synthesizer": synthesizer,
+        "stub_latency_ms": stub_latency_ms,
+        "whisper_model": whisper_model,
+        "whisper_threads": whisper_threads,
+        "whisper_batch_size": whisper_batch_size,
+        "whisper_language": whisper_language,
+        "metrics_enabled": metrics_enabled,
+        "metrics_filename": metrics_filename,
+        "prometheus_filename": prometheus_filename,
+        "metrics_panel_runs": metrics_panel_runs,
+        "lang_codes": lang_codes.split(","),
+        "log": log,
+    }
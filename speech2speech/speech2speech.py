@@ -1,30 +1,43 @@
-import configparser
+import functools
 import os
+import queue
 import sys
 import threading
-import wave
-from typing import Tuple
+import time
+import uuid
+from typing import Any, Callable, List, Optional
 
-import openai
-import psutil
-import pyaudio
-import pyautogui
 import streamlit as st
-from gtts import gTTS
-from pydub import AudioSegment
-from pydub.playback import play
-from pynput import keyboard
-import markdown
+
+from artifacts import ARTIFACTS, ArtifactStore, schedule_prune
+from backends import is_openai_error, load_backends
+from jobs import Job, QueueFull, get_job_queue
+from metrics import (Run, current_run, get_recorder, record_size, span,
+                     start_run)
+from pipeline import (Utterance, language_filename, speech_cache,
+                      synthesize_into, transcribe_file, transcribe_long,
+                      transcription_cache, translate_batched, translate_long,
+                      translate_to_many, translation_cache,
+                      translation_memory, utterance_stages)
+from segmenter import join_sentences
+from settings import load_settings
+from stages import StagePipeline
+from streaming import LiveSession
+
+# Streamlit reruns this script on every interaction, so heavy packages such
+# as pyaudio, numpy, openai, pynput, psutil and markdown are imported
+# inside the functions that use them, the first time they run.
 
 
 # define a function to handle keyboard input
-def on_press(key):
-    if key == keyboard.Key.ctrl_l and not listener.recording:
+def on_press(engine, key):
+    from pynput import keyboard
+
+    if key == keyboard.Key.ctrl_l and not engine.start_event.is_set():
         print("Recording... Press CTRL+E to stop recording.")
-        listener.recording = True
-    elif key == keyboard.Key.e and listener.recording:
-        listener.recording = False
-        return False
+        engine.start()
+    elif key == keyboard.Key.e and engine.recording:
+        engine.stop()
 
 
 def check_file_exists(filepath, config_filename):
@@ -70,7 +83,8 @@ def main() -> None:
                  "more info, please visit the [speech2speech Gihub site]("
                  "https://github.com/rcdalj/speech2speech).")
 
-        read_config()
+        with span("read_config"):
+            read_config()
         col1, col2 = st.columns([1,2])
         st.session_state.disabled = False
         st.session_state.recording_stopped = False
@@ -81,8 +95,7 @@ def main() -> None:
                 placeholder="Paste your openAI API key, sk-",
                 type="password",
             )
-            if user_secret:
-                openai.api_key = user_secret
+            st.session_state.openai_api_key = user_secret or None
             record_button = st.button(
                 "Record Audio",
                 key="record",
@@ -114,6 +127,21 @@ def main() -> None:
             placeholder_6 = st.empty()
             placeholder_7 = st.empty()
 
+            target_langs = st.multiselect(
+                "Target Languages",
+                st.session_state.lang_codes,
+                key="target_langs",
+            )
+            batched = st.checkbox(
+                "Single request for all languages",
+                key="batched",
+            )
+            translate_many_button = st.button(
+                "Translate to Selected Languages",
+                use_container_width=True
+            )
+            placeholder_10 = st.empty()
+
             read_translation_button = st.button(
                 "Read Translation",
                 use_container_width=True,
@@ -129,6 +157,8 @@ def main() -> None:
                              use_container_width=True)
             if help:
                 try:
+                    import markdown
+
                     with open("browser_help.md", 'r') as f:
                         content = f.read()
                     html = markdown.markdown(content)
@@ -137,18 +167,30 @@ def main() -> None:
                     st.error("File README.md not found.")
 
         if record_button:
-            placeholder_1.warning("Recording... Press CTRL+E to stop "
-                                 "recording.")
+            if st.session_state.auto_stop:
+                placeholder_1.warning("Recording... Press CTRL+E or pause "
+                                      "to stop recording.")
+            else:
+                placeholder_1.warning("Recording... Press CTRL+E to stop "
+                                      "recording.")
             stop_event = threading.Event()
             st.session_state.stop_event = stop_event
-            handle_record()
-            placeholder_1.warning(f"Recording saved to"
-                                f" {st.session_state.source_lang_audio_filename}")
+            warning = handle_record(stop_event, placeholder_3, placeholder_6)
+            if warning is not None:
+                placeholder_1.warning(warning)
+            elif st.session_state.persist or st.session_state.spool:
+                filename = st.session_state.artifacts.path(
+                    "source_lang_audio_filename")
+                placeholder_1.warning(f"Recording saved to {filename}")
+            else:
+                placeholder_1.warning("Recording finished")
         if transcribe_button:
             handle_transcribe(placeholder_3, placeholder_4)
         if translate_button:
             handle_translate(target_lang, placeholder_5,
                              placeholder_6, placeholder_7)
+        if translate_many_button:
+            handle_translate_many(target_langs, batched, placeholder_10)
         if read_translation_button:
             handle_read_translation(placeholder_8,
                                     placeholder_9)
@@ -156,105 +198,269 @@ def main() -> None:
         st.write("Error: ", e)
 
 
-def read_config() -> Tuple[str, int, int, int, str, str, str, str]:
+def read_config() -> None:
     """
-    Reads the configuration values from the 'config.ini' file.
-
-    Args:
-
-    Returns:
+    Reads the configuration values from the 'config.ini' file into the
+    Streamlit session state. Nothing is done if the file has not changed
+    since the last run of this session.
 
     Raises:
         configparser.Error: If there is an error reading the configuration file.
         ValueError: If any of the configuration values are invalid.
     """
-    try:
-        config = configparser.ConfigParser()
-        config.read('config.ini')
-
-        channels = config.getint('audio', 'channels')
-        rate = config.getint('audio', 'rate')
-        chunk = config.getint('audio', 'chunk')
-        source_lang_audio_filename = config.get('audio',
-                                                'source_lang_audio_filename')
-        transcript_filename = config.get('files', 'transcript_filename')
-        translation_filename = config.get('files', 'translation_filename')
-        target_lang_audio_filename = config.get('files',
-                                                'target_lang_audio_filename')
-        check_file_exists(target_lang_audio_filename,
-                          "target_lang_audio_filename")
-        lang_codes = config.get('languages', 'lang_codes')
-        log = config.getint('debugging', 'log')
-
-        if not isinstance(channels, int) or channels <= 0:
-            raise ValueError("'channels' must be a positive integer.")
-        if not isinstance(rate, int) or rate <= 0:
-            raise ValueError("'rate' must be a positive integer.")
-        if not isinstance(chunk, int) or chunk <= 0:
-            raise ValueError("'chunk' must be a positive integer.")
-        st.session_state.channels = channels
-        st.session_state.rate = rate
-        st.session_state.chunk = chunk
-        st.session_state.source_lang_audio_filename \
-            = source_lang_audio_filename
-        st.session_state.transcript_filename \
-            = transcript_filename
-        st.session_state.translation_filename \
-            = translation_filename
-        st.session_state.target_lang_audio_filename \
-            = target_lang_audio_filename
-        st.session_state.lang_codes = lang_codes.split(",")
-        st.session_state.log = log
-
-    except configparser.Error as e:
-        raise configparser.Error(f"Error reading configuration file: {e.args}")
-
-    except ValueError as e:
-        raise ValueError(f"Invalid configuration value: {e.args}")
-
-
-def handle_record() -> None:
+    settings = load_settings('config.ini')
+    if st.session_state.get("settings") is settings:
+        return
+    check_file_exists(settings["target_lang_audio_filename"],
+                      "target_lang_audio_filename")
+    for name, value in settings.items():
+        st.session_state[name] = value
+    if "session_id" not in st.session_state:
+        st.session_state.session_id = uuid.uuid4().hex
+        # make room for the new session by deleting old ones
+        if settings["sessions_dir"]:
+            schedule_prune(settings["sessions_dir"],
+                           settings["max_session_age_hours"],
+                           settings["max_sessions_mb"] * 1024 * 1024,
+                           keep={st.session_state.session_id})
+    if "artifacts" not in st.session_state:
+        st.session_state.artifacts = ArtifactStore()
+    st.session_state.artifacts.persist = settings["persist"]
+    # keep the files of each session apart, so that users of the same
+    # server do not overwrite each other's files
+    st.session_state.artifacts.directory = (
+        os.path.join(settings["sessions_dir"], st.session_state.session_id)
+        if settings["sessions_dir"] else None)
+    st.session_state.artifacts.filenames.update(
+        {name: settings[name] for name in ARTIFACTS})
+    st.session_state.settings = settings
+
+
+def handle_record(stop_event: threading.Event, placeholder_3=None,
+                  placeholder_6=None) -> Optional[str]:
     """Launches the recording of audio from the microphone.
 
+    The audio is captured by PortAudio's callback thread straight into the
+    recording's WAV file if spool is on, or else into a preallocated ring
+    buffer, while the calling thread sleeps on stop_event until CTRL+E is
+    pressed or, if auto_stop is on, until the speaker pauses for
+    silence_seconds. Long silences are cut before the recording is stored,
+    and a recording in which no speech was heard is not stored at all, so
+    that it is never sent to be transcribed.
+
+    If live is on, every utterance goes through the transcribe, translate
+    and, with live_speak, synthesize stages into target_lang as soon as the
+    speaker pauses. The stages run at the same time on different
+    utterances, while the calling thread shows the results so far. When
+    the recording stops, the transcript, translation and speech are stored
+    as if Transcribe, Translate and Read Translation had been clicked.
+
     Args:
+        stop_event (threading.Event): The event that stops the recording.
+        placeholder_3: A Streamlit placeholder to display the live
+            transcript, or None to turn live transcription off.
+        placeholder_6: A Streamlit placeholder to display the live
+            translation.
+
+    Returns:
+        Optional[str]: A warning to show about the recording, or None.
 
     Raises:
         Exception: Raised if there is an error while recording audio.
 
     """
+    from pynput import keyboard
+
+    from capture import CaptureEngine
+    from streaming import UtteranceSegmenter
+    from vad import VoiceActivityDetector
+
+    vad = VoiceActivityDetector(
+        st.session_state.rate,
+        st.session_state.channels,
+        energy_threshold_db=st.session_state.energy_threshold_db,
+        zcr_threshold=st.session_state.zcr_threshold,
+        silence_seconds=(st.session_state.silence_seconds
+                         if st.session_state.auto_stop else None),
+        max_silence_seconds=st.session_state.max_silence_seconds)
+    artifacts = st.session_state.artifacts
+    spool_filename = (artifacts.path("source_lang_audio_filename")
+                      if st.session_state.spool else None)
+    live = None
+    segmenter = None
+    if st.session_state.live and placeholder_3 is not None:
+        live = start_live_session()
+        segmenter = UtteranceSegmenter(
+            vad, st.session_state.live_pause_seconds,
+            st.session_state.live_max_utterance_seconds)
+    engine = CaptureEngine(st.session_state.channels,
+                           st.session_state.rate,
+                           st.session_state.chunk,
+                           st.session_state.max_record_seconds,
+                           stop_event=stop_event,
+                           vad=vad,
+                           spool_filename=spool_filename,
+                           segmenter=segmenter)
+    # listen to the keyboard only while recording
+    listener = keyboard.Listener(on_press=functools.partial(on_press, engine))
     try:
-        p = pyaudio.PyAudio()
-
-        # open the stream
-        stream = p.open(format=pyaudio.paInt16,
-                        channels=st.session_state.channels,
-                        rate=st.session_state.rate,
-                        input=True,
-                        frames_per_buffer=st.session_state.chunk)
-
-        # start recording
-        frames = []
-        while listener.running:
-            if listener.recording:
-                data = stream.read(st.session_state.chunk)
-                frames.append(data)
-
-        # stop the stream and PyAudio
-        stream.stop_stream()
-        stream.close()
-        p.terminate()
-
-        # save the recording to a file
-        file_name = st.session_state.source_lang_audio_filename
-        wf = wave.open(file_name, "wb")
-        wf.setnchannels(1)
-        wf.setsampwidth(p.get_sample_size(pyaudio.paInt16))
-        wf.setframerate(st.session_state.rate)
-        wf.writeframes(b"".join(frames))
-        wf.close()
-
+        engine.open()
+        listener.start()
+        with span("record"):
+            # with live transcription, the results so far are shown while
+            # waiting
+            while not engine.wait(0.25 if live is not None else None):
+                live.poll(engine.utterances)
+                show_live_results(live, placeholder_3, placeholder_6)
+    except Exception as e:
+        print(f"Error: {e.args}")
+    finally:
+        listener.stop()
+        engine.close()
+
+    if live is not None:
+        finish_live_session(live, engine, placeholder_3, placeholder_6)
+
+    if not engine.heard_speech:
+        return ("No speech was heard, so the recording was not kept. Speak "
+                "closer to the microphone or lower energy_threshold_db in "
+                "config.ini.")
+    if engine.recorded_bytes == 0:
+        return "Nothing was recorded."
+    # keep the recording, which is saved to a file in the background unless
+    # it was spooled to its file already
+    try:
+        if engine.spool is not None:
+            artifacts.put_file("source_lang_audio_filename",
+                               engine.spool_filename)
+            record_size("recording", os.path.getsize(engine.spool_filename))
+            return None
+        with span("save_recording"):
+            audio = engine.to_wav()
+        artifacts.put("source_lang_audio_filename", audio)
+        record_size("recording", len(audio))
     except Exception as e:
         print(f"Error: {e.args}")
+    if engine.limit_reached:
+        return (f"Recording stopped after max_record_seconds "
+                f"({st.session_state.max_record_seconds} s), the longest "
+                f"kept in memory. Set spool to 1 in config.ini to record "
+                f"longer.")
+    return None
+
+
+def start_live_session() -> LiveSession:
+    """
+    Returns:
+        LiveSession: The session passing the utterances of a recording
+        through the stages of a conversation into target_lang, each stage
+        running its calls on the job queue.
+    """
+    transcriber, translator, synthesizer = load_backends(st.session_state)
+    # the stage threads get the settings and the job queue rather than the
+    # session state, which only the script thread may use
+    job_queue = get_job_queue(st.session_state.job_workers,
+                              st.session_state.max_waiting_jobs)
+
+    def run_queued(fn: Callable[..., Any], *args: Any) -> Any:
+        while True:
+            try:
+                job = job_queue.submit(fn, *args)
+            except QueueFull:
+                # the stage waits, and the stages before it with it
+                time.sleep(0.1)
+                continue
+            return job.result()
+
+    stages = utterance_stages(st.session_state.target_lang, transcriber,
+                              translator, synthesizer,
+                              st.session_state.settings, run_queued)
+    return LiveSession(StagePipeline(stages,
+                                     st.session_state.live_queue_size))
+
+
+def show_live_results(live: LiveSession, placeholder_3, placeholder_6,
+                      finished: bool = False) -> List[Utterance]:
+    """
+    Shows the transcript and the translation of the utterances finished so
+    far, and a player for the speech of each new one, or the error of a new
+    one that failed. A failed utterance keeps its transcript if only its
+    translation or speech failed.
+
+    Args:
+        live (LiveSession): The session of the recording.
+        placeholder_3: A Streamlit placeholder to display the transcript.
+        placeholder_6: A Streamlit placeholder to display the translation.
+        finished (bool): Whether every utterance is done.
+
+    Returns:
+        List[Utterance]: The utterances finished so far.
+    """
+    results = live.results()
+    # an utterance that failed to be transcribed is still its WAV file
+    utterances = [result for result, _ in results
+                  if isinstance(result, Utterance) and result.transcript]
+    if live.submitted:
+        more = "" if finished else " ..."
+        placeholder_3.success(
+            "Transcription:\n"
+            + join_sentences([u.transcript for u in utterances]) + more)
+        placeholder_6.info(
+            "Translation:\n"
+            + join_sentences([u.translation for u in utterances
+                              if u.translation]) + more)
+    for index, (result, error) in enumerate(results[live.shown:],
+                                            live.shown):
+        if error is not None:
+            st.error(f"Error processing utterance {index + 1}: {error}")
+        elif result.speech:
+            st.caption(result.translation)
+            st.audio(result.speech, format="audio/mp3")
+    live.shown = len(results)
+    return utterances
+
+
+def finish_live_session(live: LiveSession, engine, placeholder_3,
+                        placeholder_6) -> None:
+    """
+    Waits for the last utterances of a recording, stores its transcript,
+    translation and speech, and shows the throughput of each stage.
+
+    Args:
+        live (LiveSession): The session of the recording.
+        engine (capture.CaptureEngine): The closed engine of the recording.
+        placeholder_3: A Streamlit placeholder to display the transcript.
+        placeholder_6: A Streamlit placeholder to display the translation.
+    """
+    with span("live_finish"):
+        live.poll(engine.utterances)
+        while not live.finished:
+            show_live_results(live, placeholder_3, placeholder_6)
+            time.sleep(0.1)
+            live.poll(engine.utterances)
+    utterances = show_live_results(live, placeholder_3, placeholder_6,
+                                   finished=True)
+    if not live.submitted:
+        return
+    report = live.pipeline.report()
+    bottleneck = live.pipeline.bottleneck()
+    with st.expander("Stage Throughput"):
+        st.table(report)
+        st.caption(f"Bottleneck: {bottleneck}")
+    if st.session_state.log:
+        print(f"Live stages: {report}, bottleneck: {bottleneck}")
+
+    artifacts = st.session_state.artifacts
+    st.session_state.transcription = join_sentences(
+        [u.transcript for u in utterances])
+    st.session_state.transcript_timeline = []
+    artifacts.put_text("transcript_filename", st.session_state.transcription)
+    st.session_state["translation"] = join_sentences(
+        [u.translation for u in utterances if u.translation])
+    artifacts.put_text("translation_filename", st.session_state.translation)
+    speech = b"".join(u.speech for u in utterances)
+    if speech:
+        artifacts.put("target_lang_audio_filename", speech)
 
 
 def handle_transcribe(placeholder_3, placeholder_4) -> None:
@@ -267,38 +473,65 @@ def handle_transcribe(placeholder_3, placeholder_4) -> None:
         placeholder_4: A Streamlit placeholder to display the
             location of the transcript file.
     """
-    check_file_exists(st.session_state.source_lang_audio_filename,
-                      "source_lang_audio_filename")
-    st.session_state.transcription = transcribe_audio()
-    with placeholder_3:
+    artifacts = st.session_state.artifacts
+    # a recording on disk is memory-mapped rather than read into memory
+    audio_filename = artifacts.file("source_lang_audio_filename")
+    if audio_filename is None:
+        audio = artifacts.get("source_lang_audio_filename")
+        st.session_state.transcription = transcribe_audio(audio)
+    else:
+        st.session_state.transcription = transcribe_audio(
+            audio_filename=audio_filename)
+    with placeholder_3.container():
         st.success(f"Transcription:\n{st.session_state.transcription}")
-    try:
-        with open(st.session_state.transcript_filename, "w") as f:
-            f.write(st.session_state.transcription)
-    except Exception as e:
-        print(f"Error saving transcript file: {e.args}")
-    placeholder_4.warning(
-        f"Transcription saved to "
-        f"{st.session_state.transcript_filename}")
-
-
-def transcribe_audio() -> str:
-    """Transcribe an audio file using OpenAI's Whisper API.
+        if len(st.session_state.get("transcript_timeline", [])) > 1:
+            with st.expander("Transcript Timeline"):
+                for chunk in st.session_state.transcript_timeline:
+                    st.write(f"{chunk['start']:.1f}s - {chunk['end']:.1f}s: "
+                             f"{chunk['text']}")
+    artifacts.put_text("transcript_filename", st.session_state.transcription)
+    if artifacts.persist:
+        placeholder_4.warning(
+            f"Transcription saved to "
+            f"{artifacts.path('transcript_filename')}")
+
+
+def transcribe_audio(audio: bytes = None, audio_filename: str = None) -> str:
+    """Transcribe audio using the configured speech-to-text backend.
+
+    Transcripts are cached on disk by the hash of the audio and the model
+    name, so the same recording is only sent to Whisper once. Long
+    recordings are split at their pauses and their chunks are transcribed
+    concurrently; the start and end of each chunk are kept in
+    st.session_state.transcript_timeline.
 
     Args:
+        audio (bytes): The content of the recorded WAV file.
+        audio_filename (str): The path of the recorded WAV file, which is
+            memory-mapped, if audio is not given.
 
     Returns:
         str: The transcribed text.
     """
     try:
-        with open(st.session_state.source_lang_audio_filename,
-                  "rb") as audio_file:
-            transcript = openai.Audio.transcribe("whisper-1", audio_file)
-            with open(st.session_state.transcript_filename, "w") as f:
-                f.write(transcript["text"])
-            return transcript["text"]
+        cache = transcription_cache(st.session_state)
+        transcriber, _, _ = load_backends(st.session_state)
+        if audio is None:
+            text, st.session_state.transcript_timeline = run_job(
+                transcribe_file, audio_filename, cache, transcriber,
+                st.session_state.settings)
+        else:
+            text, st.session_state.transcript_timeline = run_job(
+                transcribe_long, audio,
+                os.path.basename(
+                    st.session_state.source_lang_audio_filename),
+                cache, transcriber, st.session_state.settings)
+        if st.session_state.log:
+            print(f"Transcription cache: {cache.stats()}")
+        return text
     except Exception as e:
         st.error(f"Error transcribing audio: {e}")
+        st.session_state.transcript_timeline = []
         return ""
 
 
@@ -321,41 +554,36 @@ def handle_translate(target_lang: str, placeholder_5, placeholder_6,
     if not isinstance(target_lang, str):
         raise ValueError("target_lang must be a string")
 
-    check_file_exists(st.session_state.transcript_filename,
-                      "transcript_filename")
-    try:
-        with open(st.session_state.transcript_filename) as f:
-            transcription = f.read()
-            st.session_state.transcription = transcription
-            print(st.session_state.transcription)
-    except Exception as e:
-        print(f"Error reading transcript file: {e.args}")
-    if transcription is None:
-        st.error("No transcription available for translation")
-        return
-    translation = translate_text(target_lang)
+    artifacts = st.session_state.artifacts
+    transcription = artifacts.get_text("transcript_filename")
+    st.session_state.transcription = transcription
+    translation = translate_text(target_lang, transcription)
     st.session_state["translation"] = translation
     with placeholder_5:
         st.success(f"Transcription:\n{transcription}")
     with placeholder_6:
         st.info(f"Translation:\n{translation}")
-    try:
-        with open(st.session_state.translation_filename, "w") as f:
-            f.write(translation)
+    artifacts.put_text("translation_filename", translation)
+    if artifacts.persist:
         placeholder_7.warning(
             f"Translation saved to "
-            f"{st.session_state.translation_filename}")
-    except Exception as e:
-        print(f"Error saving translation file: {e.args}")
+            f"{artifacts.path('translation_filename')}")
 
 
-def translate_text(target_lang: str) -> str:
+def translate_text(target_lang: str, text: str) -> str:
     """
     Translates the given text into the specified target language using
-    OpenAI's GPT-3 API.
+    the configured translation backend.
+
+    Translations are cached on disk by the normalized text, the target
+    language, the engine and the temperature, and expire after
+    translation_cache_ttl_hours. Long texts are translated in batches of
+    sentences of at most translation_batch_tokens, concurrently. With the
+    translation memory on, only the sentences it cannot reuse are sent.
 
     Args:
         target_lang (str): The ISO 639-1 language code for the target language.
+        text (str): The text to be translated.
 
     Returns:
         str: The translated text.
@@ -367,38 +595,74 @@ def translate_text(target_lang: str) -> str:
     if not target_lang:
         raise ValueError("'target_lang' argument is required.")
 
-    try:
-        with open(st.session_state.transcript_filename) as f:
-            text = f.read()
-    except Exception as e:
-        print(f"Error reading transcript file: {e.args}")
+    cache = translation_cache(st.session_state)
+    memory = translation_memory(st.session_state)
+    _, translator, _ = load_backends(st.session_state)
 
-    # Translate text using OpenAI's API
+    # Translate text using the configured backend
     try:
-        response = openai.Completion.create(
-            engine="text-davinci-003",
-            prompt=f"Please translate the following text into '{target_lang}': {text}",
-            max_tokens=1024,
-            n=1,
-            stop=None,
-            temperature=0,
-        )
-        try:
-            with open(st.session_state.translation_filename, "w") as f:
-                f.write(response.choices[0].text.strip())
-        except Exception as e:
-            print(f"Error writing translation file: {e.args}")
-        return response.choices[0].text.strip()
-    except openai.Error as e:
-        # Catch specific OpenAI errors
-        st.write("OpenAI Error: ", e)
-        return ""
+        translation = run_job(
+            translate_long, text, target_lang, cache, translator,
+            st.session_state.translation_batch_tokens,
+            st.session_state.translation_workers, memory)
+        if st.session_state.log:
+            print(f"Translation cache: {cache.stats()}")
+            if memory is not None:
+                print(f"Translation memory: {memory.stats()}")
+        return translation
     except Exception as e:
-        # Catch all other errors
-        st.write("Error: ", e)
+        if is_openai_error(e):
+            # Catch specific OpenAI errors
+            st.write("OpenAI Error: ", e)
+        else:
+            # Catch all other errors
+            st.write("Error: ", e)
         return ""
 
 
+def handle_translate_many(target_langs: List[str], batched: bool,
+                          placeholder_10) -> None:
+    """
+    If translate_many_button is clicked, translate the transcription into
+    each selected language, save every translation next to
+    translation_filename and display them with their latency.
+
+    Args:
+        target_langs (List[str]): The languages to translate to.
+        batched (bool): Whether to use a single request for all languages.
+        placeholder_10: A Streamlit placeholder to display the translations.
+    """
+    if not target_langs:
+        st.error("Select at least one target language")
+        return
+    artifacts = st.session_state.artifacts
+    transcription = artifacts.get_text("transcript_filename")
+
+    cache = translation_cache(st.session_state)
+    _, translator, _ = load_backends(st.session_state)
+    if batched:
+        results = run_job(translate_batched, transcription, target_langs,
+                          cache, translator)
+    else:
+        results = run_job(translate_to_many, transcription, target_langs,
+                          cache, translator,
+                          st.session_state.translation_workers,
+                          translation_memory(st.session_state))
+
+    rows = []
+    for target_lang in target_langs:
+        translation, latency = results[target_lang]
+        name = f"translation_filename.{target_lang}"
+        artifacts.filenames[name] = language_filename(
+            st.session_state.translation_filename, target_lang)
+        artifacts.put_text(name, translation)
+        rows.append({"language": target_lang,
+                     "latency (s)": round(latency, 3),
+                     "translation": translation,
+                     "file": artifacts.path(name)})
+    placeholder_10.table(rows)
+
+
 def handle_read_translation(placeholder_8,
                             placeholder_9) -> None:
     """
@@ -413,63 +677,173 @@ def handle_read_translation(placeholder_8,
         KeyError: If transcription or translation filenames not available
         in the Streamlit session state.
     """
-    transcription = st.session_state.get("transcription")
-    check_file_exists(st.session_state.translation_filename,
-                      "translation_filename")
-    translation = st.session_state.get("translation")
-    with placeholder_8:
-        st.info(f"Translation:\n{translation}")
+    artifacts = st.session_state.artifacts
+    transcription = artifacts.get_text("transcript_filename")
+    translation = artifacts.get_text("translation_filename")
     if not transcription or not translation:
         raise KeyError("The transcript_filename or translation_filename are "
                        "absent or empty.")
-    read_the_translation()
-    placeholder_9.warning(
-        f"Target language audio file saved to "
-        f"{st.session_state.target_lang_audio_filename}")
+    with placeholder_8.container():
+        st.info(f"Translation:\n{translation}")
+        read_the_translation(translation)
+    if artifacts.persist:
+        placeholder_9.warning(
+            f"Target language audio file saved to "
+            f"{artifacts.path('target_lang_audio_filename')}")
 
 
-def read_the_translation() -> None:
+def read_the_translation(translation: str) -> None:
     """
-    Converts the translated text to speech and plays the resulting audio file
-    using Google gtts.
+    Converts the translated text to speech one sentence at a time using the
+    configured text-to-speech backend, reusing the cached speech of known
+    sentences.
+
+    Each sentence is sent to the browser with st.audio as soon as it is
+    synthesized, while the next ones are still being synthesized, so the
+    first sentence can be played after one request instead of after the
+    whole text. Once all sentences are done, the speech of the whole text is
+    shown and stored.
+
+    Args:
+        translation (str): The text to be read.
 
     Raises:
         ValueError if the translation does not exist or if the target_lang not
         chosen
     """
-    if not st.session_state.translation_filename:
-        raise ValueError("A file with the text to be read must exist")
+    if not translation:
+        raise ValueError("A translation to be read must exist")
     if not st.session_state.target_lang:
         raise ValueError("The 'target_lang' must be chosen.")
 
     # Generate speech from translated text
     try:
-        with open(st.session_state.translation_filename) as f:
-            translation = f.read()
-    except Exception as e:
-        print(f"Error opening the translation file: {e.args}")
-    myobj = gTTS(text=translation, lang=st.session_state.target_lang,
-                 slow=False)
-
-    # Save speech to MP3 file
-    try:
-        myobj.save(st.session_state.target_lang_audio_filename)
+        cache = speech_cache(st.session_state)
+        _, _, synthesizer = load_backends(st.session_state)
+        whole_speech = st.empty()
+        status = st.empty()
+        segments = []
+        start = time.perf_counter()
+        # the job hands each sentence over as soon as it is synthesized,
+        # and None when it is done
+        sentences: queue.Queue = queue.Queue()
+        job = submit_job(synthesize_into, sentences, translation,
+                         st.session_state.target_lang, cache, synthesizer,
+                         st.session_state.synthesis_workers)
+        while True:
+            try:
+                item = sentences.get(timeout=0.5)
+            except queue.Empty:
+                show_job_status(status, job)
+                continue
+            if item is None:
+                break
+            sentence, segment = item
+            if not segments and current_run() is not None:
+                current_run().add_span("first_speech",
+                                       time.perf_counter() - start)
+            status.empty()
+            segments.append(segment)
+            st.caption(sentence)
+            st.audio(segment, format="audio/mp3")
+        job.result()
+        if st.session_state.log:
+            print(f"Speech cache: {cache.stats()}")
+        speech = b"".join(segments)
+        whole_speech.audio(speech, format="audio/mp3")
+        st.session_state.artifacts.put("target_lang_audio_filename", speech)
     except Exception as e:
-        # Handle file save errors
-        print(f"Error saving audio file: {e}")
+        # Handle synthesis errors
+        print(f"Error synthesizing audio: {e}")
+        st.error(f"Error synthesizing audio: {e}")
         return None
 
-    # Play MP3 file
-    try:
-        audio_file = AudioSegment.from_file(
-            st.session_state.target_lang_audio_filename,
-            format="mp3")
-        # Play the MP3 file
-        play(audio_file)
-    except Exception as e:
-        # Handle file play errors
-        print(f"Error playing audio file: {e}")
-        return None
+
+def submit_job(fn: Callable[..., Any], *args: Any) -> Job:
+    """
+    Adds a job to the queue shared by all sessions of the server.
+
+    Args:
+        fn (Callable[..., Any]): The function to run, which must not use
+            Streamlit.
+        *args (Any): The arguments of the function.
+
+    Returns:
+        Job: The submitted job.
+
+    Raises:
+        jobs.QueueFull: If too many jobs are already waiting.
+    """
+    job_queue = get_job_queue(st.session_state.job_workers,
+                              st.session_state.max_waiting_jobs)
+    return job_queue.submit(fn, *args)
+
+
+def show_job_status(status, job: Job) -> None:
+    """
+    Args:
+        status: A Streamlit placeholder to display the status of the job.
+        job (Job): The job.
+    """
+    position = job.position()
+    if position:
+        status.info(f"Waiting in the queue, position {position}...")
+    else:
+        status.info("Working...")
+
+
+def run_job(fn: Callable[..., Any], *args: Any) -> Any:
+    """
+    Runs a function on the job queue and waits for its result, showing the
+    position of the job in the queue until it starts.
+
+    Args:
+        fn (Callable[..., Any]): The function to run, which must not use
+            Streamlit.
+        *args (Any): The arguments of the function.
+
+    Returns:
+        Any: The return value of the function.
+
+    Raises:
+        jobs.QueueFull: If too many jobs are already waiting.
+        Exception: The exception raised by the function.
+    """
+    job = submit_job(fn, *args)
+    status = st.empty()
+    while not job.wait(0.5):
+        show_job_status(status, job)
+    status.empty()
+    return job.result()
+
+
+def handle_metrics(run: Run) -> None:
+    """
+    Saves the measurements of this run of the app and shows those of the
+    last runs in a collapsible panel.
+
+    Args:
+        run (Run): The measurements of this run.
+    """
+    if not st.session_state.get("metrics_enabled"):
+        return
+    recorder = get_recorder(st.session_state.metrics_filename,
+                            st.session_state.prometheus_filename)
+    recorder.record(run)
+    with st.expander("Performance Metrics"):
+        rows = []
+        for entry in recorder.last_runs(st.session_state.metrics_panel_runs):
+            row = {"started": time.strftime("%H:%M:%S",
+                                            time.localtime(entry["started"])),
+                   "peak RSS (MB)": round(entry["peak_rss_bytes"] / 2 ** 20,
+                                          1)}
+            for stage, seconds in entry["seconds"].items():
+                row[f"{stage} (s)"] = round(seconds, 3)
+            for name, size in entry["bytes"].items():
+                row[f"{name} (bytes)"] = size
+            rows.append(row)
+        st.dataframe(rows, use_container_width=True)
+        st.code(recorder.prometheus_text(), language="text")
 
 
 def exit_app():
@@ -478,6 +852,10 @@ def exit_app():
     Returns:
         None
     """
+    # pyautogui needs a display, so it is only imported when closing the tab
+    import psutil
+    import pyautogui
+
     pid = None
 
     # Find the process ID associated with the Streamlit port
@@ -510,8 +888,6 @@ def exit_app():
 
 
 if __name__ == "__main__":
-    # create a listener to capture keyboard input
-    listener = keyboard.Listener(on_press=on_press)
-    listener.recording = False
-    listener.start()
-    main()
+    with start_run() as run:
+        main()
+        handle_metrics(run)
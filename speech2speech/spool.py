@@ -0,0 +1,217 @@
+"""
+Writes recordings straight to a WAV file and reads WAV files through a
+memory-mapped view, so that recordings of any length are never held in
+memory as a whole.
+
+The WAV header is written with placeholder sizes when the spool is opened
+and fixed up when it is closed. A spool left behind by a crash keeps its
+placeholder sizes, which parse_wav() reads as "up to the end of the file".
+"""
+import mmap
+import os
+import struct
+import threading
+from typing import NamedTuple, Tuple
+
+# the size fields of a WAV file that is still being written
+_UNKNOWN_SIZE = 0xFFFFFFFF
+
+
+class WavFormat(NamedTuple):
+    channels: int
+    # the bytes per sample
+    sample_width: int
+    # the sample rate in Hz
+    rate: int
+
+
+def wav_header(fmt: WavFormat, data_bytes: int) -> bytes:
+    """
+    Args:
+        fmt (WavFormat): The format of the PCM audio.
+        data_bytes (int): The size of the PCM audio that follows the header.
+
+    Returns:
+        bytes: The 44-byte header of a PCM WAV file.
+    """
+    block_align = fmt.channels * fmt.sample_width
+    riff_bytes = (_UNKNOWN_SIZE if data_bytes == _UNKNOWN_SIZE
+                  else min(_UNKNOWN_SIZE, 36 + data_bytes))
+    return struct.pack("<4sI4s4sIHHIIHH4sI", b"RIFF", riff_bytes, b"WAVE",
+                       b"fmt ", 16, 1, fmt.channels, fmt.rate,
+                       fmt.rate * block_align, block_align,
+                       8 * fmt.sample_width, b"data",
+                       min(_UNKNOWN_SIZE, data_bytes))
+
+
+def parse_wav(audio) -> Tuple[WavFormat, memoryview]:
+    """
+    Finds the format and the PCM audio of a WAV file without copying it.
+
+    Args:
+        audio (bytes-like): The content of a PCM WAV file, such as bytes or
+            the view of a MappedWav.
+
+    Returns:
+        Tuple[WavFormat, memoryview]: The format, and a view of the PCM
+        audio into audio.
+
+    Raises:
+        ValueError: If audio is not a PCM WAV file.
+    """
+    view = memoryview(audio).cast("B")
+    if len(view) < 12 or view[:4] != b"RIFF" or view[8:12] != b"WAVE":
+        raise ValueError("Not a WAV file")
+    fmt = None
+    offset = 12
+    while offset + 8 <= len(view):
+        chunk_id = bytes(view[offset:offset + 4])
+        size, = struct.unpack_from("<I", view, offset + 4)
+        body = offset + 8
+        if chunk_id == b"fmt ":
+            tag, channels, rate, _, _, bits = struct.unpack_from(
+                "<HHIIHH", view, body)
+            if tag != 1:
+                raise ValueError("Not a PCM WAV file")
+            fmt = WavFormat(channels, bits // 8, rate)
+        elif chunk_id == b"data":
+            if fmt is None:
+                break
+            # the size of a spool that was never closed is unknown
+            end = min(len(view), body + size)
+            data = view[body:end]
+            # drop a partly written sample frame
+            frame_bytes = fmt.channels * fmt.sample_width
+            return fmt, data[:len(data) - len(data) % frame_bytes]
+        # chunks are padded to an even size
+        offset = body + size + size % 2
+    raise ValueError("The WAV file has no format or data chunk")
+
+
+class WavSpool:
+    """
+    Appends PCM audio to a WAV file as it is recorded. The file is written
+    under a temporary name and renamed when the spool is closed, so readers
+    never see a recording in progress.
+    """
+
+    def __init__(self, filename: str, fmt: WavFormat):
+        """
+        Args:
+            filename (str): The path of the WAV file.
+            fmt (WavFormat): The format of the audio.
+        """
+        self.filename = filename
+        self.fmt = fmt
+        self.data_bytes = 0
+        self._tmp_filename = f"{filename}.tmp"
+        directory = os.path.dirname(filename)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = open(self._tmp_filename, "wb")
+        self._file.write(wav_header(fmt, _UNKNOWN_SIZE))
+        self._lock = threading.Lock()
+
+    @property
+    def seconds(self) -> float:
+        return self.data_bytes / (self.fmt.channels * self.fmt.sample_width
+                                  * self.fmt.rate)
+
+    def write(self, data: bytes) -> None:
+        """
+        Args:
+            data (bytes): Interleaved PCM audio in the format of the spool.
+        """
+        with self._lock:
+            if self._file is None:
+                return
+            self._file.write(data)
+            self.data_bytes += len(data)
+
+    def close(self) -> None:
+        """
+        Writes the final sizes into the header and renames the file to its
+        name. Closing a closed spool does nothing.
+        """
+        with self._lock:
+            if self._file is None:
+                return
+            self._file.seek(0)
+            self._file.write(wav_header(self.fmt, self.data_bytes))
+            self._file.close()
+            self._file = None
+        os.replace(self._tmp_filename, self.filename)
+
+    def discard(self) -> None:
+        """
+        Deletes the recording instead of closing it, leaving any earlier
+        file of the same name as it was.
+        """
+        with self._lock:
+            if self._file is None:
+                return
+            self._file.close()
+            self._file = None
+        os.remove(self._tmp_filename)
+
+    def __enter__(self) -> "WavSpool":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+class MappedWav:
+    """
+    A read-only memory map of a WAV file. The operating system pages the
+    audio in as it is read and can drop it again under memory pressure, so
+    the file costs no memory of the process however long it is.
+
+    Views of the map should be released before it is closed.
+    """
+
+    def __init__(self, filename: str):
+        """
+        Args:
+            filename (str): The path of a PCM WAV file.
+
+        Raises:
+            OSError: If the file cannot be opened.
+            ValueError: If it is not a PCM WAV file.
+        """
+        self.filename = filename
+        with open(filename, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            self.fmt, pcm = parse_wav(self._map)
+            self.nframes = len(pcm) // (self.fmt.channels
+                                        * self.fmt.sample_width)
+            pcm.release()
+        except Exception:
+            self._map.close()
+            raise
+
+    @property
+    def seconds(self) -> float:
+        return self.nframes / self.fmt.rate
+
+    def view(self) -> memoryview:
+        """
+        Returns:
+            memoryview: The whole WAV file, header included.
+        """
+        return memoryview(self._map)
+
+    def close(self) -> None:
+        try:
+            self._map.close()
+        except BufferError:
+            # a view is still alive, for instance in the traceback of an
+            # error; the map is closed when the last view is freed
+            pass
+
+    def __enter__(self) -> "MappedWav":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
@@ -0,0 +1,223 @@
+"""
+Runs items through a chain of stages, each with its own worker threads,
+connected by bounded queues, so that while one item is in a later stage the
+next ones are already in the earlier stages.
+
+A stage whose output queue is full waits, so a slow stage holds back those
+before it instead of letting work pile up in memory. The time every stage
+spends working, waiting for input and waiting for room downstream is
+measured, which shows the stage that sets the pace: the bottleneck.
+"""
+import contextvars
+import queue
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+# tells a stage that no item follows
+_DONE = object()
+
+
+class StageStats:
+    """The measurements of one stage of a StagePipeline."""
+
+    def __init__(self, name: str, workers: int):
+        self.name = name
+        self.workers = workers
+        self.items = 0
+        self.failed = 0
+        # the seconds its workers spent working, waiting for an item and
+        # waiting for room in the next queue, summed over the workers
+        self.busy_seconds = 0.0
+        self.idle_seconds = 0.0
+        self.blocked_seconds = 0.0
+
+
+class StagePipeline:
+    """
+    Passes every item put in it through each stage in turn. Each stage is
+    a function of the result of the previous one, run by its own workers.
+    An item that fails in a stage skips the next ones and comes out with
+    its exception.
+    """
+
+    def __init__(self, stages: Sequence[Tuple[str, Callable[[Any], Any],
+                                              int]],
+                 queue_size: int = 2):
+        """
+        Args:
+            stages (Sequence[Tuple[str, Callable[[Any], Any], int]]): The
+                name, function and number of workers of each stage.
+            queue_size (int): The largest number of items waiting for each
+                stage.
+
+        Raises:
+            ValueError: If there is no stage, a stage has no worker or
+                queue_size is not a positive integer.
+        """
+        if not stages:
+            raise ValueError("'stages' must not be empty.")
+        if any(workers <= 0 for _, _, workers in stages):
+            raise ValueError("Every stage must have a positive number of "
+                             "workers.")
+        if queue_size <= 0:
+            raise ValueError("'queue_size' must be a positive integer.")
+        self.stats = [StageStats(name, workers) for name, _, workers in stages]
+        self._lock = threading.Lock()
+        # the queue before each stage, and the unbounded queue of results
+        self._queues: List[queue.Queue] = (
+            [queue.Queue(queue_size) for _ in stages] + [queue.Queue()])
+        self._running = [workers for _, _, workers in stages]
+        self._next_index = 0
+        self._closed = False
+        self._done = False
+        self._started = time.perf_counter()
+        self._ended: Optional[float] = None
+        self._threads = []
+        for i, (name, fn, workers) in enumerate(stages):
+            for n in range(workers):
+                # each worker runs in a copy of the caller's context, so
+                # that its spans are added to the caller's metrics run
+                thread = threading.Thread(
+                    target=contextvars.copy_context().run,
+                    args=(self._work, i, fn), daemon=True,
+                    name=f"{name}-{n}")
+                thread.start()
+                self._threads.append(thread)
+
+    def put(self, item: Any, timeout: float = None) -> int:
+        """
+        Adds an item, waiting while the first stage has queue_size items
+        waiting.
+
+        Args:
+            item (Any): The input of the first stage.
+            timeout (float): The largest number of seconds to wait, 0 not
+                to wait, or None to wait as long as needed.
+
+        Returns:
+            int: The index of the item, counting from 0 in the order the
+            items were put.
+
+        Raises:
+            queue.Full: If the first stage is still full after timeout.
+            ValueError: If the pipeline is closed.
+        """
+        if self._closed:
+            raise ValueError("The pipeline is closed.")
+        index = self._next_index
+        self._queues[0].put((index, item, None), timeout != 0, timeout or None)
+        self._next_index += 1
+        return index
+
+    def close(self) -> None:
+        """Tells the stages that no item follows, once the last is done."""
+        if not self._closed:
+            self._closed = True
+            self._queues[0].put(_DONE)
+
+    def _work(self, stage: int, fn: Callable[[Any], Any]) -> None:
+        inbox, outbox = self._queues[stage], self._queues[stage + 1]
+        stats = self.stats[stage]
+        while True:
+            start = time.perf_counter()
+            item = inbox.get()
+            idle = time.perf_counter() - start
+            if item is _DONE:
+                with self._lock:
+                    stats.idle_seconds += idle
+                    self._running[stage] -= 1
+                    last = self._running[stage] == 0
+                # the last worker of a stage to stop tells the next stage,
+                # the others tell their siblings
+                (outbox if last else inbox).put(_DONE)
+                return
+            index, value, error = item
+            # an item that failed in an earlier stage is only passed on
+            ran = error is None
+            start = time.perf_counter()
+            if ran:
+                try:
+                    value = fn(value)
+                except Exception as e:
+                    error = e
+            busy = time.perf_counter() - start
+            start = time.perf_counter()
+            outbox.put((index, value, error))
+            blocked = time.perf_counter() - start
+            with self._lock:
+                stats.items += ran
+                stats.failed += ran and error is not None
+                stats.busy_seconds += busy
+                stats.idle_seconds += idle
+                stats.blocked_seconds += blocked
+
+    def results(self, timeout: float = 0) -> List[Tuple[int, Any,
+                                                        Optional[Exception]]]:
+        """
+        Takes the items that came out of the last stage since the last call.
+
+        Args:
+            timeout (float): The largest number of seconds to wait for the
+                first one, 0 not to wait, or None to wait as long as needed.
+
+        Returns:
+            List[Tuple[int, Any, Optional[Exception]]]: The index, result
+            and exception, or None, of each item, in the order they
+            finished.
+        """
+        items = []
+        block = timeout != 0
+        while not self._done:
+            try:
+                item = self._queues[-1].get(block, timeout or None)
+            except queue.Empty:
+                break
+            if item is _DONE:
+                self._done = True
+                self._ended = time.perf_counter()
+                break
+            items.append(item)
+            block = False
+        return items
+
+    @property
+    def done(self) -> bool:
+        """Whether every item came out of results() after close()."""
+        return self._done
+
+    def report(self) -> List[Dict[str, Any]]:
+        """
+        Returns:
+            List[Dict[str, Any]]: For each stage, its workers, the items it
+            ran and those that failed in it, its throughput in items per
+            second of the pipeline's run time, and the share of its
+            workers' time spent working, waiting for input and waiting for
+            room downstream.
+        """
+        elapsed = (self._ended or time.perf_counter()) - self._started
+        rows = []
+        with self._lock:
+            for stats in self.stats:
+                total = max(elapsed * stats.workers, 1e-9)
+                rows.append({
+                    "stage": stats.name,
+                    "workers": stats.workers,
+                    "items": stats.items,
+                    "failed": stats.failed,
+                    "items/s": round(stats.items / max(elapsed, 1e-9), 3),
+                    "busy %": round(100 * stats.busy_seconds / total, 1),
+                    "idle %": round(100 * stats.idle_seconds / total, 1),
+                    "blocked %": round(100 * stats.blocked_seconds / total,
+                                       1),
+                })
+        return rows
+
+    def bottleneck(self) -> str:
+        """
+        Returns:
+            str: The name of the stage whose workers were busiest.
+        """
+        with self._lock:
+            return max(self.stats, key=lambda stats: stats.busy_seconds
+                       / stats.workers).name
@@ -0,0 +1,137 @@
+"""
+Measures how long the app takes to start.
+
+Usage, from the speech2speech directory:
+    python startup_benchmark.py --runs 5
+
+It reports, each as the median of several fresh interpreters:
+- the time to import the app module, with its slowest imports,
+- the time for the Streamlit server to answer its health check,
+- the time of a first run of the script, which is the time the server
+  needs before it can send the first page to a browser.
+"""
+import argparse
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+from typing import List, Tuple
+
+_IMPORT_CODE = ("import time; start = time.perf_counter(); "
+                "import speech2speech; "
+                "print(time.perf_counter() - start)")
+
+_SCRIPT_RUN_CODE = ("import runpy, time; start = time.perf_counter(); "
+                    "runpy.run_path('speech2speech.py', run_name='__main__'); "
+                    "print(time.perf_counter() - start)")
+
+
+def time_python(code: str) -> float:
+    """
+    Args:
+        code (str): Python code that prints a duration on its last line.
+
+    Returns:
+        float: The duration printed by the code run in a fresh interpreter.
+    """
+    result = subprocess.run([sys.executable, "-c", code], check=True,
+                            capture_output=True, text=True)
+    return float(result.stdout.strip().splitlines()[-1])
+
+
+def slowest_imports(count: int) -> List[Tuple[float, str]]:
+    """
+    Args:
+        count (int): The number of imports to report.
+
+    Returns:
+        List[Tuple[float, str]]: The cumulative seconds and the name of the
+        slowest top-level packages imported by the app module.
+    """
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c",
+                             "import speech2speech"],
+                            check=True, capture_output=True, text=True)
+    imports = {}
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if name.startswith(" ") and not name.startswith("  "):
+            imports[name.strip()] = int(cumulative) / 1e6
+    return sorted(((seconds, name) for name, seconds in imports.items()),
+                  reverse=True)[:count]
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("localhost", 0))
+        return sock.getsockname()[1]
+
+
+def time_server_ready(timeout: float) -> float:
+    """
+    Starts the app with 'streamlit run' and waits for its health check.
+
+    Args:
+        timeout (float): The maximum number of seconds to wait.
+
+    Returns:
+        float: The seconds until the server answered.
+
+    Raises:
+        TimeoutError: If the server did not answer in time.
+    """
+    port = free_port()
+    start = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "streamlit", "run", "speech2speech.py",
+         "--server.headless", "true", "--server.port", str(port),
+         "--browser.gatherUsageStats", "false"],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while time.perf_counter() - start < timeout:
+            for path in ("/_stcore/health", "/healthz"):
+                try:
+                    with urllib.request.urlopen(
+                            f"http://localhost:{port}{path}", timeout=1):
+                        return time.perf_counter() - start
+                except OSError:
+                    pass
+            time.sleep(0.05)
+        raise TimeoutError("The Streamlit server did not start")
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Measure the import and startup time of the app.")
+    parser.add_argument("--runs", type=int, default=5,
+                        help="the number of fresh interpreters per measure")
+    parser.add_argument("--timeout", type=float, default=60,
+                        help="the maximum seconds to wait for the server")
+    args = parser.parse_args()
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+    import_times = [time_python(_IMPORT_CODE) for _ in range(args.runs)]
+    print(f"Import of the app module: "
+          f"{statistics.median(import_times) * 1000:.0f} ms (median)")
+    for seconds, name in slowest_imports(10):
+        print(f"  {name}: {seconds * 1000:.0f} ms")
+
+    ready_times = [time_server_ready(args.timeout) for _ in range(args.runs)]
+    script_times = [time_python(_SCRIPT_RUN_CODE) for _ in range(args.runs)]
+    ready = statistics.median(ready_times)
+    script = statistics.median(script_times)
+    print(f"Server ready: {ready * 1000:.0f} ms (median)")
+    print(f"First script run: {script * 1000:.0f} ms (median)")
+    print(f"Time to first paint: about {(ready + script) * 1000:.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,202 @@
+"""
+Transcribes and translates a recording while it is still being made.
+
+The live audio is cut into utterances at the speaker's pauses. Each
+utterance goes through the stages of a conversation as soon as it ends, so
+by the time the speaker stops, only the last utterance is still being
+transcribed, translated and synthesized.
+"""
+import queue
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from spool import WavFormat, wav_header
+from stages import StagePipeline
+
+# an utterance with less speech than this is a click or a breath, which
+# speech-to-text models tend to turn into made-up words
+MIN_SPEECH_SECONDS = 0.25
+
+
+class UtteranceSegmenter:
+    """
+    Cuts live 16-bit PCM audio into utterances, one chunk at a time.
+
+    An utterance ends after pause_seconds of silence. One that goes on for
+    max_seconds without such a pause is cut at its last silent chunk, and
+    the rest begins the next utterance.
+    """
+
+    def __init__(self, vad, pause_seconds: float = 0.6,
+                 max_seconds: float = 20.0):
+        """
+        Args:
+            vad (vad.VoiceActivityDetector): The detector telling speech
+                from silence, and giving the rate and channels of the audio.
+                It is not imported here, so that the app starts without
+                numpy.
+            pause_seconds (float): The silence that ends an utterance.
+            max_seconds (float): The longest utterance.
+        """
+        self.vad = vad
+        frame_bytes = 2 * vad.channels
+        self._pause_bytes = int(pause_seconds * vad.rate) * frame_bytes
+        self._max_bytes = int(max_seconds * vad.rate) * frame_bytes
+        self._min_speech_bytes = (int(MIN_SPEECH_SECONDS * vad.rate)
+                                  * frame_bytes)
+        self._fmt = WavFormat(vad.channels, 2, vad.rate)
+        # the chunks of the current utterance and whether they are speech
+        self._chunks: List[Tuple[bytes, bool]] = []
+        self._bytes = 0
+        self._speech_bytes = 0
+        # the silence since the last speech, and the number of chunks up to
+        # the last silent one after speech
+        self._silent_bytes = 0
+        self._last_pause = 0
+
+    def _append(self, chunk: bytes, speech: bool) -> None:
+        self._chunks.append((chunk, speech))
+        self._bytes += len(chunk)
+        if speech:
+            self._speech_bytes += len(chunk)
+            self._silent_bytes = 0
+        elif self._speech_bytes:
+            self._silent_bytes += len(chunk)
+            self._last_pause = len(self._chunks)
+
+    def _cut(self, n: int) -> Optional[bytes]:
+        chunks, rest = self._chunks[:n], self._chunks[n:]
+        speech_bytes = self._speech_bytes
+        self._chunks = []
+        self._bytes = self._speech_bytes = 0
+        self._silent_bytes = self._last_pause = 0
+        for chunk, speech in rest:
+            self._append(chunk, speech)
+        speech_bytes -= self._speech_bytes
+        if speech_bytes < self._min_speech_bytes:
+            return None
+        pcm = b"".join(chunk for chunk, _ in chunks)
+        return wav_header(self._fmt, len(pcm)) + pcm
+
+    def feed(self, chunk: bytes, speech: bool = None) -> Optional[bytes]:
+        """
+        Args:
+            chunk (bytes): The latest chunk from the microphone.
+            speech (bool): Whether the chunk is speech, as told by the
+                detector's is_speech(), or None to find out here.
+
+        Returns:
+            Optional[bytes]: The WAV file of the utterance this chunk ends,
+            or None.
+        """
+        if speech is None:
+            speech = self.vad.is_speech(chunk)
+        self._append(chunk, speech)
+        if not self._speech_bytes:
+            # before speech, only half a pause is kept as a lead-in
+            while len(self._chunks) > 1 and self._bytes \
+                    - len(self._chunks[0][0]) >= self._pause_bytes // 2:
+                self._bytes -= len(self._chunks.pop(0)[0])
+            return None
+        if self._silent_bytes >= self._pause_bytes:
+            return self._cut(len(self._chunks))
+        if self._bytes >= self._max_bytes:
+            # a pause in the first half would leave a long rest
+            if self._last_pause * 2 >= len(self._chunks):
+                return self._cut(self._last_pause)
+            return self._cut(len(self._chunks))
+        return None
+
+    def flush(self) -> Optional[bytes]:
+        """
+        Returns:
+            Optional[bytes]: The WAV file of the utterance under way when
+            the recording stops, or None.
+        """
+        return self._cut(len(self._chunks))
+
+
+class LiveSession:
+    """
+    Puts every utterance of a recording into a stages.StagePipeline, in
+    order, and gathers the results of the finished ones in the order of the
+    utterances, so that a later utterance is transcribed while an earlier
+    one is translated or synthesized.
+
+    An utterance that fails in a stage is not dropped: it comes out with
+    its exception and what the stages before made of it, so that the caller
+    can show that it failed.
+
+    Nothing here runs on its own: poll() is called regularly by the thread
+    that shows the results.
+    """
+
+    def __init__(self, pipeline: StagePipeline):
+        """
+        Args:
+            pipeline (StagePipeline): The stages an utterance goes through,
+                the first taking its WAV file.
+        """
+        self.pipeline = pipeline
+        self._waiting: Deque[bytes] = deque()
+        # the result and exception, or None, of each finished utterance by
+        # index
+        self._results: Dict[int, Tuple[Any, Optional[Exception]]] = {}
+        self.submitted = 0
+        # the number of results the caller has shown already
+        self.shown = 0
+        # whether the recording has ended and every utterance was received
+        self.ended = False
+
+    def poll(self, utterances: queue.Queue) -> None:
+        """
+        Takes the utterances cut since the last call and puts them into the
+        pipeline, and collects the results that came out of it. If the
+        first stage is full, the utterances are put on a later call, and
+        the recording goes on meanwhile.
+
+        Args:
+            utterances (queue.Queue): The WAV files of the utterances, and
+                None after the last one.
+        """
+        while True:
+            try:
+                utterance = utterances.get_nowait()
+            except queue.Empty:
+                break
+            if utterance is None:
+                self.ended = True
+            else:
+                self._waiting.append(utterance)
+        while self._waiting:
+            try:
+                self.pipeline.put(self._waiting[0], timeout=0)
+            except queue.Full:
+                break
+            self._waiting.popleft()
+            self.submitted += 1
+        if self.ended and not self._waiting:
+            self.pipeline.close()
+        for index, result, error in self.pipeline.results():
+            if error is not None:
+                print(f"Error processing utterance {index + 1}: {error}")
+            self._results[index] = (result, error)
+
+    @property
+    def finished(self) -> bool:
+        return self.pipeline.done
+
+    def results(self) -> List[Tuple[Any, Optional[Exception]]]:
+        """
+        Returns:
+            List[Tuple[Any, Optional[Exception]]]: The result and exception,
+            or None, of each utterance finished so far, up to the first one
+            still under way. The result of a failed utterance is the input
+            of the stage it failed in.
+        """
+        results = []
+        index = 0
+        while index in self._results:
+            results.append(self._results[index])
+            index += 1
+        return results
@@ -0,0 +1,206 @@
+from collections import deque
+from typing import Deque, Optional, Tuple
+
+import numpy as np
+
+
+class VoiceActivityDetector:
+    """
+    Tells speech from silence in 16-bit PCM audio using the energy and the
+    zero-crossing rate of short frames.
+
+    A frame is speech if it is louder than energy_threshold_db, or if it is
+    up to 10 dB quieter but crosses zero often, as fricatives such as "s"
+    and "f" do. All frames of a buffer are analysed at once with NumPy.
+    """
+
+    def __init__(self, rate: int, channels: int,
+                 energy_threshold_db: float = -40.0,
+                 zcr_threshold: float = 0.25,
+                 silence_seconds: float = None,
+                 max_silence_seconds: float = 0.5,
+                 frame_ms: int = 30):
+        """
+        Args:
+            rate (int): The sample rate in Hz.
+            channels (int): The number of interleaved channels.
+            energy_threshold_db (float): The level, in dBFS, above which a
+                frame is speech.
+            zcr_threshold (float): The zero-crossing rate above which a
+                quieter frame is still speech.
+            silence_seconds (float): The silence after speech that ends the
+                recording. None disables auto-stop.
+            max_silence_seconds (float): The longest silence kept by trim().
+                0 disables trimming.
+            frame_ms (int): The length of an analysis frame in milliseconds.
+        """
+        self.rate = rate
+        self.channels = channels
+        self.energy_threshold_db = energy_threshold_db
+        self.zcr_threshold = zcr_threshold
+        self.silence_seconds = silence_seconds
+        self.max_silence_seconds = max_silence_seconds
+        self.frame_length = max(1, rate * frame_ms // 1000)
+        self.heard_speech = False
+        self.silent_for = 0.0
+        # the state of trim_stream(): the silent chunks held back in case
+        # speech follows, and the bytes of silence kept since the last
+        # speech, None before any speech
+        self._held: Deque[bytes] = deque()
+        self._held_bytes = 0
+        self._kept_silence: Optional[int] = None
+
+    def _samples(self, data: bytes) -> np.ndarray:
+        samples = np.frombuffer(data, dtype=np.int16)
+        samples = samples[:len(samples) - len(samples) % self.channels]
+        return samples.reshape(-1, self.channels)
+
+    def frame_features(self, mono: np.ndarray) -> Tuple[np.ndarray,
+                                                        np.ndarray]:
+        """
+        Args:
+            mono (np.ndarray): The mono samples to analyse.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: The level in dBFS and the
+            zero-crossing rate of each frame.
+        """
+        n_frames = len(mono) // self.frame_length
+        frames = mono[:n_frames * self.frame_length].reshape(
+            n_frames, self.frame_length).astype(np.float32)
+        rms = np.sqrt(np.mean(frames ** 2, axis=1))
+        db = 20 * np.log10(np.maximum(rms, 1e-9) / 32768.0)
+        signs = np.signbit(frames)
+        zcr = np.mean(signs[:, 1:] != signs[:, :-1], axis=1)
+        return db, zcr
+
+    def speech_mask(self, data: bytes) -> np.ndarray:
+        """
+        Args:
+            data (bytes): Interleaved 16-bit PCM audio.
+
+        Returns:
+            np.ndarray: A boolean per frame, True where the frame is speech.
+        """
+        mono = self._samples(data).mean(axis=1)
+        if len(mono) < self.frame_length:
+            mono = np.pad(mono, (0, self.frame_length - len(mono)))
+        db, zcr = self.frame_features(mono)
+        return ((db > self.energy_threshold_db)
+                | ((db > self.energy_threshold_db - 10)
+                   & (zcr > self.zcr_threshold)))
+
+    def is_speech(self, chunk: bytes) -> bool:
+        """
+        Args:
+            chunk (bytes): A chunk of interleaved 16-bit PCM audio.
+
+        Returns:
+            bool: Whether any frame of the chunk is speech.
+        """
+        return bool(self.speech_mask(chunk).any())
+
+    def feed(self, chunk: bytes, speech: bool = None) -> bool:
+        """
+        Updates the silence timer with a chunk of live audio.
+
+        Args:
+            chunk (bytes): The latest chunk from the microphone.
+            speech (bool): Whether the chunk is speech, as told by
+                is_speech(), or None to find out here.
+
+        Returns:
+            bool: True once silence_seconds of silence followed speech.
+        """
+        if self.silence_seconds is None:
+            return False
+        if speech is None:
+            speech = self.is_speech(chunk)
+        if speech:
+            self.heard_speech = True
+            self.silent_for = 0.0
+        elif self.heard_speech:
+            frame_bytes = 2 * self.channels
+            self.silent_for += len(chunk) / frame_bytes / self.rate
+        return self.heard_speech and self.silent_for >= self.silence_seconds
+
+    def trim(self, data: bytes) -> bytes:
+        """
+        Shortens every silence longer than max_silence_seconds to that
+        length, keeping half of it on each side of the speech around it.
+
+        Args:
+            data (bytes): Interleaved 16-bit PCM audio.
+
+        Returns:
+            bytes: The audio without its long silences.
+        """
+        if not self.max_silence_seconds:
+            return data
+        samples = self._samples(data)
+        mask = self.speech_mask(data)
+        n_frames = len(samples) // self.frame_length
+        if n_frames == 0 or not mask.any():
+            return data
+        mask = mask[:n_frames]
+        keep_frames = max(1, int(self.max_silence_seconds * self.rate
+                                 / self.frame_length))
+        head = keep_frames // 2
+        tail = keep_frames - head
+
+        # run-length encode the mask into runs of speech and silence
+        edges = np.flatnonzero(np.diff(mask.astype(np.int8))) + 1
+        starts = np.concatenate(([0], edges))
+        ends = np.concatenate((edges, [n_frames]))
+        keep = np.ones(n_frames, dtype=bool)
+        for start, end in zip(starts[~mask[starts]], ends[~mask[starts]]):
+            lead = tail if start > 0 else 0
+            trail = head if end < n_frames else 0
+            if end - start > lead + trail:
+                keep[start + lead:end - trail] = False
+
+        keep = np.repeat(keep, self.frame_length)
+        keep = np.concatenate(
+            (keep, np.ones(len(samples) - len(keep), dtype=bool)))
+        return samples[keep].tobytes()
+
+    def trim_stream(self, chunk: bytes, speech: bool = None) -> bytes:
+        """
+        Trims live audio one chunk at a time like trim(), with chunks
+        instead of frames as the unit, so that the recording can be written
+        as it comes without ever being held in memory. Unlike trim(), it
+        drops the silence of a recording without speech.
+
+        Args:
+            chunk (bytes): The latest chunk from the microphone.
+            speech (bool): Whether the chunk is speech, as told by
+                is_speech(), or None to find out here.
+
+        Returns:
+            bytes: The audio to keep now, which may be empty, or include
+            silence held back from earlier chunks.
+        """
+        if not self.max_silence_seconds:
+            return chunk
+        frame_bytes = 2 * self.channels
+        keep_bytes = int(self.max_silence_seconds * self.rate) * frame_bytes
+        head = keep_bytes // 2
+        tail = keep_bytes - head
+        if speech is None:
+            speech = self.is_speech(chunk)
+        if speech:
+            # the end of the silence before the speech is kept
+            kept = b"".join(self._held) + chunk
+            self._held.clear()
+            self._held_bytes = 0
+            self._kept_silence = 0
+            return kept
+        if self._kept_silence is not None and self._kept_silence < tail:
+            # the start of the silence after the speech is kept
+            self._kept_silence += len(chunk)
+            return chunk
+        self._held.append(chunk)
+        self._held_bytes += len(chunk)
+        while self._held and self._held_bytes - len(self._held[0]) >= head:
+            self._held_bytes -= len(self._held.popleft())
+        return b""
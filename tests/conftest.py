@@ -0,0 +1,7 @@
+import os
+import sys
+
+# the modules of the package import each other by their plain names, as
+# they do when the app is run from its directory
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), "speech2speech"))
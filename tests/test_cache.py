@@ -0,0 +1,54 @@
+import time
+
+from cache import DiskCache, make_key, normalize_text
+
+
+def test_make_key_is_stable_and_hex():
+    key = make_key("hello", b"world")
+    assert key == make_key("hello", b"world")
+    assert len(key) == 64
+    int(key, 16)
+
+
+def test_make_key_keeps_the_parts_apart():
+    assert make_key("ab", "c") != make_key("a", "bc")
+    assert make_key("a") != make_key("a", "")
+
+
+def test_make_key_hashes_str_as_utf8():
+    assert make_key("é") == make_key("é".encode("utf-8"))
+
+
+def test_normalize_text():
+    assert normalize_text("  Hello \n  world\t") == "Hello world"
+    # the decomposed and composed forms of é share a key
+    assert normalize_text("e\u0301") == normalize_text("\u00e9")
+
+
+def test_disk_cache_round_trip(tmp_path):
+    cache = DiskCache(str(tmp_path / "cache.sqlite"), 1000)
+    assert cache.get("key") is None
+    cache.set("key", b"value")
+    assert cache.get("key") == b"value"
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_disk_cache_evicts_least_recently_used(tmp_path):
+    cache = DiskCache(str(tmp_path / "cache.sqlite"), 10)
+    cache.set("a", b"12345")
+    time.sleep(0.01)
+    cache.set("b", b"12345")
+    time.sleep(0.01)
+    cache.get("a")
+    time.sleep(0.01)
+    cache.set("c", b"12345")
+    assert cache.get("b") is None
+    assert cache.get("a") == b"12345"
+    assert cache.get("c") == b"12345"
+
+
+def test_disk_cache_expires_entries(tmp_path):
+    cache = DiskCache(str(tmp_path / "cache.sqlite"), 1000, ttl=0.01)
+    cache.set("key", b"value")
+    time.sleep(0.02)
+    assert cache.get("key") is None
@@ -0,0 +1,78 @@
+import numpy as np
+
+from chunker import (chunk_bounds, chunk_wav, merge_overlap,
+                     merge_transcripts)
+from spool import WavFormat, parse_wav, wav_header
+
+RATE = 16000
+
+
+def make_wav(samples: np.ndarray, rate: int = RATE) -> bytes:
+    pcm = samples.astype("<i2").tobytes()
+    return wav_header(WavFormat(1, 2, rate), len(pcm)) + pcm
+
+
+def tone(seconds: float) -> np.ndarray:
+    t = np.arange(int(seconds * RATE)) / RATE
+    return 8000 * np.sin(2 * np.pi * 220 * t)
+
+
+def test_merge_overlap_drops_repeated_words():
+    assert merge_overlap("the quick brown fox", "brown fox jumps over") \
+        == "the quick brown fox jumps over"
+
+
+def test_merge_overlap_ignores_case_and_punctuation():
+    assert merge_overlap("It was late.", "late, so we left") \
+        == "It was late. so we left"
+
+
+def test_merge_overlap_without_overlap():
+    assert merge_overlap("hello there", "general kenobi") \
+        == "hello there general kenobi"
+
+
+def test_merge_overlap_with_empty_sides():
+    assert merge_overlap("", "hello") == "hello"
+    assert merge_overlap("hello", "") == "hello"
+    assert merge_overlap("hello", "hello") == "hello"
+
+
+def test_merge_overlap_looks_at_most_max_overlap_words():
+    assert merge_overlap("a b c", "a b c d", max_overlap_words=2) \
+        == "a b c a b c d"
+
+
+def test_merge_transcripts():
+    assert merge_transcripts(["one two three", "three four five",
+                              "five six"]) == "one two three four five six"
+
+
+def test_short_recording_is_one_chunk():
+    audio = make_wav(tone(2))
+    assert chunk_bounds(audio, 10, 1) == [(0, 2 * RATE)]
+
+
+def test_long_recording_is_cut_in_its_pause():
+    # 7 s of speech, 1 s of silence, then 7 s of speech
+    samples = np.concatenate((tone(7), np.zeros(RATE), tone(7)))
+    bounds = chunk_bounds(make_wav(samples), 10, 0)
+    assert len(bounds) == 2
+    assert bounds[0][0] == 0 and bounds[-1][1] == len(samples)
+    assert 7 * RATE <= bounds[0][1] <= 8 * RATE
+    assert bounds[0][1] == bounds[1][0]
+
+
+def test_chunks_overlap_their_neighbours():
+    samples = np.concatenate((tone(7), np.zeros(RATE), tone(7)))
+    (_, first_end), (second_start, _) = chunk_bounds(make_wav(samples), 10,
+                                                     0.5)
+    assert first_end - second_start == RATE
+
+
+def test_chunk_wav_is_a_wav_file_of_the_chunk():
+    samples = tone(2)
+    chunk = chunk_wav(make_wav(samples), RATE // 2, RATE)
+    fmt, pcm = parse_wav(chunk)
+    assert fmt == WavFormat(1, 2, RATE)
+    assert bytes(pcm) == samples.astype("<i2")[RATE // 2:RATE].tobytes()
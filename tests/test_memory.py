@@ -0,0 +1,64 @@
+import pytest
+
+from memory import TranslationMemory, substitute_numbers, template
+
+
+@pytest.fixture
+def memory(tmp_path):
+    return TranslationMemory(str(tmp_path / "memory.sqlite"), 100)
+
+
+def test_template_replaces_numbers_and_punctuation():
+    assert template("I have 3 cats, and 1,200 dogs.") \
+        == ("I have 0 cats and 0 dogs", ["3", "1,200"])
+
+
+def test_template_keeps_case_and_questions():
+    assert template("Send it to the US.")[0] \
+        != template("Send it to the us.")[0]
+    assert template("Really?")[0] != template("Really.")[0]
+
+
+def test_substitute_numbers():
+    assert substitute_numbers("J'ai 3 chats.", ["3"], ["5"]) \
+        == "J'ai 5 chats."
+    # a number that is not found exactly once cannot be replaced
+    assert substitute_numbers("3 et 3", ["3"], ["5"]) is None
+    assert substitute_numbers("J'ai trois chats.", ["3"], ["5"]) is None
+
+
+def test_lookup_exact_with_other_numbers(memory):
+    memory.add([("I have 3 cats.", "J'ai 3 chats.")], "fr", "stub")
+    match = memory.lookup("I have 5 cats", "fr", "stub")
+    assert match.exact
+    assert match.translation == "J'ai 5 chats."
+
+
+def test_lookup_by_language_and_translator(memory):
+    memory.add([("Good morning.", "Bonjour.")], "fr", "stub")
+    assert memory.lookup("Good morning.", "de", "stub") is None
+    assert memory.lookup("Good morning.", "fr", "other") is None
+
+
+def test_other_case_is_only_a_near_match(memory):
+    memory.add([("Send it to the US.", "Envoyez-le aux États-Unis.")], "fr",
+               "stub")
+    match = memory.lookup("Send it to the us.", "fr", "stub")
+    assert match is not None and not match.exact
+
+
+def test_similar_sentence_is_a_near_match(memory):
+    memory.add([("Alice went to the market today.",
+                 "Alice est allée au marché aujourd'hui.")], "fr", "stub")
+    match = memory.lookup("Alice went to the station today.", "fr", "stub")
+    assert match is not None and not match.exact
+    assert match.similarity >= memory.threshold
+    assert memory.lookup("Completely unrelated words here.", "fr",
+                         "stub") is None
+
+
+def test_memory_forgets_least_recently_used(tmp_path):
+    memory = TranslationMemory(str(tmp_path / "memory.sqlite"), 2)
+    memory.add([("One.", "Un."), ("Two.", "Deux."), ("Three.", "Trois.")],
+               "fr", "stub")
+    assert memory.stats()["sentences"] <= 2
@@ -0,0 +1,163 @@
+import threading
+import time
+
+import pytest
+
+import scheduler
+from scheduler import RateLimiter, RequestScheduler, retry_status
+
+
+class HTTPError(Exception):
+
+    def __init__(self, status, headers=None):
+        super().__init__(f"status {status}")
+        self.http_status = status
+        self.headers = headers or {}
+
+
+def wait_for(predicate, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.001)
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    # the retries wait without sleeping, and the waits are recorded
+    waits = []
+    monkeypatch.setattr(scheduler.time, "sleep", waits.append)
+    monkeypatch.setattr(scheduler.random, "uniform", lambda a, b: b)
+    return waits
+
+
+def test_retry_status():
+    assert retry_status(HTTPError(429)) == 429
+    assert retry_status(HTTPError(503)) == 503
+    assert retry_status(HTTPError(400)) is None
+    assert retry_status(ValueError()) is None
+
+
+def test_identical_requests_in_flight_are_sent_once():
+    scheduler = RequestScheduler(RateLimiter(0))
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def send(value):
+        calls.append(value)
+        started.set()
+        release.wait(5)
+        return value * 2
+
+    results = []
+    leader = threading.Thread(
+        target=lambda: results.append(scheduler.call("key", send, 21)))
+    leader.start()
+    started.wait(5)
+    follower = threading.Thread(
+        target=lambda: results.append(scheduler.call("key", send, 21)))
+    follower.start()
+    wait_for(lambda: scheduler.coalesced == 1)
+    release.set()
+    leader.join(5)
+    follower.join(5)
+    assert calls == [21]
+    assert results == [42, 42]
+
+
+def test_followers_get_the_error_of_the_request():
+    scheduler = RequestScheduler(RateLimiter(0))
+    started = threading.Event()
+    release = threading.Event()
+
+    def send():
+        started.set()
+        release.wait(5)
+        raise ValueError("refused")
+
+    errors = []
+
+    def call():
+        try:
+            scheduler.call("key", send)
+        except ValueError as e:
+            errors.append(e)
+
+    leader = threading.Thread(target=call)
+    leader.start()
+    started.wait(5)
+    follower = threading.Thread(target=call)
+    follower.start()
+    wait_for(lambda: scheduler.coalesced == 1)
+    release.set()
+    leader.join(5)
+    follower.join(5)
+    assert len(errors) == 2 and errors[0] is errors[1]
+
+
+def test_different_keys_are_sent_separately():
+    scheduler = RequestScheduler(RateLimiter(0))
+    calls = []
+    scheduler.call("a", calls.append, 1)
+    scheduler.call("b", calls.append, 2)
+    scheduler.call("a", calls.append, 3)
+    assert calls == [1, 2, 3]
+    assert scheduler.coalesced == 0
+
+
+def test_throttled_request_is_retried_with_backoff(sleeps):
+    scheduler = RequestScheduler(RateLimiter(0), max_retries=5,
+                                 backoff_seconds=1, max_backoff_seconds=3)
+    failures = [HTTPError(429), HTTPError(502), HTTPError(503)]
+
+    def send():
+        if failures:
+            raise failures.pop(0)
+        return "ok"
+
+    assert scheduler.call("key", send) == "ok"
+    # the longest waits double, up to max_backoff_seconds
+    assert sleeps == [1, 2, 3]
+    assert scheduler.retries == 3
+
+
+def test_retry_after_is_honoured(sleeps):
+    scheduler = RequestScheduler(RateLimiter(0), backoff_seconds=1)
+    failures = [HTTPError(429, {"Retry-After": "7"})]
+
+    def send():
+        if failures:
+            raise failures.pop(0)
+        return "ok"
+
+    assert scheduler.call("key", send) == "ok"
+    assert sleeps == [7]
+
+
+def test_retries_are_limited(sleeps):
+    scheduler = RequestScheduler(RateLimiter(0), max_retries=2)
+    calls = []
+
+    def send():
+        calls.append(None)
+        raise HTTPError(500)
+
+    with pytest.raises(HTTPError):
+        scheduler.call("key", send)
+    assert len(calls) == 3
+    assert len(sleeps) == 2
+
+
+def test_other_errors_are_not_retried(sleeps):
+    scheduler = RequestScheduler(RateLimiter(0))
+    calls = []
+
+    def send():
+        calls.append(None)
+        raise HTTPError(400)
+
+    with pytest.raises(HTTPError):
+        scheduler.call("key", send)
+    assert len(calls) == 1
+    assert sleeps == []
@@ -0,0 +1,85 @@
+import io
+import wave
+
+import pytest
+
+from spool import MappedWav, WavFormat, WavSpool, parse_wav, wav_header
+
+FMT = WavFormat(channels=2, sample_width=2, rate=8000)
+
+
+def test_wav_header_is_read_by_the_wave_module():
+    pcm = bytes(range(8)) * 10
+    with wave.open(io.BytesIO(wav_header(FMT, len(pcm)) + pcm)) as wf:
+        assert (wf.getnchannels(), wf.getsampwidth(), wf.getframerate()) \
+            == FMT
+        assert wf.readframes(wf.getnframes()) == pcm
+
+
+def test_parse_wav_reads_the_wave_module():
+    fp = io.BytesIO()
+    with wave.open(fp, "wb") as wf:
+        wf.setnchannels(1)
+        wf.setsampwidth(2)
+        wf.setframerate(16000)
+        wf.writeframes(b"\x01\x02" * 5)
+    fmt, pcm = parse_wav(fp.getvalue())
+    assert fmt == WavFormat(1, 2, 16000)
+    assert bytes(pcm) == b"\x01\x02" * 5
+
+
+def test_parse_wav_refuses_other_files():
+    with pytest.raises(ValueError):
+        parse_wav(b"ID3 not a wav file")
+    with pytest.raises(ValueError):
+        parse_wav(b"RIFF\x04\x00\x00\x00WAVE")
+
+
+def test_spool_writes_a_wav_file(tmp_path):
+    filename = str(tmp_path / "recording.wav")
+    with WavSpool(filename, FMT) as spool:
+        spool.write(b"\x00\x01" * 8000)
+        spool.write(b"\x02\x03" * 8000)
+    assert spool.seconds == 1.0
+    with MappedWav(filename) as wav, wav.view() as view:
+        fmt, pcm = parse_wav(view)
+        assert fmt == FMT
+        assert bytes(pcm) == b"\x00\x01" * 8000 + b"\x02\x03" * 8000
+        pcm.release()
+        assert wav.nframes == 8000
+        assert wav.seconds == 1.0
+
+
+def test_spool_is_only_renamed_when_closed(tmp_path):
+    filename = tmp_path / "recording.wav"
+    spool = WavSpool(str(filename), FMT)
+    spool.write(bytes(16))
+    assert not filename.exists()
+    spool.close()
+    assert filename.exists()
+    assert not (tmp_path / "recording.wav.tmp").exists()
+
+
+def test_unfinished_spool_is_read_to_its_end(tmp_path):
+    filename = str(tmp_path / "recording.wav")
+    spool = WavSpool(filename, FMT)
+    # a partly written sample frame at the end is dropped
+    spool.write(bytes(4 * 10 + 3))
+    spool._file.flush()
+    with open(f"{filename}.tmp", "rb") as f:
+        fmt, pcm = parse_wav(f.read())
+    assert fmt == FMT
+    assert len(pcm) == 4 * 10
+    spool.discard()
+
+
+def test_discard_keeps_the_previous_recording(tmp_path):
+    filename = tmp_path / "recording.wav"
+    with WavSpool(str(filename), FMT) as spool:
+        spool.write(bytes(16))
+    previous = filename.read_bytes()
+    spool = WavSpool(str(filename), FMT)
+    spool.write(bytes(64))
+    spool.discard()
+    assert filename.read_bytes() == previous
+    assert not (tmp_path / "recording.wav.tmp").exists()
@@ -0,0 +1,75 @@
+import pytest
+
+from stages import StagePipeline
+
+
+def collect(pipeline, timeout=5):
+    # the results of every item, by index, once the pipeline is done
+    results = {}
+    while not pipeline.done:
+        for index, value, error in pipeline.results(timeout):
+            results[index] = (value, error)
+    return results
+
+
+def test_items_pass_through_every_stage():
+    pipeline = StagePipeline([("double", lambda x: 2 * x, 2),
+                              ("increment", lambda x: x + 1, 1)])
+    for item in range(5):
+        pipeline.put(item)
+    pipeline.close()
+    assert collect(pipeline) == {i: (2 * i + 1, None) for i in range(5)}
+
+
+def test_failed_item_skips_the_next_stages():
+    def check(x):
+        if x == 2:
+            raise ValueError("two")
+        return x
+
+    later = []
+    pipeline = StagePipeline([("check", check, 1),
+                              ("record", lambda x: later.append(x) or x, 1)])
+    for item in range(4):
+        pipeline.put(item)
+    pipeline.close()
+    results = collect(pipeline)
+    value, error = results[2]
+    # the failed item carries the input of the stage it failed in
+    assert value == 2 and isinstance(error, ValueError)
+    assert sorted(later) == [0, 1, 3]
+    assert pipeline.report()[0]["failed"] == 1
+    assert pipeline.report()[1]["items"] == 3
+
+
+def test_close_stops_every_worker():
+    pipeline = StagePipeline([("a", lambda x: x, 3), ("b", lambda x: x, 2)])
+    pipeline.put(1)
+    pipeline.close()
+    collect(pipeline)
+    assert pipeline.done
+    for thread in pipeline._threads:
+        thread.join(5)
+        assert not thread.is_alive()
+
+
+def test_close_without_items():
+    pipeline = StagePipeline([("a", lambda x: x, 2)])
+    pipeline.close()
+    assert collect(pipeline) == {}
+
+
+def test_put_after_close_is_refused():
+    pipeline = StagePipeline([("a", lambda x: x, 1)])
+    pipeline.close()
+    with pytest.raises(ValueError):
+        pipeline.put(1)
+
+
+def test_invalid_stages_are_refused():
+    with pytest.raises(ValueError):
+        StagePipeline([])
+    with pytest.raises(ValueError):
+        StagePipeline([("a", lambda x: x, 0)])
+    with pytest.raises(ValueError):
+        StagePipeline([("a", lambda x: x, 1)], queue_size=0)